@@ -1,64 +1,24 @@
 import argparse
 from pathlib import Path
 from glob import glob
-import json
-from statistics import mode, mean
+from statistics import mean
 from operator import itemgetter
-import ctypes
 
-from litepuf.evaluation import steadiness, uniqueness, randomness, graycode
+import numpy as np
+
+from litepuf.evaluation import evaluate
+from litepuf.store import iter_json_stores
+from litepuf.cache import ResponseCache, memoize_cached, open_cached
 
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 
 
-def _response_post(response):
-    """Return the post-processed response."""
-    # response = ctypes.c_bool(response).value
+def _response_post(responses):
+    """Return the post-processed responses."""
     # workaround, the ROPUF sampler return counter values instead of boolean
-    response = ctypes.c_int16(response).value > 0
-    return response
-
-def response_gen(dump_iter, offset_attr, offset=None):        
-    for chip_dump in dump_iter:
-        chip = dict()
-        for c, responses in chip_dump.items():
-            if offset_attr is not None:
-                responses = filter(lambda r: offset_attr in r and r[offset_attr] == offset, responses)
-            else:
-                # remove all values with additional offset attribute(s)
-                responses = filter(lambda r: r.keys() <= {"value"}, responses)
-            responses = [_response_post(r['value']) for r in responses]
-            chip[c] = responses
-        yield chip
-
-def _reference(chip):
-    return {c: mode(responses) for c, responses in chip.items()}
-
-def parse_dumps(response_dumps, offset_attr, offset=None):
-    chips = list(response_gen(response_dumps, offset_attr, offset))
-
-    uniqueness_ = uniqueness(chips)
-
-    steadiness_per_chip = []
-    for chip_idx, chip in enumerate(chips):
-        if args.ref:
-            references = references_per_chip[chip_idx]
-        else:
-            references = _reference(chip)
-
-        steadiness_ = list(steadiness(chip, references))
-        steadiness_chip = mean(steadiness_)
-        steadiness_per_chip.append(steadiness_chip)
-
-    randomness_ = randomness(chips)
-    print('Randomness:', randomness_)
-
-    return (
-        uniqueness_,
-        steadiness_per_chip,
-    )
+    return responses.astype(np.int16) > 0
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -66,6 +26,10 @@ if __name__ == "__main__":
     parser.add_argument('--offset-key', default=None)
     parser.add_argument('--export-path', default=None, help='export path of plot figure')
     parser.add_argument('--yerr', action='store_true', default=False)
+    parser.add_argument('--export-hd', default=None, help='export path of the pairwise inter-chip distance matrices (.npz)')
+    parser.add_argument('--stream', action='store_true', help='parse JSON dumps one chip at a time to bound memory')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the cache of parsed dumps and results')
+    parser.add_argument('--cache-dir', default=None, help='cache directory (default: ~/.cache/litepuf)')
     parser.add_argument('dump_files', nargs='*')
 
     args = parser.parse_args()
@@ -87,30 +51,30 @@ if __name__ == "__main__":
         dump_files += glob(arg)
     print(dump_files)
 
-    response_dumps = []
-    for filename in dump_files:
-        with open(filename, 'r') as f:
-            response_data = json.load(f)
-        response_dumps.append(response_data['dump'])
+    cache = None if args.no_cache else ResponseCache(args.cache_dir)
+    if args.stream:
+        stores = iter_json_stores(dump_files)
+    else:
+        stores = [open_cached(cache, dump_files)]
 
     offset_attr = args.offset_key
-    if offset_attr:
-        offsets = [r[offset_attr] for r in list(response_dumps[0].values())[0] if offset_attr in r]
-        offsets = list(dict.fromkeys(offsets)) # remove duplicates and keep order (Python > 3.6) 
-    else:
-        offsets = [None,]
 
     steadiness_plot_data = []
     steadiness_err_data  = []
     uniqueness_plot_data = []
-
-    if args.ref:
-        ref_offset = args.ref
-        chips = response_gen(response_dumps, offset_attr, ref_offset)
-        references_per_chip = [_reference(chip) for chip in chips]
-    for offset in offsets:
-        uniqueness_, steadiness_per_chip = parse_dumps(response_dumps, offset_attr, offset)
+    distance_data = []
+
+    # responses are grouped by offset in a single pass
+    def _evaluate():
+        return evaluate(stores, offset_attr, views=[(_response_post, 1)], ref_offset=args.ref)
+    idents, results = memoize_cached(cache, _evaluate, dump_files, 'ropuf', offset_attr, args.ref)
+    offsets = list(results)
+    for offset, (metrics,) in results.items():
+        print('Randomness:', metrics.randomness)
+        uniqueness_ = metrics.uniqueness
+        steadiness_per_chip = metrics.steadiness
         uniqueness_plot_data.append(uniqueness_)
+        distance_data.append(metrics.distances)
         # plot steadiness for one chip
         steadiness_mean = mean(steadiness_per_chip)
         steadiness_plot_data.append(steadiness_mean)
@@ -119,6 +83,12 @@ if __name__ == "__main__":
         print('Uniqueness:', uniqueness_)
         print('Steadiness:', steadiness_mean, steadiness_per_chip)
 
+    if args.export_hd:
+        np.savez(args.export_hd,
+            offsets=np.array([np.nan if offset is None else offset for offset in offsets]),
+            idents=np.array(idents),
+            distances=np.stack(distance_data))
+
     fig, (ax_uniqueness, ax_steadiness) = plt.subplots(2)
     if args.offset_key == 'voltage':
         fig, ax_steadiness = plt.subplots()
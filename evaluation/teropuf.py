@@ -1,49 +1,51 @@
 import argparse
 from pathlib import Path
 from glob import glob
-import json
-from statistics import mode, mean
+from statistics import mean
 from operator import itemgetter
-import ctypes
+from functools import partial
 from cycler import cycler
 
-from litepuf.evaluation import steadiness, uniqueness, randomness, graycode
+import numpy as np
+
+from litepuf.evaluation import evaluate, extract_bits, graycode
+from litepuf.store import iter_json_stores
+from litepuf.cache import ResponseCache, memoize_cached, open_cached
 
 import matplotlib
 import matplotlib.pyplot as plt
 
 
-def _slice_bits(n, slicer):
-    bits = bin(n)[2:].zfill(16)
-    if type(slicer) is slice:
-        bits = bits[slicer]
-    else:
-        bits = ''.join(itemgetter(*slicer)(bits))
-    return int(bits, 2)
-
-def _response_post(response, bit_slice):
-    """Return the post-processed response."""
-    response = ctypes.c_uint16(response).value
-    response = graycode(response)
-    if bit_slice:
-        response = _slice_bits(response, bit_slice)
-    return response
-
-def response_gen(dump_iter, offset_attr, offset=None, bit_slice=None):        
-    for chip_dump in dump_iter:
-        chip = dict()
-        for c, responses in chip_dump.items():
-            if offset_attr is not None:
-                responses = filter(lambda r: offset_attr in r and r[offset_attr] == offset, responses)
-            else:
-                # remove all values with additional offset attribute(s)
-                responses = filter(lambda r: r.keys() <= {"value"}, responses)
-            responses = [_response_post(r['value'], bit_slice) for r in responses]
-            chip[c] = responses
-        yield chip
-
-def _reference(chip):
-    return {c: mode(responses) for c, responses in chip.items()}
+RESPONSE_LEN = 16
+
+def _response_post(responses, gray=True):
+    """Return the post-processed responses."""
+    responses = responses.astype(np.uint16)
+    if gray:
+        responses = graycode(responses)
+    return responses
+
+def parse_slice(spec):
+    """Parse a bit slice, e.g. '15', '15,0,1' or '15-8' (bit 0 is the LSB)."""
+    bits = []
+    for part in spec.split(','):
+        if '-' in part:
+            high, low = map(int, part.split('-'))
+            bits += range(high, low-1, -1) if high >= low else range(high, low+1)
+        else:
+            bits.append(int(part))
+    if not all(0 <= bit < RESPONSE_LEN for bit in bits):
+        raise ValueError(f'bits of slice {spec!r} out of range')
+    return tuple(bits)
+
+def _slice_label(bit_slice):
+    if len(bit_slice) == 1:
+        return f'bit {bit_slice[0]}'
+    return 'bits ' + '+'.join(map(str, bit_slice))
+
+def _slice_view(bit_slice):
+    """Return the (post-processing, response length) evaluation view of a bit slice."""
+    return (lambda responses: extract_bits(responses, bit_slice)), len(bit_slice)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -51,6 +53,13 @@ if __name__ == "__main__":
     parser.add_argument('--offset-key', default=None)
     parser.add_argument('--export-path', default=None, help='export path of plot figure')
     parser.add_argument('--yerr', action='store_true', default=False)
+    parser.add_argument('--stream', action='store_true', help='parse JSON dumps one chip at a time to bound memory')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the cache of parsed dumps and results')
+    parser.add_argument('--cache-dir', default=None, help='cache directory (default: ~/.cache/litepuf)')
+    parser.add_argument('--slices', action='append', default=None,
+        help="evaluated bit slices, repeat the option or separate them with spaces, e.g. "
+             "--slices '15 15,0' --slices 15-12, or 'all' for every single bit (default: '15 0 1 15,0 15,0,1')")
+    parser.add_argument('--no-graycode', action='store_true', help='slice the raw counter values')
     parser.add_argument('dump_files', nargs='*')
 
     args = parser.parse_args()
@@ -70,67 +79,55 @@ if __name__ == "__main__":
 
     dump_files = list()
     for arg in args.dump_files:  
-        dump_files += glob(arg)
-
-    response_dumps = []
-    for filename in dump_files:
-        with open(filename, 'r') as f:
-            response_data = json.load(f)
-        response_dumps.append(response_data['dump'])
+        matches = glob(arg)
+        if not matches:
+            parser.error(f'no dump file matches {arg!r}')
+        dump_files += matches
+    if not dump_files:
+        parser.error('no dump file given')
+
+    cache = None if args.no_cache else ResponseCache(args.cache_dir)
+    if args.stream:
+        stores = iter_json_stores(dump_files)
+    else:
+        stores = [open_cached(cache, dump_files)]
 
     offset_attr = args.offset_key
-    if offset_attr:
-        offsets = [r[offset_attr] for r in list(response_dumps[0].values())[0] if offset_attr in r]
-        offsets = list(dict.fromkeys(offsets)) # remove duplicates and keep order (Python > 3.6) 
-    else:
-        offsets = [None,]
 
-    # TODO: configure slices in args
-    #slices = [slice(bit_num, bit_num+1) for bit_num in range(16)]
-    slices = [[0], [15], [14], [0, 15], [0, 15, 14]]
+    slices = list()
+    for spec in ' '.join(args.slices or ['15 0 1 15,0 15,0,1']).split():
+        if spec == 'all':
+            slices += [(bit,) for bit in reversed(range(RESPONSE_LEN))]
+        else:
+            slices.append(parse_slice(spec))
 
     steadiness_plot_data = [list() for _ in range(len(slices))]
     steadiness_err_data  = [list() for _ in range(len(slices))]
     uniqueness_plot_data = [list() for _ in range(len(slices))]
 
-    for slice_idx, bit_slice in enumerate(slices):
-        if args.ref:
-            ref_offset = args.ref
-            chips = response_gen(response_dumps, offset_attr, ref_offset, bit_slice)
-            references_per_chip = [_reference(chip) for chip in chips]
-        for offset in offsets:
-            chips = list(response_gen(response_dumps, offset_attr, offset, bit_slice))
-
-            # get length from the slice
-            if type(bit_slice) is slice:
-                slice_len = len(range(*bit_slice.indices(16)))
-            else:
-                slice_len = len(bit_slice)
-            print(f'Slice {slice_idx} len: {slice_len}')
-            uniqueness_ = uniqueness(chips, response_len=slice_len)
+    # responses are grouped by offset in a single pass, all slices are evaluated from each group
+    views = [_slice_view(bit_slice) for bit_slice in slices]
+    post = partial(_response_post, gray=not args.no_graycode)
+    def _evaluate():
+        return evaluate(stores, offset_attr, views=views, ref_offset=args.ref, post=post)
+    idents, results = memoize_cached(cache, _evaluate, dump_files, 'teropuf', slices, not args.no_graycode, offset_attr, args.ref)
+    offsets = list(results)
+    for offset, metrics_per_slice in results.items():
+        for slice_idx, metrics in enumerate(metrics_per_slice):
+            print(f'Slice {slice_idx} len: {views[slice_idx][1]}')
+            uniqueness_ = metrics.uniqueness
             uniqueness_plot_data[slice_idx].append(uniqueness_)
 
-            steadiness_per_chip = []
-            for chip_idx, chip in enumerate(chips):
-                if args.ref:
-                    references = references_per_chip[chip_idx]
-                else:
-                    references = _reference(chip)
-
-                steadiness_ = list(steadiness(chip, references, response_len=slice_len))
-                steadiness_chip = mean(steadiness_)
-                steadiness_per_chip.append(steadiness_chip)
+            steadiness_per_chip = metrics.steadiness
             # plot steadiness for one chip
             steadiness_mean = mean(steadiness_per_chip)
             steadiness_plot_data[slice_idx].append(steadiness_mean)
             steadiness_err = steadiness_mean-min(steadiness_per_chip), max(steadiness_per_chip)-steadiness_mean
             steadiness_err_data[slice_idx].append(steadiness_err)
 
-            randomness_ = randomness(chips, response_len=slice_len)
-
             print('Uniqueness:', uniqueness_)
             print('Steadiness:', steadiness_mean, steadiness_per_chip)
-            print('Randomness:', randomness_)
+            print('Randomness:', metrics.randomness)
 
     fig, (ax_uniqueness, ax_steadiness) = plt.subplots(2)
     if args.offset_key == 'voltage':
@@ -166,19 +163,13 @@ if __name__ == "__main__":
     else:
         yerr = [None] * len(slices)
 
-    ax_steadiness.errorbar(offsets, steadiness_plot_data[0], yerr=yerr[0], markersize=3, markeredgewidth=1, capsize=3, capthick=1, label='bit 15')
-    ax_steadiness.errorbar(offsets, steadiness_plot_data[1], yerr=yerr[1], markersize=3, markeredgewidth=1, capsize=3, capthick=1, label='bit 0')
-    ax_steadiness.errorbar(offsets, steadiness_plot_data[2], yerr=yerr[2], markersize=3, markeredgewidth=1, capsize=3, capthick=1, label='bit 1')
-    ax_steadiness.errorbar(offsets, steadiness_plot_data[3], yerr=yerr[3], markersize=3, markeredgewidth=1, capsize=3, capthick=1, label='bits 15+0')
-    ax_steadiness.errorbar(offsets, steadiness_plot_data[4], yerr=yerr[4], markersize=3, markeredgewidth=1, capsize=3, capthick=1, label='bits 15+0+1')
+    for slice_idx, bit_slice in enumerate(slices):
+        ax_steadiness.errorbar(offsets, steadiness_plot_data[slice_idx], yerr=yerr[slice_idx], markersize=3, markeredgewidth=1, capsize=3, capthick=1, label=_slice_label(bit_slice))
     if args.offset_key == 'voltage':
         ax_steadiness.legend(loc="lower right", ncol=2)
 
-    ax_uniqueness.plot(offsets, uniqueness_plot_data[0], markersize=3, markeredgewidth=1)
-    ax_uniqueness.plot(offsets, uniqueness_plot_data[1], markersize=3, markeredgewidth=1)
-    ax_uniqueness.plot(offsets, uniqueness_plot_data[2], markersize=3, markeredgewidth=1)
-    ax_uniqueness.plot(offsets, uniqueness_plot_data[3], markersize=3, markeredgewidth=1)
-    ax_uniqueness.plot(offsets, uniqueness_plot_data[4], markersize=3, markeredgewidth=1)
+    for slice_idx in range(len(slices)):
+        ax_uniqueness.plot(offsets, uniqueness_plot_data[slice_idx], markersize=3, markeredgewidth=1)
 
     if args.export_path:
         # plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
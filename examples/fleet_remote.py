@@ -0,0 +1,30 @@
+import argparse
+import json
+import time
+from functools import partial
+
+from litepuf.host import Board, acquire_fleet, acquire_puf
+from litepuf.store import json_to_columns, write_store
+
+parser = argparse.ArgumentParser(description="Acquire the PUF responses of several boards at once")
+parser.add_argument('--boards', default='boards.json',
+    help='JSON list of boards: {"host": ..., "port": ..., "csr_csv": ..., "ident": ...} (ident read from the SoC if omitted)')
+parser.add_argument('--samples', type=int, default=100)
+parser.add_argument('--cells', type=int, default=4, help='number of PUF cells (for challenge selection)')
+parser.add_argument('--name', default='puf', help='PUF core name in the CSR map')
+parser.add_argument('--method', choices=['single', 'batch', 'sequencer'], default='batch')
+parser.add_argument('--store', default='fleet_store', help='combined response store of all the boards')
+parser.add_argument('--workers', type=int, default=None, help='boards acquired at once (all by default)')
+args = parser.parse_args()
+
+with open(args.boards, 'r') as f:
+    boards = [Board(**board) for board in json.load(f)]
+
+start = time.monotonic()
+dumps = acquire_fleet(boards, partial(acquire_puf, cells=args.cells, samples=args.samples, name=args.name, method=args.method), args.workers)
+print(f'{len(dumps)}/{len(boards)} boards acquired in {time.monotonic() - start:.1f} s')
+if not dumps:
+    parser.exit(1, 'no board acquired\n')
+
+idents = sorted(dumps)
+write_store(args.store, idents, json_to_columns([dumps[ident] for ident in idents]))
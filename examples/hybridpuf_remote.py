@@ -8,8 +8,11 @@ import ctypes
 from litex.tools.litex_client import RemoteClient
 from litescope.software.driver.analyzer import LiteScopeAnalyzerDriver
 
+from litepuf.host import PUFReader
+
 wb = RemoteClient(csr_csv="test/csr.csv")
 wb.open()
+puf = PUFReader(wb.regs, "hybridpuf")
 
 analyzer = LiteScopeAnalyzerDriver(wb.regs, "analyzer", debug=True, config_csv="test/analyzer.csv")
 
@@ -24,12 +27,7 @@ analyzer.run(offset=8, length=512)  ### CHANGE THIS TO MATCH DEPTH offset=32 by
 samples = defaultdict(list)
 for s1, s2 in product(range(5), repeat=2):
     for sample_idx in range(10): # take n samples
-        wb.regs.hybridpuf_reset.write(1) # enable reset
-        wb.regs.hybridpuf_cell0_select.write(s1)
-        wb.regs.hybridpuf_cell1_select.write(s2)
-        wb.regs.hybridpuf_reset.write(0) # disable reset
-        time.sleep(0.1)
-        bit_value = wb.regs.hybridpuf_bit_value.read()
+        bit_value = puf.read(s1, s2)
         samples[f'{s1}:{s2}'].append(bit_value)
         print(f'Comparator from set {s1} and {s2}: {bit_value}')
 
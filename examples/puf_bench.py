@@ -23,7 +23,7 @@ from litescope import LiteScopeIO, LiteScopeAnalyzer
 
 from litepuf import RingOscillator, TEROCell
 from litepuf.oscillator import MetastableOscillator
-from litepuf.cores import RingOscillatorPUF, TransientEffectRingOscillatorPUF as TEROPUF, PowerOptimizedHybridOscillatorArbiterPUF as HybridOscillatorArbiterPUF
+from litepuf.cores import ChallengeSequencer, RingOscillatorPUF, TransientEffectRingOscillatorPUF as TEROPUF, PowerOptimizedHybridOscillatorArbiterPUF as HybridOscillatorArbiterPUF
 from litepuf.random import RandomLFSR
 
 from litepuf import PUFType
@@ -154,6 +154,9 @@ class LiteScopeSoC(BaseSoC):
 
         self.comb += puf_reset.eq(puf.reset)
 
+        # challenges applied by the gateware, responses drained from a FIFO
+        self.submodules.sequencer = ChallengeSequencer(puf, cells=len(oscillators1))
+
         # safety check for the scope sampling rate
         monotonic = Signal(16)
         self.sync += monotonic.eq(monotonic + 1)
@@ -1,145 +1,184 @@
-from itertools import product, combinations, count
+from itertools import combinations
 from sys import stdout
-import time
 from collections import defaultdict
-import json
-from more_itertools import numeric_range
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import *
 from enum import Enum, auto
 
 from litex.tools.litex_client import RemoteClient
 from litescope.software.driver.analyzer import LiteScopeAnalyzerDriver
-from litescope.software.dump import DumpData, Dump
 
 from litepuf import PUFType
+from litepuf.capture import puf_responses
+from litepuf.evaluation import graycode
+from litepuf.host import AnalyzerReader, CSRBatch, PUFReader, SequencerReader
+from litepuf.online import ChipAccumulator
+from litepuf.store import NO_OFFSET, StreamWriter, iter_stream_blocks
+from litepuf.supply import SUPPLIES, sweep, voltage_range
 
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument("--identity", default=None)
 parser.add_argument('--analyzer', action='store_true')
 parser.add_argument('--voltage', action='store_true')
+parser.add_argument('--supply', choices=list(SUPPLIES), default='digilent', help='supply of the voltage sweep')
+parser.add_argument('--passes', type=int, default=1, help='visits of every voltage, the samples are split between them')
+parser.add_argument('--shuffle', action='store_true', help='random order of the voltages in every pass')
+parser.add_argument('--seed', type=int, default=0, help='seed of the voltage order (keep it to resume a sweep)')
+parser.add_argument('--settle-tolerance', type=float, default=0.005, help='volts from the set point for the rail to be settled')
+parser.add_argument('--settle-timeout', type=float, default=5.0)
 parser.add_argument('--samples', type=int, default=100)
 parser.add_argument('--analyzer-subsampling', type=int, default=10)
 parser.add_argument('--analyzer-offset', type=int, default=0)
 parser.add_argument('--analyzer-length', type=int, default=51)
 parser.add_argument('--cells', type=int, default=4, help='number of PUF cells (for challenge selection)')
 parser.add_argument('--type', type=lambda t: PUFType[t], choices=list(PUFType))
+parser.add_argument('--live-stats', action='store_true', help='print steadiness and bias after each sample')
+parser.add_argument('--no-dump', action='store_true', help='only keep online statistics, not the samples')
+parser.add_argument('--stream-dir', default=None, help='directory the samples are streamed to, an existing stream is resumed (default: {identity}_stream)')
+parser.add_argument('--flush-interval', type=float, default=10.0, help='seconds between the writes of the samples to the stream')
+parser.add_argument('--timeout', type=float, default=1.0, help='seconds to wait for the PUF ready flag')
+parser.add_argument('--sequencer', action='store_true', help='apply the challenges with the on-FPGA sequencer')
+parser.add_argument('--batch', action='store_true', help='pipeline the CSR accesses of all the challenges of a sample (and their analyzer captures)')
 
 args = parser.parse_args()
+if args.analyzer and args.sequencer:
+    parser.error('the analyzer is triggered per challenge, it cannot be used with --sequencer')
 
 wb = RemoteClient(csr_csv="test/csr.csv")
 wb.open()
+puf = PUFReader(wb.regs, "puf", timeout=args.timeout)
+if args.sequencer:
+    sequencer = SequencerReader(wb.regs, "sequencer")
+    sequencer.configure(cells=args.cells)
 
-samples = defaultdict(list)
 samples_iter = range(args.samples)
 
+# post-processing of the responses for online statistics (see evaluation/ropuf.py and teropuf.py)
+if args.type is PUFType.TERO:
+    response_len = 16
+    live_response = lambda value: graycode(c_uint16(value).value)
+elif args.type is PUFType.RO:
+    response_len = 1
+    live_response = lambda value: c_int16(value).value > 0
+else:
+    response_len = 1
+    live_response = lambda value: value & 1
+# one accumulator per operating point (voltage)
+stats = defaultdict(lambda: ChipAccumulator(response_len, args.identity))
+
 if args.analyzer:
     analyzer = LiteScopeAnalyzerDriver(wb.regs, "analyzer", debug=True, config_csv="test/analyzer.csv")
     analyzer.configure_subsampler(args.analyzer_subsampling)  ## increase this to "skip" cycles, e.g. subsample
     analyzer.configure_group(0)
+    scope = AnalyzerReader(analyzer, puf, offset=args.analyzer_offset, length=args.analyzer_length)
 
 if args.voltage:
-    from dwfconstants import *
-
-    dwf = cdll.LoadLibrary("libdwf.so")
-    hdwf = c_int()
-
-    dwf.FDwfParamSet(DwfParamOnClose, c_int(0)) # 0 = run, 1 = stop, 2 = shutdown
-    print("Opening first device")
-    dwf.FDwfDeviceOpen(c_int(-1), byref(hdwf))
-
-    if hdwf.value == hdwfNone.value:
-        print("failed to open device")
-        quit()
-
-    dwf.FDwfDeviceAutoConfigureSet(hdwf, c_int(0))
-    # set up analog IO channel nodes
-    # enable positive supply
-    dwf.FDwfAnalogIOChannelNodeSet(hdwf, c_int(0), c_int(0), c_double(True))
-    # set voltage to 1.20 V
-    dwf.FDwfAnalogIOChannelNodeSet(hdwf, c_int(0), c_int(1), c_double(1.20))
-    # master enable
-    dwf.FDwfAnalogIOEnableSet(hdwf, c_int(True))
-    dwf.FDwfAnalogIOConfigure(hdwf)
-
-    def voltage_range(start, stop, step):
-        # max recommended operating conditions for ECP5-5G is 1.26V
-        # absolute maximum rating is 1.32V for ECP5 and ECP5-5G
-        assert(start <= stop <= 1.32)
-        return numeric_range(start, stop, step)
-
-    voltage_iter = voltage_range(Decimal('1.1'), Decimal('1.31'), Decimal('0.02'))
-    samples_iter = product(samples_iter, voltage_iter)
+    supply = SUPPLIES[args.supply]()
+    voltage_iter = voltage_range('1.1', '1.31', '0.02')
+    # all the samples of an operating point before the next one
+    samples_iter = sweep(args.samples, voltage_iter, passes=args.passes, shuffle=args.shuffle, seed=args.seed)
 
-samples_iter = list(samples_iter)
-for sample_idx in samples_iter: # take n samples
+def round_key(sample_idx):
+    # [sample, voltage] of an acquisition round, as stored in the stream manifest
     if args.voltage:
-        voltage = float(sample_idx[1])
-        if dwf.FDwfAnalogIOStatus(hdwf) == 0:
-            break
+        return [sample_idx[0], float(sample_idx[1])]
+    return [sample_idx, None]
+
+samples_iter = list(samples_iter)
+writer = None
+if not args.no_dump:
+    writer = StreamWriter(args.stream_dir or f'{args.identity or "puf"}_stream', ident=args.identity,
+        flush_interval=args.flush_interval)
+    if writer.done:
+        if writer.done > len(samples_iter) or writer.last != round_key(samples_iter[writer.done-1]):
+            parser.error(f'{writer.path} was acquired with other parameters')
+        print(f'resuming {writer.path} after {writer.done} rounds')
+        # replay the streamed responses into the online statistics
+        for block in iter_stream_blocks(writer.path):
+            main_samples = block['offset'] == NO_OFFSET
+            rows = zip(*(block[column][main_samples].tolist() for column in ('cell0', 'cell1', 'voltage', 'value')))
+            for cell0, cell1, voltage, value in rows:
+                voltage = None if voltage != voltage else voltage # NaN without voltage
+                stats[voltage].update(f'{cell0}:{cell1}', live_response(value))
+
+def store_round(rows, captures, key):
+    # runs on the store worker, the captures of a round are decoded while the next one is acquired
+    sample_number, voltage = key
+    for s1, s2, bit_value in rows:
+        writer.append(s1, s2, sample_number, bit_value, voltage=voltage)
+    layout = analyzer.layouts[analyzer.group] if args.analyzer else None
+    for s1, s2, data in captures:
+        # responses indexed by offset (in clock cycles)
+        offsets, values = puf_responses(data, layout, analyzer.data_width, args.type, args.analyzer_subsampling)
+        writer.extend(s1, s2, sample_number, values, offset=offsets)
+    writer.end_unit(key)
+
+done_rounds = writer.done if writer is not None else 0
+store = ThreadPoolExecutor(max_workers=1)
+stored = None
+supply_voltage = None
+for round_idx, sample_idx in enumerate(samples_iter): # take n samples
+    if round_idx < done_rounds:
+        continue
+    sample_number, voltage = round_key(sample_idx)
+    if args.voltage and voltage != supply_voltage:
         print(f'set voltage to {voltage}')
-        dwf.FDwfAnalogIOChannelNodeSet(hdwf, c_int(0), c_int(1), c_double(voltage))
-        dwf.FDwfAnalogIOConfigure(hdwf)
-        time.sleep(0.5)
-    for s1, s2 in combinations(range(args.cells), 2):
-        sample = {}
-        if args.voltage:
-            sample['voltage'] = voltage
+        try:
+            supply.set_voltage(voltage)
+            settle_time = supply.settle(voltage, args.settle_tolerance, timeout=args.settle_timeout)
+        except (IOError, TimeoutError) as e:
+            print(f'supply error: {e}')
+            break
+        supply_voltage = voltage
+        print(f'settled in {settle_time:.3f} s')
+    captures = []
+    if args.sequencer:
+        readings = sequencer.responses() # one pass over all the challenges
+    elif args.batch:
+        challenges = list(combinations(range(args.cells), 2))
         if args.analyzer:
-            analyzer.clear()
-            analyzer.add_falling_edge_trigger("puf_reset")
-            analyzer.run(offset=args.analyzer_offset, length=args.analyzer_length)
-
-        wb.regs.puf_reset.write(1) # enable reset
-        wb.regs.puf_cell0_select.write(s1)
-        wb.regs.puf_cell1_select.write(s2)
-        wb.regs.puf_reset.write(0) # disable reset
-        time.sleep(0.1)
-        bit_value = wb.regs.puf_bit_value.read()
-        sample['value'] = bit_value
+            # arm, trigger and upload of all the captures pipelined in one batch
+            responses = []
+            for (s1, s2), (bit_value, data) in zip(challenges, scope.read_batch(CSRBatch(wb), challenges)):
+                responses.append(bit_value)
+                captures.append((s1, s2, data))
+        else:
+            responses = puf.read_batch(CSRBatch(wb), challenges)
+        readings = [(s1, s2, bit_value) for (s1, s2), bit_value in zip(challenges, responses)]
+    else:
+        readings = ((s1, s2, None) for s1, s2 in combinations(range(args.cells), 2))
+    rows = []
+    for s1, s2, bit_value in readings:
+        if bit_value is None and args.analyzer:
+            bit_value, data = scope.read(s1, s2)
+            captures.append((s1, s2, data))
+        elif bit_value is None:
+            bit_value = puf.read(s1, s2)
         print(f'Comparator from set {s1} and {s2}: {c_int16(bit_value).value}')
 
-        samples[f'{s1}:{s2}'].append(sample)
-
-        if args.analyzer:
-            analyzer.wait_done()
-            analyzer.upload()
-            analyzer_dump = Dump()
-            analyzer_dump.add_from_layout(analyzer.layouts[analyzer.group], analyzer.data)
-
-            if args.type is PUFType.RO or args.type is PUFType.TERO:
-                cv1 = next(v.values for v in  analyzer_dump.variables if v.name == 'puf_roset0_counter')
-                cv2 = next(v.values for v in  analyzer_dump.variables if v.name == 'puf_roset1_counter')
-                signal_values = list(zip(cv1, cv2))
-            elif args.type is PUFType.HYBRID:
-                signal_values = list(next(v.values for v in  analyzer_dump.variables if v.name == 'puf_ff_o'))
-            # each clock cycles has two values (rising, falling), skip every other value
-            signal_values = signal_values[::2]
-            for offset, signal_value in zip(count(0, args.analyzer_subsampling), signal_values):
-                if args.type is PUFType.RO or args.type is PUFType.TERO:
-                    counter1, counter2 = signal_value
-                    puf_response = counter1 - counter2
-                elif args.type is PUFType.HYBRID:
-                    puf_response = signal_value
-                # index responses by offset (in clock cycles)
-                sample = {
-                    'offset': offset,
-                    'value': puf_response
-                }
-                samples[f'{s1}:{s2}'].append(sample)
-
+        rows.append((s1, s2, bit_value))
+        stats[voltage].update(f'{s1}:{s2}', live_response(bit_value))
+    if writer is not None:
+        if stored is not None:
+            stored.result() # one round at most waits for the store
+        stored = store.submit(store_round, rows, captures, round_key(sample_idx))
+    if args.live_stats:
+        voltage_stats = stats[voltage]
+        print(f'Sample {sample_idx}: steadiness {voltage_stats.steadiness():.4f}, bias {voltage_stats.bias():.4f}')
+
+if stored is not None:
+    stored.result()
+store.shutdown()
+if writer is not None:
+    writer.close()
 if args.analyzer:
     analyzer.save("test/dump.vcd")
 if args.voltage:
-    dwf.FDwfDeviceClose(hdwf)
+    supply.close()
 
 wb.close()
 
-dump = {
-    'ident': args.identity,
-    'dump': samples
-}
-
-with open(f'{args.identity or "puf"}_dump.json', 'w') as dumpfile:
-    json.dump(dump, dumpfile)
+for voltage, chip_stats in stats.items():
+    suffix = f'_{voltage}V' if voltage is not None else ''
+    chip_stats.save(f'{args.identity or "puf"}{suffix}_stats.json')
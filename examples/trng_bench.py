@@ -39,7 +39,7 @@ class LiteScopeSoC(BaseSoC):
     }
     csr_map.update(BaseSoC.csr_map)
 
-    def __init__(self, num_osc=4, osc_len=7):
+    def __init__(self, num_osc=4, osc_len=7, fifo_depth=512, lanes=1, steps=1):
         sys_clk_freq = int(50e6) # check
 
         BaseSoC.__init__(self, sys_clk_freq, x5_clk_freq=int(50e6), toolchain="trellis", # check
@@ -55,8 +55,8 @@ class LiteScopeSoC(BaseSoC):
         self.submodules.bridge = bridge
         self.add_wb_master(bridge.wishbone)
 
-        oscillators = [RingOscillator(placement) for placement in ro_placer(num_osc, osc_len)]
-        self.submodules.trng = trng = RandomLFSR(oscillators)
+        oscillators = [RingOscillator(placement) for placement in ro_placer(num_osc*lanes*steps, osc_len)]
+        self.submodules.trng = trng = RandomLFSR(oscillators, fifo_depth=fifo_depth, lanes=lanes, steps=steps, rate_window=sys_clk_freq) # rate in words/s
 
         # Litescope Analyzer
         analyzer_groups = {}
@@ -85,13 +85,19 @@ class LiteScopeSoC(BaseSoC):
 def main():
     parser = argparse.ArgumentParser(description="TRNG testbench on ECP5 Evaluation Board")
     parser.add_argument("--load",         action="store_true", help="Load bitstream")
-    parser.add_argument('--num-oscillators', type=int, default=4)
+    parser.add_argument('--num-oscillators', type=int, default=4, help='oscillators per sampler')
+    parser.add_argument('--lanes', type=int, default=1, help='independent TRNG lanes, their words are interleaved')
+    parser.add_argument('--steps', type=int, default=1, help='LFSR shifts per clock, with one sampler per shift')
     parser.add_argument('--oscillators-length', type=int, default=7)
+    parser.add_argument('--fifo-depth', type=int, default=512, help='words of the TRNG output FIFO')
     args = parser.parse_args()
 
     soc = LiteScopeSoC(
         num_osc=args.num_oscillators,
-        osc_len=args.oscillators_length)
+        osc_len=args.oscillators_length,
+        fifo_depth=args.fifo_depth,
+        lanes=args.lanes,
+        steps=args.steps)
     builder = Builder(soc, csr_csv="test/csr.csv", csr_json="test/csr.json")
     vns = builder.build(nowidelut=True, ignoreloops=True)
 
@@ -8,32 +8,67 @@ import ctypes
 from litex.tools.litex_client import RemoteClient
 from litescope.software.driver.analyzer import LiteScopeAnalyzerDriver
 
+from litepuf.capture import save_analyzer
+from litepuf.host import RateMeter, ShardWriter, TRNGReader
+
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('--samples', type=int, default=-1)
-parser.add_argument('--dumpfile', default='dump.py')
+parser.add_argument('--dumpfile', default='dump.lcap', help='binary capture (.lcap) or LiteScope dump (.vcd, .py, ...)')
+parser.add_argument('--output', default='entropy.dat', help='random words file, or shard pattern with a {shard} field (e.g. entropy_{shard:04d}.dat)')
+parser.add_argument('--shard-size', type=int, default=None, help='bytes per output shard')
+parser.add_argument('--shard-hours', type=float, default=None, help='hours per output shard')
+parser.add_argument('--print-words', action='store_true', help='print every word (slow)')
+parser.add_argument('--no-analyzer', action='store_true', help='do not capture the TRNG signals')
+parser.add_argument('--no-stream', action='store_true', help='read one word at a time even if the TRNG has an output FIFO')
+parser.add_argument('--decimation', type=int, nargs='+', default=None,
+    help='sys cycles per bit, several values are acquired one after the other (--output may have a {decimation} field)')
+parser.add_argument('--prescaler', type=int, default=None, help='half period of the TRNG sampling clock, in sys cycles')
 
 args = parser.parse_args()
-samples_iter = range(args.samples) if args.samples >= 0 else count() 
+if (args.shard_size or args.shard_hours) and '{shard' not in args.output:
+    parser.error('--shard-size and --shard-hours need a {shard} field in --output')
+if args.decimation and len(args.decimation) > 1 and (args.samples < 0 or '{decimation}' not in args.output):
+    parser.error('a decimation sweep needs --samples and a {decimation} field in --output')
 
 wb = RemoteClient(csr_csv="test/csr.csv")
 wb.open()
 
-analyzer = LiteScopeAnalyzerDriver(wb.regs, "analyzer", debug=True, config_csv="test/analyzer.csv")
+if not args.no_analyzer:
+    analyzer = LiteScopeAnalyzerDriver(wb.regs, "analyzer", debug=True, config_csv="test/analyzer.csv")
 
-analyzer.run(length=2**20)  ### CHANGE THIS TO MATCH DEPTH offset=32 by default
+    analyzer.run(length=2**20)  ### CHANGE THIS TO MATCH DEPTH offset=32 by default
 
-with open('entropy.dat', 'ab') as f:
-    for _ in samples_iter:
-        wb.regs.trng_update_value.write(1)
-        while not wb.regs.trng_ready.read():
-            pass
-        random_word = wb.regs.trng_random_word.read()
-        print(hex(random_word))
-        f.write(random_word.to_bytes(4, 'big'))
+trng = TRNGReader(wb, "trng", stream=False if args.no_stream else None)
+shard_time = args.shard_hours * 3600 if args.shard_hours else None
+for decimation in args.decimation or [None]:
+    if decimation is not None or args.prescaler is not None:
+        trng.configure(decimation, args.prescaler)
+    meter = RateMeter(bits_per_word=32)
+    output = args.output.replace('{decimation}', str(decimation))
+    with ShardWriter(output, shard_size=args.shard_size, shard_time=shard_time) as f:
+        try:
+            for random_word in trng.words(args.samples if args.samples >= 0 else None):
+                if args.print_words:
+                    print(hex(random_word))
+                f.write(random_word.to_bytes(4, 'big'))
+                meter.update()
+        except KeyboardInterrupt:
+            break
+        finally:
+            meter.close()
+    if trng.overflows:
+        print(f'{trng.overflows} words dropped by the TRNG FIFO')
+    rate = trng.measured_rate()
+    if rate is not None:
+        print(f'{output}: generator rate {rate:.1f} words/s ({32*rate:.0f} bits/s)')
 
-analyzer.wait_done()
-analyzer.upload()
-analyzer.save(f"test/{args.dumpfile}")
+if not args.no_analyzer:
+    analyzer.wait_done()
+    analyzer.upload()
+    if args.dumpfile.endswith('.lcap'):
+        save_analyzer(analyzer, f"test/{args.dumpfile}")
+    else:
+        analyzer.save(f"test/{args.dumpfile}")
 
 wb.close()
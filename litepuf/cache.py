@@ -0,0 +1,239 @@
+"""Persistent cache of parsed response dumps and evaluation results.
+
+Entries are keyed by the content hash (SHA-256) of the input files. File hashes are
+remembered with the size and modification time of the file, so unchanged files are not
+read again, and a touched file whose content did not change still hits the cache.
+Parsed dumps are kept as response stores (see `litepuf.store`) and opened memory-mapped,
+evaluation results are pickled. The least recently used entries are evicted when the
+cache grows beyond its size bound.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+from .store import ResponseStore, is_store, open_responses, write_store
+
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'litepuf'
+DEFAULT_MAX_SIZE = 4 << 30 # bytes
+
+
+def _hash_file(path, chunk_size=1<<20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _entry_size(path):
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.iterdir())
+    return path.stat().st_size
+
+def _remove(path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class ResponseCache:
+    """Content-addressed cache directory, `LITEPUF_CACHE` overrides the default location."""
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = Path(path or os.environ.get('LITEPUF_CACHE', DEFAULT_CACHE_DIR))
+        self.max_size = max_size
+        self.stores_path = self.path / 'stores'
+        self.results_path = self.path / 'results'
+        self.stores_path.mkdir(parents=True, exist_ok=True)
+        self.results_path.mkdir(parents=True, exist_ok=True)
+        self._hashes_file = self.path / 'hashes.json'
+        try:
+            with open(self._hashes_file, 'r') as f:
+                self._hashes = json.load(f)
+        except (OSError, ValueError):
+            self._hashes = {}
+        self._hashes_changed = False
+
+    def file_hash(self, path):
+        """Content hash of a file, recomputed only when its size or mtime changed."""
+        path = Path(path).resolve()
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        known = self._hashes.get(str(path))
+        if known and known['stamp'] == stamp:
+            return known['sha256']
+        digest = _hash_file(path)
+        self._hashes[str(path)] = {'stamp': stamp, 'sha256': digest}
+        self._hashes_changed = True
+        return digest
+
+    def key(self, paths, *parts):
+        """Cache key of the content of `paths` (files or store directories) and `parts`."""
+        digest = hashlib.sha256(repr((CACHE_VERSION,) + parts).encode())
+        for path in paths:
+            path = Path(path)
+            files = sorted(path.iterdir()) if path.is_dir() else [path]
+            for f in files:
+                digest.update(f.name.encode())
+                digest.update(self.file_hash(f).encode())
+        self._save_hashes()
+        return digest.hexdigest()
+
+    def _save_hashes(self):
+        if not self._hashes_changed:
+            return
+        # drop the hashes of deleted files
+        self._hashes = {path: known for path, known in self._hashes.items() if os.path.exists(path)}
+        tmp_file = self._hashes_file.with_name(f'{self._hashes_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self._hashes, f)
+        os.replace(tmp_file, self._hashes_file)
+        self._hashes_changed = False
+
+    def open(self, paths):
+        """Open JSON dumps and/or stores as a single `ResponseStore`, parsing them at most once."""
+        paths = list(paths)
+        if len(paths) == 1 and is_store(paths[0]):
+            return ResponseStore(paths[0])
+        entry = self.stores_path / self.key(paths)
+        if is_store(entry):
+            os.utime(entry)
+            return ResponseStore(entry)
+        store = open_responses(paths)
+        write_store(entry, store.idents, store.columns)
+        self.evict(keep=entry)
+        return ResponseStore(entry)
+
+    def get(self, key, default=None):
+        """Return the pickled result of `key`, or `default` if it is not cached."""
+        entry = self.results_path / f'{key}.pickle'
+        try:
+            with open(entry, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return default
+        os.utime(entry)
+        return result
+
+    def put(self, key, result):
+        entry = self.results_path / f'{key}.pickle'
+        tmp_entry = entry.with_name(f'{entry.name}.{os.getpid()}.tmp')
+        with open(tmp_entry, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_entry, entry)
+        self.evict(keep=entry)
+
+    def memoize(self, key, compute):
+        """Return the pickled result of `key`, calling `compute()` on a miss."""
+        missing = object()
+        result = self.get(key, missing)
+        if result is missing:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in `max_size`."""
+        entries = [entry for entries_path in (self.stores_path, self.results_path)
+            for entry in entries_path.iterdir() if not entry.name.endswith('.tmp') and entry != keep]
+        entries = sorted((entry.stat().st_mtime, _entry_size(entry), entry) for entry in entries)
+        size = sum(entry_size for _, entry_size, _ in entries) + (_entry_size(keep) if keep else 0)
+        for _, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            _remove(entry)
+            size -= entry_size
+
+    def clear(self):
+        for entries_path in (self.stores_path, self.results_path):
+            shutil.rmtree(entries_path, ignore_errors=True)
+            entries_path.mkdir(parents=True)
+
+
+def open_cached(cache, paths):
+    """`ResponseCache.open` of `paths`, or a plain `open_responses` without a cache (--no-cache)."""
+    return cache.open(paths) if cache is not None else open_responses(paths)
+
+def memoize_cached(cache, compute, paths, *parts):
+    """`compute()`, memoized by the content of `paths` and `parts` unless `cache` is None."""
+    if cache is None:
+        return compute()
+    return cache.memoize(cache.key(paths, *parts), compute)
+
+
+import unittest
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.cache = ResponseCache(self.tmp / 'cache')
+        self.dump = self.tmp / 'chip0.json'
+        self.write_dump([1, 0, 1])
+
+    def write_dump(self, values, mtime=None):
+        with open(self.dump, 'w') as f:
+            json.dump({'ident': 'chip0', 'dump': {'0:1': values}}, f)
+        if mtime is not None:
+            os.utime(self.dump, ns=(mtime, mtime))
+
+    def entries(self, path):
+        return sorted(entry.name for entry in path.iterdir())
+
+    def test_hit(self):
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+        self.assertEqual(self.cache.memoize(self.cache.key([self.dump], 'test'), compute), 1)
+        self.assertEqual(self.cache.memoize(self.cache.key([self.dump], 'test'), compute), 1)
+        self.assertEqual(len(calls), 1)
+        self.cache.open([self.dump])
+        self.assertEqual(list(ResponseCache(self.cache.path).open([self.dump]).columns['value']), [1, 0, 1])
+        self.assertEqual(len(self.entries(self.cache.stores_path)), 1)
+        # a touched file with the same content hits
+        os.utime(self.dump, ns=(1, 1))
+        self.assertEqual(self.cache.memoize(self.cache.key([self.dump], 'test'), compute), 1)
+
+    def test_invalidation(self):
+        mtime = self.dump.stat().st_mtime_ns
+        key = self.cache.key([self.dump])
+        self.cache.open([self.dump])
+        self.write_dump([1, 1, 1], mtime=mtime) # same size and mtime, the remembered hash is used
+        self.assertEqual(self.cache.key([self.dump]), key)
+        self.write_dump([1, 1, 1], mtime=mtime + 1)
+        mtime_key = self.cache.key([self.dump])
+        self.assertNotEqual(mtime_key, key)
+        self.write_dump([1, 1, 1, 1], mtime=mtime + 1)
+        self.assertNotIn(self.cache.key([self.dump]), (key, mtime_key))
+        self.assertEqual(list(self.cache.open([self.dump]).columns['value']), [1, 1, 1, 1])
+        self.assertEqual(len(self.entries(self.cache.stores_path)), 2)
+
+    def test_eviction(self):
+        result = bytes(1000)
+        self.cache.max_size = 2500 # two results
+        for i, key in enumerate('abc'):
+            self.cache.put(key, result)
+            os.utime(self.cache.results_path / f'{key}.pickle', (i, i))
+        self.assertEqual(self.entries(self.cache.results_path), ['b.pickle', 'c.pickle'])
+        self.assertEqual(self.cache.get('b'), result) # b is now the most recently used
+        self.cache.put('d', result)
+        self.assertEqual(self.entries(self.cache.results_path), ['b.pickle', 'd.pickle'])
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_no_cache(self):
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+        for _ in range(2):
+            self.assertEqual(list(open_cached(None, [self.dump]).columns['value']), [1, 0, 1])
+        self.assertEqual([memoize_cached(None, compute, [self.dump], 'test') for _ in range(2)], [1, 2])
+        self.assertEqual(self.entries(self.cache.stores_path), [])
+        self.assertEqual(self.entries(self.cache.results_path), [])
+        self.assertEqual([memoize_cached(self.cache, compute, [self.dump], 'test') for _ in range(2)], [3, 3])
@@ -0,0 +1,259 @@
+"""Binary LiteScope captures.
+
+A capture file holds the raw analyzer words, as uploaded by `LiteScopeAnalyzerDriver`,
+after a JSON header describing the signal layout. Words are stored as little-endian
+64-bit lanes (one lane per 64 bits of data width) and memory-mapped when loaded, so that
+byte-aligned signals are returned as views of the file and other signals are decoded with
+a single shift and mask. Unlike the LiteScope dumps, samples are not duplicated.
+
+Captures can be exported to any LiteScope dump format (.vcd, .py, .csv, .json, .sr).
+
+`puf_responses` decodes the words of a capture around a PUF challenge into per-offset
+responses with array operations, without going through a LiteScope dump.
+"""
+import argparse
+import json
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from . import PUFType
+
+MAGIC = b'LPCAP\0\0\0'
+CAPTURE_VERSION = 1
+ALIGNMENT = 64 # bytes, data offset in the file
+
+
+def _lanes(data_width):
+    return max((data_width + 63) // 64, 1)
+
+def _value_dtype(width):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if width <= np.dtype(dtype).itemsize * 8:
+            return dtype
+    raise ValueError(f'signals wider than 64 bits are not supported ({width} bits)')
+
+def words_to_lanes(data, data_width):
+    """Convert analyzer words (Python ints) to a (sample, lane) uint64 array."""
+    lanes = _lanes(data_width)
+    if isinstance(data, np.ndarray) and data.dtype != object:
+        return np.ascontiguousarray(data, dtype=np.uint64).reshape(len(data), lanes)
+    if lanes == 1:
+        return np.array(data, dtype=np.uint64).reshape(len(data), 1)
+    data = np.array(data, dtype=object)
+    return np.stack([((data >> (64*lane)) & (2**64 - 1)).astype(np.uint64) for lane in range(lanes)], axis=-1)
+
+def subwords_to_lanes(subwords, data_width):
+    """Convert the 32-bit bus words of an analyzer upload to a (sample, lane) uint64 array.
+
+    Every analyzer word is uploaded as consecutive bus words, least significant first.
+    """
+    per_word = (data_width + 31) // 32
+    lanes = _lanes(data_width)
+    subwords = np.asarray(subwords, dtype=np.uint64).reshape(-1, per_word)
+    if per_word % 2:
+        subwords = np.hstack([subwords, np.zeros((len(subwords), 1), dtype=np.uint64)])
+    words = subwords[:, 0::2] | (subwords[:, 1::2] << np.uint64(32))
+    return np.ascontiguousarray(words[:, :lanes], dtype='<u8')
+
+def lanes_to_data(words, data_width):
+    """Analyzer words as Python ints, like `LiteScopeAnalyzerDriver.data`."""
+    from litescope.software.dump import DumpData
+    data = DumpData(data_width)
+    if words.shape[1] == 1:
+        data.extend(words[:, 0].tolist())
+    else:
+        lanes = [words[:, lane].tolist() for lane in range(words.shape[1])]
+        data.extend(sum(word << (64*lane) for lane, word in enumerate(words)) for words in zip(*lanes))
+    return data
+
+def _position(layout, signal):
+    position = 0
+    for name, width in layout:
+        if name == signal:
+            return position, width
+        position += width
+    raise KeyError(signal)
+
+def extract_signal(words, layout, signal):
+    """Samples of `signal` from (sample, lane) little-endian words with `layout`."""
+    position, width = _position(layout, signal)
+    lane, shift = divmod(position, 64)
+    dtype = _value_dtype(width)
+    if width in (8, 16, 32, 64) and position % 8 == 0:
+        # byte-aligned signal, view of the words (lanes are little-endian)
+        start = position // 8
+        raw = words.view(np.uint8).reshape(len(words), -1)[:, start:start + width//8]
+        return raw.view(np.dtype(dtype).newbyteorder('<'))[:, 0]
+    values = words[:, lane] >> np.uint64(shift)
+    if shift + width > 64:
+        values |= words[:, lane+1] << np.uint64(64 - shift)
+    return (values & np.uint64(2**width - 1)).astype(dtype)
+
+def puf_responses(data, layout, data_width, puf_type, subsampling=1, name='puf'):
+    """Per-offset responses of a capture around a challenge, as (offsets, values) arrays.
+
+    `data` holds analyzer words (Python ints or a (sample, lane) array). The response at a
+    sample is the difference of the two RO set counters for RO and TERO PUFs, and the
+    comparator output for hybrid PUFs. Offsets are in clock cycles from the first sample.
+    """
+    words = words_to_lanes(data, data_width)
+    if puf_type is PUFType.HYBRID:
+        values = extract_signal(words, layout, f'{name}_ff_o').astype(np.int64)
+    else:
+        values = extract_signal(words, layout, f'{name}_roset0_counter').astype(np.int64) \
+            - extract_signal(words, layout, f'{name}_roset1_counter').astype(np.int64)
+    return np.arange(len(words), dtype=np.int64) * subsampling, values
+
+def write_capture(filename, layout, data, data_width, samplerate=None, offset=0):
+    """Write analyzer words with their `layout` of (signal name, width) pairs."""
+    words = words_to_lanes(data, data_width)
+    header = json.dumps({
+        'version': CAPTURE_VERSION,
+        'layout': [[name, width] for name, width in layout],
+        'data_width': data_width,
+        'length': len(words),
+        'samplerate': samplerate,
+        'offset': offset,
+    }).encode()
+    data_offset = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+    header = header.ljust(data_offset - len(MAGIC) - 8)
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write(words.astype('<u8', copy=False).tobytes())
+    os.replace(tmp_filename, filename)
+
+def save_analyzer(analyzer, filename):
+    """Save the uploaded data of a `LiteScopeAnalyzerDriver` as a binary capture."""
+    samplerate = getattr(analyzer, 'samplerate', None)
+    if samplerate is not None:
+        samplerate /= getattr(analyzer, 'subsampling', 1)
+    write_capture(filename, analyzer.layouts[analyzer.group], analyzer.data, analyzer.data_width,
+        samplerate=samplerate, offset=analyzer.offset)
+
+
+class Capture:
+    """Memory-mapped binary capture, `capture[signal]` returns the samples of a signal."""
+
+    def __init__(self, filename, mmap=True):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a capture file')
+            header_len, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len))
+        if header['version'] > CAPTURE_VERSION:
+            raise ValueError(f'unsupported capture version {header["version"]}')
+        self.layout = [tuple(signal) for signal in header['layout']]
+        self.data_width = header['data_width']
+        self.samplerate = header['samplerate']
+        self.offset = header['offset']
+        shape = (header['length'], _lanes(self.data_width))
+        data_offset = len(MAGIC) + 8 + header_len
+        if mmap and header['length']:
+            self.words = np.memmap(filename, dtype='<u8', mode='r', offset=data_offset, shape=shape)
+        else:
+            self.words = np.fromfile(filename, dtype='<u8', offset=data_offset).reshape(shape)
+
+    def __len__(self):
+        return len(self.words)
+
+    @property
+    def signals(self):
+        return [name for name, _ in self.layout]
+
+    def __getitem__(self, signal):
+        return extract_signal(self.words, self.layout, signal)
+
+    def data(self):
+        """Analyzer words as Python ints, like `LiteScopeAnalyzerDriver.data`."""
+        return lanes_to_data(self.words, self.data_width)
+
+    def export(self, filename, flatten=False):
+        """Export to a LiteScope dump, the format is chosen from the extension."""
+        from litescope.software.dump import VCDDump, CSVDump, PythonDump, JSONDump, SigrokDump
+        ext = Path(filename).suffix
+        if ext == ".vcd":
+            dump = VCDDump(samplerate=self.samplerate)
+        elif ext == ".csv":
+            dump = CSVDump()
+        elif ext == ".py":
+            dump = PythonDump()
+        elif ext == ".json":
+            dump = JSONDump()
+        elif ext == ".sr":
+            dump = SigrokDump(samplerate=self.samplerate)
+        else:
+            raise NotImplementedError(f'unsupported dump format {ext}')
+        if not flatten:
+            dump.add_from_layout(self.layout, self.data())
+        else:
+            dump.add_from_layout_flatten(self.layout, self.data())
+        dump.add_scope_clk()
+        dump.add_scope_trig(self.offset)
+        dump.write(filename)
+
+
+def read_python_signal(filename, signal):
+    """Read one signal of a LiteScope Python dump without importing the module.
+
+    The samples duplicated by the dump are dropped.
+    """
+    name = f'"{signal}"'
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith(name):
+                values = line[line.index('[')+1:line.rindex(']')]
+                return np.fromstring(values, dtype=np.int64, sep=',')[::2]
+    raise KeyError(f'{signal} not found in {filename}')
+
+def load_signal(filename, signal):
+    """Samples of a signal from a binary capture or a LiteScope Python dump."""
+    if Path(filename).suffix == '.py':
+        return read_python_signal(filename, signal)
+    return Capture(filename)[signal]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a binary LiteScope capture to a dump (.vcd, .py, .csv, .json, .sr)")
+    parser.add_argument('capture')
+    parser.add_argument('dump_file')
+    parser.add_argument('--flatten', action='store_true')
+    args = parser.parse_args()
+
+    Capture(args.capture).export(args.dump_file, flatten=args.flatten)
+
+if __name__ == "__main__":
+    main()
+
+
+import unittest
+
+
+class CaptureTestCase(unittest.TestCase):
+
+    def test_puf_responses(self):
+        from litescope.software.dump import Dump
+        layout = [('puf_reset', 1), ('puf_roset0_counter', 16), ('puf_roset1_counter', 16), ('puf_ff_o', 1)]
+        rng = np.random.default_rng(0)
+        counters = rng.integers(0, 2**16, size=(2, 50)).tolist()
+        ff_o = rng.integers(0, 2, size=50).tolist()
+        data = [1 | c0 << 1 | c1 << 17 | ff << 33 for c0, c1, ff in zip(*counters, ff_o)]
+        subwords = [word >> (32*i) & 0xffffffff for word in data for i in range(2)]
+        words = subwords_to_lanes(subwords, 34)
+        self.assertEqual(lanes_to_data(words, 34), data)
+
+        # same responses as decoded through a LiteScope dump
+        dump = Dump()
+        dump.add_from_layout(layout, lanes_to_data(words, 34))
+        signals = {variable.name: variable.values[::2] for variable in dump.variables}
+        offsets, values = puf_responses(words, layout, 34, PUFType.RO, subsampling=10)
+        self.assertEqual(offsets.tolist(), list(range(0, 500, 10)))
+        self.assertEqual(values.tolist(), [c0 - c1 for c0, c1 in zip(signals['puf_roset0_counter'], signals['puf_roset1_counter'])])
+        _, values = puf_responses(data, layout, 34, PUFType.HYBRID)
+        self.assertEqual(values.tolist(), signals['puf_ff_o'])
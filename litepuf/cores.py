@@ -3,6 +3,7 @@
 
 from migen import *
 from migen.genlib.cdc import MultiReg
+from migen.genlib.fifo import SyncFIFO
 from migen.genlib.misc import WaitTimer
 
 from litex.soc.interconnect.csr import *
@@ -11,6 +12,13 @@ from .oscillator import RingOscillator, ROSet
 from . import PUFType
 
 
+challenge_layout = [
+    ("reset", 1),
+    ("cell0", 8),
+    ("cell1", 8),
+]
+
+
 class RingOscillator2(Module, AutoCSR):
     def __init__(self, pads, clock_domain="sys"):
         counter  = Signal(20)
@@ -133,11 +141,15 @@ class RingOscillatorPUF(Module, AutoCSR):
     def __init__(self, oscillators, clock_domain="sys", pulse_comparator=True):
         self.bit_value = comparator = Signal()
         self.reset = Signal()
+        self.ready = Signal()
+        self.sequenced = Signal()
+        self.challenge = Record(challenge_layout)
 
         self._reset = CSRStorage(reset=1)
         self._cell0_select = select0 = CSRStorage(8)
         self._cell1_select = select1 = CSRStorage(8)
         self._bit_value = CSRStatus(reset=0)
+        self._ready = CSRStatus(reset=0)
 
         ro_sets = (
             ROSet(oscillators[0]),
@@ -152,11 +164,25 @@ class RingOscillatorPUF(Module, AutoCSR):
         self.submodules.ro_set0 = ro_sets[0]
         self.submodules.ro_set1 = ro_sets[1]
 
+        # challenge from the CSRs, or from a ChallengeSequencer when sequenced
+        csr_challenge = Record(challenge_layout)
+        self.comb += \
+            If(self.sequenced,
+                self.reset.eq(self.challenge.reset),
+                ro_sets[0].select.eq(self.challenge.cell0),
+                ro_sets[1].select.eq(self.challenge.cell1)
+            ).Else(
+                self.reset.eq(csr_challenge.reset),
+                ro_sets[0].select.eq(csr_challenge.cell0),
+                ro_sets[1].select.eq(csr_challenge.cell1)
+            )
+
         self.specials += [
-            MultiReg(self._reset.storage, self.reset, clock_domain),
-            MultiReg(select0.storage, ro_sets[0].select, clock_domain),
-            MultiReg(select1.storage, ro_sets[1].select, clock_domain),
+            MultiReg(self._reset.storage, csr_challenge.reset, clock_domain),
+            MultiReg(select0.storage, csr_challenge.cell0, clock_domain),
+            MultiReg(select1.storage, csr_challenge.cell1, clock_domain),
             MultiReg(comparator, self._bit_value.status, clock_domain),
+            MultiReg(self.ready, self._ready.status, clock_domain),
         ]
 
         ro_sets[0].add_counter(20)
@@ -169,12 +195,18 @@ class RingOscillatorPUF(Module, AutoCSR):
                 self.pulse_comp.pulse0.eq(ro_sets[0].counter[-1]),
                 self.pulse_comp.pulse1.eq(ro_sets[1].counter[-1])
             ]
-            self.comb += comparator.eq(self.pulse_comp.select)
+            self.comb += [
+                comparator.eq(self.pulse_comp.select),
+                self.ready.eq(self.pulse_comp.ready)
+            ]
         else:
             timer = WaitTimer(40) # wait 40 clock cycles at sys freq (50 Hz)
             latch = Signal()
             self.submodules += timer
-            self.comb += timer.wait.eq(~self.reset)
+            self.comb += [
+                timer.wait.eq(~self.reset),
+                self.ready.eq(latch)
+            ]
             self.sync += [
                 latch.eq(timer.done),
                 If(timer.done & ~latch,
@@ -190,11 +222,15 @@ class TransientEffectRingOscillatorPUF(Module, AutoCSR):
     def __init__(self, cell_sets, clock_domain="sys"):
         self.bit_value = comparator = Signal(32)
         self.reset = Signal()
+        self.ready = Signal()
+        self.sequenced = Signal()
+        self.challenge = Record(challenge_layout)
 
         self._reset = CSRStorage(reset=1)
         self._cell0_select = select0 = CSRStorage(8)
         self._cell1_select = select1 = CSRStorage(8)
         self._bit_value = CSRStatus(32, reset=0)
+        self._ready = CSRStatus(reset=0)
 
         ro_sets = (
             ROSet(cell_sets[0]),
@@ -209,11 +245,25 @@ class TransientEffectRingOscillatorPUF(Module, AutoCSR):
         self.submodules.ro_set0 = ro_sets[0]
         self.submodules.ro_set1 = ro_sets[1]
 
+        # challenge from the CSRs, or from a ChallengeSequencer when sequenced
+        csr_challenge = Record(challenge_layout)
+        self.comb += \
+            If(self.sequenced,
+                self.reset.eq(self.challenge.reset),
+                ro_sets[0].select.eq(self.challenge.cell0),
+                ro_sets[1].select.eq(self.challenge.cell1)
+            ).Else(
+                self.reset.eq(csr_challenge.reset),
+                ro_sets[0].select.eq(csr_challenge.cell0),
+                ro_sets[1].select.eq(csr_challenge.cell1)
+            )
+
         self.specials += [
-            MultiReg(self._reset.storage, self.reset, clock_domain),
-            MultiReg(select0.storage, ro_sets[0].select, clock_domain),
-            MultiReg(select1.storage, ro_sets[1].select, clock_domain),
+            MultiReg(self._reset.storage, csr_challenge.reset, clock_domain),
+            MultiReg(select0.storage, csr_challenge.cell0, clock_domain),
+            MultiReg(select1.storage, csr_challenge.cell1, clock_domain),
             MultiReg(comparator, self._bit_value.status, clock_domain),
+            MultiReg(self.ready, self._ready.status, clock_domain),
         ]
 
         ro_sets[0].add_counter(32)
@@ -222,7 +272,10 @@ class TransientEffectRingOscillatorPUF(Module, AutoCSR):
         timer = WaitTimer(16) # wait 16 clock cycles at sys freq (50 Hz)
         latch = Signal()
         self.submodules += timer
-        self.comb += timer.wait.eq(~self.reset)
+        self.comb += [
+            timer.wait.eq(~self.reset),
+            self.ready.eq(latch)
+        ]
         self.sync += [
             latch.eq(timer.done),
             If(timer.done & ~latch,
@@ -238,11 +291,15 @@ class PowerOptimizedHybridOscillatorArbiterPUF(Module, AutoCSR):
     def __init__(self, oscillators, clock_domain="sys"):
         self.bit_value = Signal()
         self.reset = Signal()
+        self.ready = Signal()
+        self.sequenced = Signal()
+        self.challenge = Record(challenge_layout)
 
         self._reset = CSRStorage(reset=1)
         self._cell0_select = select0 = CSRStorage(8)
         self._cell1_select = select1 = CSRStorage(8)
         self._bit_value = CSRStatus(reset=0)
+        self._ready = CSRStatus(reset=0)
 
         ro_sets = (
             ROSet(oscillators[0]),
@@ -257,11 +314,25 @@ class PowerOptimizedHybridOscillatorArbiterPUF(Module, AutoCSR):
         self.submodules.ro_set0 = ro_sets[0]
         self.submodules.ro_set1 = ro_sets[1]
 
+        # challenge from the CSRs, or from a ChallengeSequencer when sequenced
+        csr_challenge = Record(challenge_layout)
+        self.comb += \
+            If(self.sequenced,
+                self.reset.eq(self.challenge.reset),
+                ro_sets[0].select.eq(self.challenge.cell0),
+                ro_sets[1].select.eq(self.challenge.cell1)
+            ).Else(
+                self.reset.eq(csr_challenge.reset),
+                ro_sets[0].select.eq(csr_challenge.cell0),
+                ro_sets[1].select.eq(csr_challenge.cell1)
+            )
+
         self.specials += [
-            MultiReg(self._reset.storage, self.reset, clock_domain),
-            MultiReg(select0.storage, ro_sets[0].select, clock_domain),
-            MultiReg(select1.storage, ro_sets[1].select, clock_domain),
+            MultiReg(self._reset.storage, csr_challenge.reset, clock_domain),
+            MultiReg(select0.storage, csr_challenge.cell0, clock_domain),
+            MultiReg(select1.storage, csr_challenge.cell1, clock_domain),
             MultiReg(self.bit_value, self._bit_value.status, clock_domain),
+            MultiReg(self.ready, self._ready.status, clock_domain),
         ]
 
         self.ff_o = Signal()
@@ -274,7 +345,10 @@ class PowerOptimizedHybridOscillatorArbiterPUF(Module, AutoCSR):
         timer = WaitTimer(10) # wait 10 clock cycles at sys freq (50 Hz)
         latch = Signal()
         self.submodules += timer
-        self.comb += timer.wait.eq(~self.reset)
+        self.comb += [
+            timer.wait.eq(~self.reset),
+            self.ready.eq(latch)
+        ]
         self.sync += [
             latch.eq(timer.done),
             If(timer.done & ~latch,
@@ -283,6 +357,136 @@ class PowerOptimizedHybridOscillatorArbiterPUF(Module, AutoCSR):
         ]
 
 
+class ChallengeSequencer(Module, AutoCSR):
+    """Apply a sequence of challenges to a PUF core and queue the responses.
+
+    The challenges are either all the pairs of the first `cells` cells, in the order of
+    `combinations(range(cells), 2)`, or the first `length` entries of the challenge memory
+    (cell0 in bits 0-7, cell1 in bits 8-15). The sequence is applied `repetitions` times.
+    Responses are pushed in a FIFO as words of cell0 (bits 0-7), cell1 (bits 8-15) and
+    the response (from bit 16), and reading the `data` CSR pops the FIFO. The sequencer
+    waits when the FIFO is full. A start with an empty sequence (fewer than 2 cells, a
+    `length` or `repetitions` of 0) is ignored.
+    """
+
+    def __init__(self, puf, cells=8, depth=512, memory_depth=64, reset_cycles=4):
+        self._start = CSR()
+        self._enable = CSRStorage(reset=0)
+        self._mode = CSRStorage() # 0: pairs of cells, 1: challenge memory
+        self._cells = CSRStorage(8, reset=cells)
+        self._length = CSRStorage(bits_for(memory_depth), reset=memory_depth)
+        self._repetitions = CSRStorage(16, reset=1)
+        self._challenge_adr = CSRStorage(bits_for(memory_depth - 1))
+        self._challenge_dat = CSRStorage(16)
+        self._busy = CSRStatus()
+        self._level = CSRStatus(bits_for(depth))
+        self._data = CSRStatus(16 + len(puf.bit_value))
+
+        # challenge memory, written from the CSRs
+        memory = Memory(16, memory_depth)
+        write_port = memory.get_port(write_capable=True)
+        read_port = memory.get_port(async_read=True)
+        self.specials += memory, write_port, read_port
+        self.comb += [
+            write_port.adr.eq(self._challenge_adr.storage),
+            write_port.dat_w.eq(self._challenge_dat.storage),
+            write_port.we.eq(self._challenge_dat.re)
+        ]
+
+        self.submodules.fifo = fifo = SyncFIFO(16 + len(puf.bit_value), depth)
+        self.comb += [
+            self._level.status.eq(fifo.level),
+            self._data.status.eq(fifo.dout),
+            fifo.re.eq(self._data.we)
+        ]
+
+        # the pulse comparator is not synchronous to sys
+        ready = Signal()
+        response = Signal(len(puf.bit_value))
+        self.specials += [
+            MultiReg(puf.ready, ready),
+            MultiReg(puf.bit_value, response),
+        ]
+
+        cell0 = Signal(8)
+        cell1 = Signal(8)
+        index = Signal(bits_for(memory_depth))
+        repetition = Signal(16)
+        hold = Signal(max=reset_cycles + 1)
+        last = Signal()
+        empty = Signal()
+        self.comb += [
+            empty.eq((self._repetitions.storage == 0) |
+                Mux(self._mode.storage, self._length.storage == 0, self._cells.storage < 2)),
+            read_port.adr.eq(index),
+            If(self._mode.storage,
+                puf.challenge.cell0.eq(read_port.dat_r[:8]),
+                puf.challenge.cell1.eq(read_port.dat_r[8:]),
+                last.eq(index == self._length.storage - 1)
+            ).Else(
+                puf.challenge.cell0.eq(cell0),
+                puf.challenge.cell1.eq(cell1),
+                last.eq((cell0 == self._cells.storage - 2) & (cell1 == self._cells.storage - 1))
+            ),
+            puf.sequenced.eq(self._enable.storage),
+            fifo.din.eq(Cat(puf.challenge.cell0, puf.challenge.cell1, response))
+        ]
+
+        # clearing enable aborts the sequence
+        self.submodules.fsm = fsm = ResetInserter()(FSM(reset_state="IDLE"))
+        self.comb += fsm.reset.eq(~self._enable.storage)
+        fsm.act("IDLE",
+            puf.challenge.reset.eq(1),
+            NextValue(cell0, 0),
+            NextValue(cell1, 1),
+            NextValue(index, 0),
+            NextValue(repetition, 1),
+            If(self._start.re & self._enable.storage & ~empty,
+                NextValue(hold, reset_cycles),
+                NextState("RESET")
+            )
+        )
+        fsm.act("RESET",
+            self._busy.status.eq(1),
+            puf.challenge.reset.eq(1),
+            NextValue(hold, hold - 1),
+            If(hold == 0,
+                NextState("MEASURE")
+            )
+        )
+        fsm.act("MEASURE",
+            self._busy.status.eq(1),
+            If(ready,
+                NextState("PUSH") # let the response settle after ready
+            )
+        )
+        fsm.act("PUSH",
+            self._busy.status.eq(1),
+            fifo.we.eq(1),
+            If(fifo.writable,
+                NextValue(hold, reset_cycles),
+                NextState("RESET"),
+                If(last,
+                    NextValue(cell0, 0),
+                    NextValue(cell1, 1),
+                    NextValue(index, 0),
+                    NextValue(repetition, repetition + 1),
+                    If(repetition == self._repetitions.storage,
+                        NextState("IDLE")
+                    )
+                ).Else(
+                    NextValue(index, index + 1),
+                    If(cell1 == self._cells.storage - 1,
+                        NextValue(cell0, cell0 + 1),
+                        NextValue(cell1, cell0 + 2)
+                    ).Else(
+                        NextValue(cell1, cell1 + 1)
+                    )
+                )
+            )
+        )
+
+
 class SpeedOptimizedHybridOscillatorArbiterPUF(Module, AutoCSR):
     def __init__(self, enable, oscillators, clock_domain="sys"):
         self.key = key = Signal(len(oscillators[0]))
@@ -314,3 +518,93 @@ class Muxer(Module, AutoCSR):
         self.sync += counter.status.eq(mux[select.storage])
 
         self.submodules += ClockGenerator(pads, length)
+
+
+import unittest
+
+
+class ChallengeSequencerTestCase(unittest.TestCase):
+
+    class PUF(Module):
+        """Responds to a challenge `delay` cycles after its reset, with bit 0 of cell0 + cell1."""
+
+        def __init__(self, delay=3):
+            self.challenge = Record(challenge_layout)
+            self.sequenced = Signal()
+            self.ready = Signal()
+            self.bit_value = Signal()
+            elapsed = Signal(max=delay + 1)
+            self.sync += \
+                If(self.challenge.reset,
+                    elapsed.eq(0)
+                ).Elif(elapsed != delay,
+                    elapsed.eq(elapsed + 1)
+                )
+            self.comb += [
+                self.ready.eq(elapsed == delay),
+                self.bit_value.eq(self.challenge.cell0[0] ^ self.challenge.cell1[0])
+            ]
+
+    def run_sequence(self, cells=4, challenges=None, repetitions=1, depth=16):
+        puf = self.PUF()
+        dut = ChallengeSequencer(puf, depth=depth)
+        dut.submodules += puf
+        result = {}
+
+        def generator():
+            if challenges is not None:
+                for adr, (cell0, cell1) in enumerate(challenges):
+                    yield dut._challenge_adr.storage.eq(adr)
+                    yield dut._challenge_dat.storage.eq(cell0 | cell1 << 8)
+                    yield dut._challenge_dat.re.eq(1)
+                    yield
+                    yield dut._challenge_dat.re.eq(0)
+                yield dut._length.storage.eq(len(challenges))
+                yield dut._mode.storage.eq(1)
+            yield dut._cells.storage.eq(cells)
+            yield dut._repetitions.storage.eq(repetitions)
+            yield dut._enable.storage.eq(1)
+            yield dut._start.re.eq(1)
+            yield
+            yield dut._start.re.eq(0)
+            busy = []
+            for _ in range(500):
+                yield
+                busy.append((yield dut._busy.status))
+                if not busy[-1] and (any(busy) or len(busy) > 50):
+                    break
+            result['busy'] = busy
+            result['level'] = level = (yield dut._level.status)
+            words = []
+            for _ in range(level):
+                words.append((yield dut._data.status))
+                yield dut._data.we.eq(1)
+                yield
+                yield dut._data.we.eq(0)
+                yield
+            result['words'] = [(word & 0xff, (word >> 8) & 0xff, word >> 16) for word in words]
+            result['level_after'] = (yield dut._level.status)
+
+        run_simulation(dut, generator())
+        return result
+
+    def test_pairs(self):
+        from itertools import combinations
+        result = self.run_sequence(cells=4, repetitions=2)
+        expected = [(cell0, cell1, (cell0 ^ cell1) & 1) for cell0, cell1 in combinations(range(4), 2)]
+        self.assertEqual(result['words'], expected*2)
+        self.assertEqual(result['level'], 12)
+        self.assertEqual(result['level_after'], 0)
+        self.assertTrue(any(result['busy']))
+        self.assertEqual(result['busy'][-1], 0)
+
+    def test_challenges(self):
+        challenges = [(3, 1), (0, 7), (5, 5)]
+        result = self.run_sequence(challenges=challenges)
+        self.assertEqual(result['words'], [(cell0, cell1, (cell0 ^ cell1) & 1) for cell0, cell1 in challenges])
+
+    def test_empty(self):
+        for kwargs in ({'cells': 1}, {'challenges': []}, {'repetitions': 0}):
+            result = self.run_sequence(**kwargs)
+            self.assertFalse(any(result['busy']), kwargs)
+            self.assertEqual(result['level'], 0, kwargs)
@@ -1,6 +1,9 @@
-from itertools import permutations
 from operator import itemgetter
 import statistics
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 
 def hamming_dist(x, y):
@@ -20,42 +23,331 @@ def bitwise_mode(iterable, n):
 def graycode(n):
     return n ^ (n >> 1)
 
-def uniqueness(chip_dumps, response_len=1):
-    def permute_chips(chip_dumps, response_len):
-        for chip1, chip2 in permutations(chip_dumps, 2):
-            distances = list()
-            for challenge in chip1:
-                resp1 = bitwise_mode(chip1[challenge], response_len)
-                resp2 = bitwise_mode(chip2[challenge], response_len)
-                distances.append(hamming_dist(resp1, resp2))
-            yield statistics.mean(
-                [distance/response_len for distance in distances]
-            )
-
-    k_chips = len(chip_dumps)
+
+# Array engine ------------------------------------------------------------------------------------
+#
+# Responses are packed into a (chip, challenge, sample) uint64 tensor, the bit axis being packed
+# into the integer words. Challenges may hold a different number of samples: the tensor is padded
+# at the end of the sample axis and `counts` gives the number of valid samples per (chip, challenge).
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(x):
+    """Number of set bits of each element of an unsigned integer array."""
+    x = np.asarray(x)
+    if hasattr(np, 'bitwise_count'): # NumPy >= 2.0
+        return np.bitwise_count(x)
+    x = np.ascontiguousarray(x)
+    return _POPCOUNT_TABLE[x.view(np.uint8).reshape(x.shape + (x.itemsize,))].sum(axis=-1)
+
+def pack_responses(chip_dumps, challenges=None):
+    """Pack a list of {challenge: [responses]} dumps into a response tensor.
+
+    Returns the (chip, challenge, sample) tensor and the (chip, challenge) sample counts.
+    Challenges are ordered as in the first chip unless given explicitly.
+    """
+    if challenges is None:
+        challenges = list(chip_dumps[0]) if chip_dumps else []
+    n_samples = max((len(chip[c]) for chip in chip_dumps for c in challenges), default=0)
+    responses = np.zeros((len(chip_dumps), len(challenges), n_samples), dtype=np.uint64)
+    counts = np.zeros((len(chip_dumps), len(challenges)), dtype=np.int64)
+    for chip_idx, chip in enumerate(chip_dumps):
+        for challenge_idx, challenge in enumerate(challenges):
+            chip_responses = chip[challenge]
+            responses[chip_idx, challenge_idx, :len(chip_responses)] = chip_responses
+            counts[chip_idx, challenge_idx] = len(chip_responses)
+    return responses, counts
+
+def majority_vote(responses, counts, response_len=1):
+    """Bitwise majority over the sample axis (the last one).
+
+    Ties are resolved to the bit of the first sample, like `statistics.mode`.
+    """
+    responses = np.asarray(responses, dtype=np.uint64)
+    counts = np.asarray(counts)
+    valid = np.arange(responses.shape[-1]) < counts[..., None]
+    first = responses[..., 0] if responses.shape[-1] else np.zeros(counts.shape, dtype=np.uint64)
+    majority = np.zeros(counts.shape, dtype=np.uint64)
+    for b in range(response_len):
+        shift = np.uint64(b)
+        ones = (((responses >> shift) & np.uint64(1)).astype(bool) & valid).sum(axis=-1)
+        bit = np.where(2*ones == counts, (first >> shift) & np.uint64(1), 2*ones > counts)
+        majority |= bit.astype(np.uint64) << shift
+    return majority
+
+def mode_vote(responses, counts):
+    """Most common response over the sample axis (the last one).
+
+    Ties are resolved to the value seen first, like `statistics.mode`.
+    """
+    responses = np.asarray(responses)
+    counts = np.asarray(counts)
+    n_samples = responses.shape[-1]
+    if n_samples == 0:
+        return np.zeros(counts.shape, dtype=responses.dtype)
+    positions = np.arange(n_samples)
+    valid = positions < counts[..., None]
+    # stable sort keeps equal values in order of appearance, invalid samples go last
+    order = np.lexsort((responses, ~valid), axis=-1)
+    values = np.take_along_axis(responses, order, axis=-1)
+    valid = np.take_along_axis(valid, order, axis=-1)
+    run_start = np.ones(values.shape, dtype=bool)
+    run_start[..., 1:] = (values[..., 1:] != values[..., :-1]) | (valid[..., 1:] != valid[..., :-1])
+    run_end = np.ones(values.shape, dtype=bool)
+    run_end[..., :-1] = run_start[..., 1:]
+    start = np.maximum.accumulate(np.where(run_start, positions, 0), axis=-1)
+    end = np.flip(np.minimum.accumulate(np.flip(np.where(run_end, positions, n_samples), axis=-1), axis=-1), axis=-1)
+    first_seen = np.take_along_axis(order, start, axis=-1)
+    # longest run first, then earliest first appearance
+    score = np.where(valid, (end - start + 1) * (n_samples + 1) + (n_samples - first_seen), -1)
+    best = np.argmax(score, axis=-1)[..., None]
+    return np.take_along_axis(values, best, axis=-1)[..., 0]
+
+def extract_bits(responses, positions):
+    """Gather the bits at `positions` (most significant first) into packed responses.
+
+    Runs of consecutive positions are extracted with a single shift and mask.
+    """
+    responses = np.asarray(responses, dtype=np.uint64)
+    extracted = np.zeros(responses.shape, dtype=np.uint64)
+    positions = list(positions)
+    while positions:
+        run = 1
+        while run < len(positions) and positions[run] == positions[0] - run:
+            run += 1
+        low = positions[run-1]
+        mask = np.uint64((1 << run) - 1)
+        extracted = (extracted << np.uint64(run)) | ((responses >> np.uint64(low)) & mask)
+        positions = positions[run:]
+    return extracted
+
+def steadiness_array(responses, counts, references, response_len=1):
+    """Per-challenge steadiness of one chip.
+
+    `responses` is a (challenge, sample) array and `references` a (challenge,) array.
+    Challenges without any sample have a NaN steadiness.
+    """
+    responses = np.asarray(responses, dtype=np.uint64)
+    references = np.asarray(references, dtype=np.uint64)
+    counts = np.asarray(counts)
+    valid = np.arange(responses.shape[-1]) < counts[..., None]
+    distances = np.where(valid, popcount(responses ^ references[..., None]), 0).sum(axis=-1)
+    total = counts * response_len
+    return 1 - np.divide(distances, total, out=np.full(counts.shape, np.nan), where=total > 0)
+
+def pack_bits(references, response_len=1):
+    """Pack (chip, challenge) responses into (chip, word) uint64 bit vectors.
+
+    Every bit plane of the responses is packed along the challenge axis, the Hamming
+    distance between two chips is the popcount of the XOR of their bit vectors.
+    """
+    references = np.asarray(references, dtype=np.uint64)
+    planes = [
+        np.packbits(((references >> np.uint64(b)) & np.uint64(1)).astype(np.uint8), axis=-1)
+        for b in range(response_len)
+    ]
+    packed = np.concatenate(planes, axis=-1)
+    padding = -packed.shape[-1] % 8
+    packed = np.pad(packed, [(0, 0)] * (packed.ndim - 1) + [(0, padding)])
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+def _hamming_block(rows, columns, row_masks=None, column_masks=None):
+    differences = rows[:, None, :] ^ columns[None, :, :]
+    if row_masks is not None:
+        differences &= row_masks[:, None, :] & column_masks[None, :, :]
+    return popcount(differences).sum(axis=-1, dtype=np.int64)
+
+def hamming_matrix(references, response_len=1, block_size=256, workers=None, valid=None):
+    """Pairwise Hamming distances between chip references, summed over challenges.
+
+    `references` is a (chip, challenge) array. If a (chip, challenge) `valid` mask is
+    given, only the challenges valid for both chips of a pair are compared. Hamming
+    distance is symmetric, so only the blocks of the upper triangle are computed and
+    mirrored. Blocks are spread over a process pool of `workers` processes (all CPUs by
+    default, 1 to run in-process).
+    """
+    packed = pack_bits(references, response_len)
+    masks = None
+    if valid is not None:
+        # one mask bit per response bit, packed like the references
+        masks = pack_bits(np.where(valid, np.uint64((1 << response_len) - 1), np.uint64(0)), response_len)
+    k_chips = packed.shape[0]
+    blocks = [
+        (row, column)
+        for row in range(0, k_chips, block_size)
+        for column in range(row, k_chips, block_size)
+    ]
+    block = lambda array, start: None if array is None else array[start:start+block_size]
+
+    if workers == 1 or len(blocks) <= 1:
+        results = [
+            _hamming_block(block(packed, row), block(packed, column), block(masks, row), block(masks, column))
+            for row, column in blocks
+        ]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(
+                _hamming_block,
+                [block(packed, row) for row, _ in blocks],
+                [block(packed, column) for _, column in blocks],
+                [block(masks, row) for row, _ in blocks],
+                [block(masks, column) for _, column in blocks],
+            ))
+
+    distances = np.zeros((k_chips, k_chips), dtype=np.int64)
+    for (row, column), result in zip(blocks, results):
+        rows, columns = result.shape
+        distances[row:row+rows, column:column+columns] = result
+        distances[column:column+columns, row:row+rows] = result.T
+    return distances
+
+def fractional_distances(references, valid, response_len=1, workers=None):
+    """Pairwise Hamming distances normalised by the number of bits compared.
+
+    Only the challenges `valid` for both chips are compared, the distance of two chips
+    without any common challenge is NaN.
+    """
+    valid = np.asarray(valid, dtype=bool)
+    if valid.all():
+        distances = hamming_matrix(references, response_len, workers=workers)
+        return distances / (references.shape[1] * response_len)
+    distances = hamming_matrix(references, response_len, workers=workers, valid=valid)
+    common = valid.astype(np.float64) @ valid.T.astype(np.float64) * response_len
+    return np.divide(distances, common, out=np.full(distances.shape, np.nan), where=common > 0)
+
+def distance_matrix(responses, counts, response_len=1, workers=None):
+    """Pairwise fractional Hamming distances between the majority responses of chips."""
+    references = majority_vote(responses, counts, response_len)
+    return fractional_distances(references, np.asarray(counts) > 0, response_len, workers)
+
+def mean_distance(distances):
+    """Mean of the off-diagonal entries of a pairwise distance matrix, 1 for a single chip.
+
+    NaN entries (pairs without any common challenge) are left out.
+    """
+    k_chips = len(distances)
     if k_chips == 1:
         return 1
-    sum_permutations = sum(permute_chips(chip_dumps, response_len))
-    return 1 / (k_chips*(k_chips-1)) * sum_permutations
+    off_diagonal = distances[~np.eye(k_chips, dtype=bool)]
+    off_diagonal = off_diagonal[~np.isnan(off_diagonal)]
+    return float(off_diagonal.sum()) / len(off_diagonal)
+
+def bias(references, valid, response_len=1):
+    """Ratio of ones of the `valid` (chip, challenge) entries of majority responses."""
+    valid = np.asarray(valid, dtype=bool)
+    ones = popcount(np.where(valid, np.asarray(references, dtype=np.uint64), np.uint64(0))).sum(dtype=np.int64)
+    return int(ones) / (int(valid.sum()) * response_len)
+
+def uniqueness_array(responses, counts, response_len=1, workers=None):
+    """Uniqueness of a (chip, challenge, sample) response tensor."""
+    if responses.shape[0] == 1:
+        return 1
+    return mean_distance(distance_matrix(responses, counts, response_len, workers))
+
+def randomness_array(responses, counts, response_len=1):
+    """Bias (ratio of ones) of the majority responses of a response tensor."""
+    references = majority_vote(responses, counts, response_len)
+    return bias(references, np.asarray(counts) > 0, response_len)
+
+
+# Evaluation of response stores ------------------------------------------------------------------
+
+Metrics = namedtuple('Metrics', ['uniqueness', 'steadiness', 'randomness', 'distances'])
+
+def _align_challenges(arrays, axes, fill):
+    """Concatenate (chip, challenge) arrays of stores along the union of their challenges."""
+    if all(axis == axes[0] for axis in axes):
+        return np.concatenate(arrays)
+    challenges = np.unique(np.concatenate([np.asarray(axis) for axis in axes]))
+    aligned = []
+    for array, axis in zip(arrays, axes):
+        columns = np.searchsorted(challenges, axis)
+        aligned_array = np.full((array.shape[0], len(challenges)), fill, dtype=array.dtype)
+        aligned_array[:, columns] = array
+        aligned.append(aligned_array)
+    return np.concatenate(aligned)
+
+def evaluate(stores, offset_attr=None, views=((None, 1),), ref_offset=None, reference=mode_vote, post=None, workers=None):
+    """Evaluate every offset of a sequence of response stores (see `litepuf.store`).
+
+    `stores` may hold all the chips at once or a few chips each: between stores, only the
+    majority responses of the chips are kept, and aligned on the union of the challenges
+    of all the stores (a chip is only compared on the challenges it has). `views` is a list of (post-processing,
+    response length) pairs evaluated from the same responses, after the common `post`
+    processing which is applied once per offset. Steadiness is measured
+    against `reference` of each chip, computed at `ref_offset` if given.
+
+    Challenges without samples for a chip (at the offset or the reference offset) are
+    left out of its steadiness, of the distances and of the randomness. Chips without
+    any sample at an offset are left out of its steadiness list.
+
+    Returns the chip idents and `{offset: [Metrics per view]}`, offsets sorted.
+    """
+    idents = []
+    majorities = defaultdict(list)
+    valids = defaultdict(list)
+    challenge_axes = defaultdict(list)
+    steadiness_per_chip = defaultdict(list)
+    for store in stores:
+        idents += store.idents
+        if ref_offset is not None:
+            values, ref_counts = store.tensor(offset_attr, ref_offset)
+            if post:
+                values = post(values)
+            ref_references = [reference(view_post(values) if view_post else values, ref_counts) for view_post, _ in views]
+        for offset, values, counts in store.partition(offset_attr):
+            if post:
+                values = post(values)
+            valid = counts > 0
+            steady_valid = valid & (ref_counts > 0) if ref_offset is not None else valid
+            for view_idx, (view_post, response_len) in enumerate(views):
+                view_values = view_post(values) if view_post else values
+                if ref_offset is not None:
+                    references = ref_references[view_idx]
+                else:
+                    references = reference(view_values, counts)
+                for chip_idx, chip_references in enumerate(references):
+                    if not steady_valid[chip_idx].any():
+                        continue
+                    steadiness_ = steadiness_array(view_values[chip_idx], counts[chip_idx], chip_references, response_len)
+                    steadiness_per_chip[offset, view_idx].append(statistics.mean(steadiness_[steady_valid[chip_idx]].tolist()))
+                majorities[offset, view_idx].append(majority_vote(view_values, counts, response_len))
+                valids[offset, view_idx].append(valid)
+                challenge_axes[offset, view_idx].append(store.challenges)
+
+    results = defaultdict(list)
+    for offset, view_idx in sorted(majorities):
+        response_len = views[view_idx][1]
+        axes = challenge_axes[offset, view_idx]
+        references = _align_challenges(majorities[offset, view_idx], axes, 0)
+        valid = _align_challenges(valids[offset, view_idx], axes, False)
+        distances = fractional_distances(references, valid, response_len, workers)
+        randomness_ = bias(references, valid, response_len)
+        results[offset].append(Metrics(
+            mean_distance(distances), steadiness_per_chip[offset, view_idx], randomness_, distances
+        ))
+    return idents, dict(results)
+
+
+# Compatibility layer -----------------------------------------------------------------------------
+
+def uniqueness(chip_dumps, response_len=1):
+    if len(chip_dumps) == 1:
+        return 1
+    responses, counts = pack_responses(chip_dumps)
+    return uniqueness_array(responses, counts, response_len)
 
 # for one chip
 def steadiness(chip_dump, references, response_len=1):
-    for challenge, responses in chip_dump.items():
-        ref = references[challenge]
-        distances = [hamming_dist(resp, ref) for resp in responses]
-        # yield a value for each different challenge
-        yield 1 - statistics.mean(
-            [distance/response_len for distance in distances]
-        )
+    responses, counts = pack_responses([chip_dump])
+    references = [references[challenge] for challenge in chip_dump]
+    # yield a value for each different challenge
+    yield from steadiness_array(responses[0], counts[0], references, response_len).tolist()
 
 # bias
 def randomness(chip_dumps, response_len=1):
-    responses = []
-    for chip in chip_dumps:
-        for resp in chip.values():
-            mode = bitwise_mode(resp, response_len)
-            responses.extend(bitfield(mode, response_len))
-    return statistics.mean(responses)
+    responses, counts = pack_responses(chip_dumps)
+    return randomness_array(responses, counts, response_len)
 
 
 import unittest
@@ -77,6 +369,7 @@ class EvaluationTestCase(unittest.TestCase):
 
     def test_uniqueness(self):
         uniqueness_ = uniqueness(self.chips_cr, response_len=1)
+        self.assertAlmostEqual(uniqueness_, 0.5)
 
     def test_steadiness(self):
         references = {
@@ -84,3 +377,71 @@ class EvaluationTestCase(unittest.TestCase):
             'challenge2': 0,
         }
         steadiness_ = steadiness(self.chips_cr[0], references, response_len=1)
+        self.assertEqual(list(steadiness_), [0, 1])
+
+    def test_randomness(self):
+        self.assertAlmostEqual(randomness(self.chips_cr), 0.25)
+
+    def test_majority_vote(self):
+        responses = [0b101, 0b011, 0b110, 0b000, 0b111]
+        majority = majority_vote([responses], [len(responses)], response_len=3)
+        self.assertEqual(int(majority[0]), bitwise_mode(responses, 3))
+        # ties are resolved like statistics.mode
+        majority = majority_vote([[0b01, 0b10]], [2], response_len=2)
+        self.assertEqual(int(majority[0]), bitwise_mode([0b01, 0b10], 2))
+
+    def test_hamming_matrix(self):
+        references = np.array([[0b01, 0b11, 0b10], [0b00, 0b11, 0b01], [0b11, 0b00, 0b10]])
+        expected = [[hamming_dist(int(a), int(b)) for a, b in zip(r1, r2)] for r1 in references for r2 in references]
+        expected = np.array(expected).sum(axis=-1).reshape(3, 3)
+        distances = hamming_matrix(references, response_len=2, block_size=2, workers=2)
+        self.assertEqual(distances.tolist(), expected.tolist())
+
+    def test_extract_bits(self):
+        responses = np.array([0b1011_0010, 0b0110_1001])
+        extracted = extract_bits(responses, [7, 0, 5, 4, 3])
+        self.assertEqual(extracted.tolist(), [0b1_0_110, 0b0_1_101])
+
+    def test_mode_vote(self):
+        responses = [[3, 5, 5, 3, 7, 0], [2, 1, 1, 2, 9, 9]]
+        modes = mode_vote(responses, [6, 4])
+        self.assertEqual(modes.tolist(), [statistics.mode(responses[0]), statistics.mode(responses[1][:4])])
+
+    def test_missing_challenge(self):
+        import warnings
+        from .store import ResponseStore, json_to_columns
+        dumps = [{'0:1': [1, 1, 0], '0:2': [0, 0]}, {'0:1': [1, 1]}]
+        store = ResponseStore(idents=['A', 'C'], columns=json_to_columns(dumps))
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            idents, results = evaluate([store], workers=1)
+        (metrics,) = results[None]
+        self.assertEqual(idents, ['A', 'C'])
+        self.assertEqual(len(metrics.steadiness), 2)
+        self.assertAlmostEqual(metrics.steadiness[0], (2/3 + 1) / 2)
+        self.assertAlmostEqual(metrics.steadiness[1], 1)
+        # only 0:1 is compared, both chips answer 1
+        self.assertEqual(metrics.distances.tolist(), [[0, 0], [0, 0]])
+        self.assertEqual(metrics.uniqueness, 0)
+        self.assertAlmostEqual(metrics.randomness, 2/3)
+        self.assertTrue(np.isnan(steadiness_array([[1, 0]], [0], [1])[0]))
+
+    def test_store_challenges(self):
+        from .store import ResponseStore, json_to_columns
+        stores = [
+            ResponseStore(idents=['A'], columns=json_to_columns([{'0:1': [1], '0:2': [1]}])),
+            ResponseStore(idents=['B'], columns=json_to_columns([{'0:2': [0], '1:2': [1]}])),
+            ResponseStore(idents=['C'], columns=json_to_columns([{'0:1': [0]}])),
+        ]
+        idents, results = evaluate(stores, workers=1)
+        (metrics,) = results[None]
+        self.assertEqual(idents, ['A', 'B', 'C'])
+        # A and B share 0:2, A and C share 0:1, B and C share nothing
+        self.assertTrue(np.isnan(metrics.distances[1, 2]))
+        self.assertEqual(metrics.distances[0].tolist(), [0, 1, 1])
+        self.assertAlmostEqual(metrics.uniqueness, 1)
+        self.assertAlmostEqual(metrics.randomness, 3/5)
+        # the same chips in a single store
+        dumps = [{'0:1': [1], '0:2': [1]}, {'0:2': [0], '1:2': [1]}, {'0:1': [0]}]
+        _, single = evaluate([ResponseStore(idents=idents, columns=json_to_columns(dumps))], workers=1)
+        np.testing.assert_array_equal(single[None][0].distances, metrics.distances)
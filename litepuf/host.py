@@ -0,0 +1,994 @@
+"""Host side of the PUF cores, over a LiteX `RemoteClient`.
+
+A PUF core is read by holding it in reset while the challenge (the two cell selects) is
+written, releasing the reset and reading the response once the core raises its `ready`
+CSR. Bitstreams built before the `ready` CSR existed are read after a fixed delay instead.
+With a `ChallengeSequencer`, the challenges are applied by the gateware and the host only
+drains the response FIFO.
+
+`CSRBatch` queues register accesses and sends them as pipelined Etherbone packets, so
+that many accesses share one round-trip over the bridge. `LocalServer` is a stand-in for
+`litex_server` backed by a register dictionary, with an emulated bridge latency.
+
+`AnalyzerReader` captures a LiteScope analyzer around every challenge of a round with
+one `CSRBatch`, the upload of a capture sharing the round-trips of the next challenges.
+
+`TRNGReader` reads the words of a `RandomLFSR`, `RateMeter` reports the throughput of a
+long acquisition and `ShardWriter` writes the words to size- or time-rotated files.
+
+`acquire_fleet` drives several boards at once, one thread per board, each with its own
+`litex_server` and CSR map.
+"""
+import argparse
+import math
+import os
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import combinations, count, islice
+
+from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneReads, EtherboneWrites
+from litex.tools.remote.etherbone import etherbone_packet_header_length, etherbone_record_header_length
+
+from .capture import lanes_to_data, subwords_to_lanes, words_to_lanes
+
+MAX_RECORD_WORDS = 255 # wcount and rcount are 8 bits
+
+
+def wait_ready(reg, timeout=1.0, interval=0):
+    """Poll a status CSR until it reads non-zero, raises `TimeoutError` after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not reg.read():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{reg.name} not ready after {timeout} s')
+        if interval:
+            time.sleep(interval)
+
+
+class PUFReader:
+    """Challenge/response access to the PUF core named `name` in the CSR map."""
+
+    def __init__(self, regs, name='puf', timeout=1.0, delay=0.1):
+        self.name = name
+        self.timeout = timeout
+        self.delay = delay
+        self.reset = getattr(regs, f'{name}_reset')
+        self.cell0_select = getattr(regs, f'{name}_cell0_select')
+        self.cell1_select = getattr(regs, f'{name}_cell1_select')
+        self.bit_value = getattr(regs, f'{name}_bit_value')
+        self.ready = getattr(regs, f'{name}_ready', None)
+
+    def challenge(self, cell0, cell1):
+        """Apply a challenge and start the measurement."""
+        self.reset.write(1) # enable reset
+        self.cell0_select.write(cell0)
+        self.cell1_select.write(cell1)
+        self.reset.write(0) # disable reset
+
+    def response(self):
+        """Wait for the measurement to end and read the response."""
+        if self.ready is None:
+            time.sleep(self.delay)
+        else:
+            wait_ready(self.ready, self.timeout)
+        return self.bit_value.read()
+
+    def read(self, cell0, cell1):
+        self.challenge(cell0, cell1)
+        return self.response()
+
+    def queue(self, batch, cell0, cell1):
+        """Queue a challenge on `batch`, returns the pending (ready, response) reads."""
+        batch.write(self.reset, 1)
+        batch.write(self.cell0_select, cell0)
+        batch.write(self.cell1_select, cell1)
+        batch.write(self.reset, 0)
+        return batch.read(self.ready), batch.read(self.bit_value)
+
+    def read_batch(self, batch, challenges):
+        """Read the responses to many challenges with one `CSRBatch`.
+
+        The ready flag is read along with each response, the challenges whose measurement
+        was not over when the response was read are measured again one by one.
+        """
+        if self.ready is None:
+            return [self.read(cell0, cell1) for cell0, cell1 in challenges]
+        readings = [self.queue(batch, cell0, cell1) for cell0, cell1 in challenges]
+        batch.flush()
+        return [
+            bit_value.value if ready.value else self.read(cell0, cell1)
+            for (cell0, cell1), (ready, bit_value) in zip(challenges, readings)
+        ]
+
+
+class SequencerReader:
+    """Drain the responses of a `ChallengeSequencer` named `name` in the CSR map.
+
+    Responses are yielded as (cell0, cell1, response) tuples. When the data CSR fits in
+    one bus word, the FIFO is drained with one fixed-address burst read per level read.
+    """
+
+    def __init__(self, regs, name='sequencer', timeout=10.0):
+        self.timeout = timeout
+        for reg in ('start', 'enable', 'mode', 'cells', 'length', 'repetitions',
+                    'challenge_adr', 'challenge_dat', 'busy', 'level', 'data'):
+            setattr(self, f'_{reg}', getattr(regs, f'{name}_{reg}'))
+
+    def configure(self, cells=None, challenges=None, repetitions=1):
+        """Sequence all the pairs of the first `cells` cells, or the `challenges` list."""
+        self._enable.write(0)
+        if challenges is not None:
+            for adr, (cell0, cell1) in enumerate(challenges):
+                self._challenge_adr.write(adr)
+                self._challenge_dat.write(cell0 | cell1 << 8)
+            self._length.write(len(challenges))
+            self._mode.write(1)
+        else:
+            self._cells.write(cells)
+            self._mode.write(0)
+        self._repetitions.write(repetitions)
+
+    def start(self):
+        self._enable.write(1)
+        self._start.write(1)
+
+    def stop(self):
+        self._enable.write(0) # gives the challenge back to the PUF CSRs
+
+    def _pop(self, n):
+        if self._data.length == 1:
+            try:
+                words = []
+                for start in range(0, n, MAX_RECORD_WORDS):
+                    size = min(n - start, MAX_RECORD_WORDS)
+                    words += self._data.readfn(self._data.addr, length=size, burst="fixed")
+                return words
+            except TypeError: # RemoteClient without burst support
+                pass
+        return [self._data.read() for _ in range(n)]
+
+    def drain(self):
+        """Pop the responses currently queued."""
+        level = self._level.read()
+        for word in self._pop(level) if level else ():
+            yield word & 0xff, (word >> 8) & 0xff, word >> 16
+
+    def responses(self):
+        """Start the sequence and yield the responses until it is done."""
+        self.start()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            busy = self._busy.read()
+            queued = 0
+            for response in self.drain():
+                queued += 1
+                yield response
+            if queued:
+                deadline = time.monotonic() + self.timeout
+            elif not busy:
+                break
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f'no response from the sequencer after {self.timeout} s')
+        self.stop()
+
+
+class TRNGReader:
+    """Read the random words of the `RandomLFSR` named `name` in the CSR map of `wb`.
+
+    When the generator has an output FIFO (and `stream` is not False), it runs freely and
+    the FIFO is drained with burst reads, the FIFO level for the next burst being read
+    with each burst. Between bursts, the reader sleeps for the time to generate `burst`
+    words at the measured rate, at most `max_interval`.
+
+    Otherwise, generation is restarted, and the ready flag and the word are read, in one
+    round-trip. The first poll is delayed by an estimate of the generation time: the time
+    of the poll that found the word ready after a miss, decreased while the first poll
+    finds it ready, and at most the word period set by the `decimation` CSR when the clock
+    frequency is known. The following polls back off exponentially from `interval` to
+    `max_interval`.
+    """
+
+    def __init__(self, wb, name='trng', interval=1e-4, max_interval=0.05, timeout=10.0, stream=None, burst=128):
+        self.wb = wb
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.burst = burst
+        self.update_value = getattr(wb.regs, f'{name}_update_value')
+        self.ready = getattr(wb.regs, f'{name}_ready')
+        self.random_word = getattr(wb.regs, f'{name}_random_word')
+        self.stream = getattr(wb.regs, f'{name}_stream', None) if stream is not False else None
+        if stream and self.stream is None:
+            raise ValueError(f'{name} has no output FIFO')
+        if self.stream is not None:
+            self.level = getattr(wb.regs, f'{name}_level')
+            self.overflow = getattr(wb.regs, f'{name}_overflow')
+            self.data = getattr(wb.regs, f'{name}_data')
+        self.decimation = getattr(wb.regs, f'{name}_decimation', None)
+        self.prescaler = getattr(wb.regs, f'{name}_prescaler', None)
+        self.rate = getattr(wb.regs, f'{name}_rate', None)
+        self.rate_window = getattr(wb.regs, f'{name}_rate_window', None)
+        self.overflows = 0 # words dropped by the FIFO
+        self.wait = 0 # estimate of the generation time
+        self.max_wait = None # word period, bound of the estimate
+        self.polls = 0
+        # the update write is sent alone, Nagle's algorithm would hold the next poll until it is acknowledged
+        wb.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def configure(self, decimation=None, prescaler=None):
+        """Set the decimation (sys cycles per bit) and the sampling prescaler of the generator."""
+        if self.decimation is None:
+            raise ValueError('the generator has no decimation and prescaler CSRs')
+        if decimation is not None:
+            self.decimation.write(decimation)
+        if prescaler is not None:
+            self.prescaler.write(prescaler)
+        self.wait = 0
+        self.max_wait = None
+
+    def _clock_frequency(self):
+        constants = getattr(self.wb, 'constants', None)
+        return constants.d.get('config_clock_frequency') if constants is not None else None
+
+    def measured_rate(self):
+        """Words generated per second during the last rate window of the generator.
+
+        None if the generator has no rate CSR or the CSR map no clock frequency.
+        """
+        clock_frequency = self._clock_frequency()
+        if self.rate is None or clock_frequency is None:
+            return None
+        return self.rate.read() * clock_frequency / self.rate_window.read()
+
+    def word_period(self):
+        """Generation time of a word from the decimation CSR, None if it is not known.
+
+        This is an upper bound when the LFSR shifts several bits per clock (`steps`).
+        """
+        clock_frequency = self._clock_frequency()
+        if self.decimation is None or clock_frequency is None:
+            return None
+        return 32 * max(self.decimation.read(), 1) / clock_frequency
+
+    def read(self):
+        if self.max_wait is None:
+            period = self.word_period()
+            self.max_wait = period if period is not None else math.inf
+        batch = CSRBatch(self.wb)
+        start = time.monotonic()
+        batch.write(self.update_value, 1)
+        if self.wait:
+            batch.flush()
+            time.sleep(self.wait)
+        interval = self.interval
+        missed = False
+        while True:
+            polled = time.monotonic() - start
+            ready, random_word = batch.read(self.ready), batch.read(self.random_word)
+            batch.flush()
+            self.polls += 1
+            if ready.value:
+                break
+            missed = True
+            if polled > self.timeout:
+                raise TimeoutError(f'{self.ready.name} not ready after {self.timeout} s')
+            time.sleep(interval)
+            interval = min(2*interval, self.max_interval)
+        self.wait = min(polled if missed else 0.97*self.wait, self.max_wait)
+        return random_word.value
+
+    def stream_words(self):
+        """Start the free-running mode and yield the words drained from the FIFO."""
+        batch = CSRBatch(self.wb)
+        batch.write(self.stream, 0) # empties the FIFO
+        batch.write(self.stream, 1)
+        start = drained_at = time.monotonic()
+        words = 0
+        try:
+            level, overflow = batch.read(self.level), batch.read(self.overflow)
+            batch.flush()
+            while True:
+                self.polls += 1
+                self.overflows = overflow.value
+                n = level.value
+                if n:
+                    data = batch.read_burst(self.data, n)
+                # the level of the next burst is read along with this one
+                level, overflow = batch.read(self.level), batch.read(self.overflow)
+                batch.flush()
+                now = time.monotonic()
+                if n:
+                    words += n
+                    drained_at = now
+                    yield from data.values
+                elif now - drained_at > self.timeout:
+                    raise TimeoutError(f'no word in the FIFO after {self.timeout} s')
+                rate = words / (now - start)
+                time.sleep(min(self.burst / rate, self.max_interval) if rate else self.interval)
+        finally:
+            self.stream.write(0)
+
+    def words(self, n=None):
+        """Yield `n` words, or words forever."""
+        if self.stream is not None:
+            yield from islice(self.stream_words(), n)
+            return
+        for _ in (range(n) if n is not None else count()):
+            yield self.read()
+
+
+class RateMeter:
+    """Live words/s and bits/s of an acquisition, printed on one line every `interval` seconds."""
+
+    def __init__(self, bits_per_word=32, interval=1.0, stream=sys.stderr):
+        self.bits_per_word = bits_per_word
+        self.interval = interval
+        self.stream = stream
+        self.start = self.last = time.monotonic()
+        self.words = self.last_words = 0
+
+    def update(self, words=1):
+        self.words += words
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.report(now)
+
+    def report(self, now=None):
+        now = time.monotonic() if now is None else now
+        rate = (self.words - self.last_words) / max(now - self.last, 1e-9)
+        self.stream.write(f'\r{self.words} words, {rate:.1f} words/s, {rate*self.bits_per_word:.0f} bits/s'
+            f' (average {self.words / max(now - self.start, 1e-9) * self.bits_per_word:.0f} bits/s)')
+        self.stream.flush()
+        self.last, self.last_words = now, self.words
+
+    def close(self):
+        self.report()
+        self.stream.write('\n')
+
+
+class ShardWriter:
+    """Buffered binary output rotated to a new file every `shard_size` bytes or `shard_time` seconds.
+
+    `pattern` is formatted with the shard number (e.g. ``entropy_{shard:04d}.dat``), a
+    pattern without ``{shard}`` is a single file appended to. Shards left by a previous
+    run are kept, writing resumes with the next shard number.
+    """
+
+    def __init__(self, pattern, shard_size=None, shard_time=None, buffer_size=1<<20):
+        self.pattern = pattern
+        self.shard_size = shard_size
+        self.shard_time = shard_time
+        self.buffer_size = buffer_size
+        self.sharded = '{shard' in pattern
+        self.shard = 0
+        if self.sharded:
+            directory, name = os.path.split(pattern)
+            prefix, suffix = re.split(r'\{shard[^}]*\}', name)
+            existing = [entry[len(prefix):len(entry)-len(suffix)] for entry in os.listdir(directory or '.')
+                if entry.startswith(prefix) and entry.endswith(suffix)]
+            self.shard = max((int(number) + 1 for number in existing if number.isdigit()), default=0)
+        self.file = None
+        self._open()
+
+    def _open(self):
+        if self.file is not None:
+            self.file.close()
+            self.shard += 1
+        self.filename = self.pattern.format(shard=self.shard) if self.sharded else self.pattern
+        self.file = open(self.filename, 'ab', buffering=self.buffer_size)
+        self.size = 0
+        self.opened_at = time.monotonic()
+
+    def write(self, data):
+        if self.sharded and ((self.shard_size and self.size + len(data) > self.shard_size and self.size) or
+                (self.shard_time and time.monotonic() - self.opened_at >= self.shard_time)):
+            self._open()
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _receive_packet(sock, addr_size):
+    """Receive one single-record Etherbone packet, returns its bytes."""
+    header_length = etherbone_packet_header_length + etherbone_record_header_length
+    packet = bytearray()
+    packet_size = header_length
+    while len(packet) < packet_size:
+        chunk = sock.recv(packet_size - len(packet))
+        if not chunk:
+            raise ConnectionError('connection closed by the server')
+        packet += chunk
+        if len(packet) == header_length:
+            wcount, rcount = struct.unpack('>BB', packet[header_length-2:])
+            if wcount:
+                packet_size += 4*wcount + addr_size
+            if rcount:
+                packet_size += (rcount + 1)*addr_size
+    return bytes(packet)
+
+
+class PendingRead:
+    """Value of a queued CSR read, available once the batch is flushed."""
+    __slots__ = ('reg', 'size', 'words')
+
+    def __init__(self, reg, size=None):
+        self.reg = reg
+        self.size = reg.length if size is None else size
+        self.words = None
+
+    @property
+    def value(self):
+        if self.words is None:
+            raise RuntimeError(f'{self.reg.name} read before the batch was flushed')
+        value = 0
+        for word in self.words:
+            value = (value << self.reg.data_width) | word
+        return value
+
+
+class PendingBurst:
+    """Words of a queued fixed-address burst read, available once the batch is flushed."""
+    __slots__ = ('reg', 'chunks')
+
+    def __init__(self, reg):
+        self.reg = reg
+        self.chunks = []
+
+    @property
+    def values(self):
+        if any(chunk.words is None for chunk in self.chunks):
+            raise RuntimeError(f'{self.reg.name} read before the batch was flushed')
+        return [word for chunk in self.chunks for word in chunk.words]
+
+
+class _Record:
+    __slots__ = ('base', 'writes', 'reads', 'pending')
+
+    def __init__(self):
+        self.base = None
+        self.writes = []
+        self.reads = []
+        self.pending = []
+
+
+class CSRBatch:
+    """Queue CSR accesses of a `RemoteClient` and send them pipelined.
+
+    Accesses keep their order: consecutive writes to contiguous addresses and the reads
+    that follow them share an Etherbone record, one record per packet as `litex_server`
+    serves them. Packets are sent without waiting for the responses, up to `window`
+    packets with reads in flight. Reads return a `PendingRead`, resolved by `flush()`,
+    which is also called when the batch is used as a context manager.
+    """
+
+    def __init__(self, wb, window=32):
+        self.wb = wb
+        self.window = window
+        self.addr_size = wb.csr_bus_address_width // 8
+        self.records = []
+
+    def _record(self):
+        if not self.records:
+            self.records.append(_Record())
+        return self.records[-1]
+
+    def write(self, reg, value):
+        datas = [(value >> ((reg.length-1-i)*reg.data_width)) & (2**reg.data_width - 1) for i in range(reg.length)]
+        addr = self.wb.base_address + reg.addr
+        record = self._record()
+        if record.reads or len(record.writes) + len(datas) > MAX_RECORD_WORDS or \
+                (record.writes and addr != record.base + 4*len(record.writes)):
+            record = _Record()
+            self.records.append(record)
+        if not record.writes:
+            record.base = addr
+        record.writes += datas
+
+    def read(self, reg):
+        pending = PendingRead(reg)
+        addr = self.wb.base_address + reg.addr
+        record = self._record()
+        if len(record.reads) + reg.length > MAX_RECORD_WORDS:
+            record = _Record()
+            self.records.append(record)
+        record.reads += [addr + 4*i for i in range(reg.length)]
+        record.pending.append(pending)
+        return pending
+
+    def read_burst(self, reg, n):
+        """Queue `n` reads of the first word of `reg`, to drain a FIFO data CSR."""
+        burst = PendingBurst(reg)
+        addr = self.wb.base_address + reg.addr
+        while n > 0:
+            record = self._record()
+            size = min(n, MAX_RECORD_WORDS - len(record.reads))
+            if size == 0:
+                record = _Record()
+                self.records.append(record)
+                size = min(n, MAX_RECORD_WORDS)
+            chunk = PendingRead(reg, size)
+            record.reads += [addr]*size
+            record.pending.append(chunk)
+            burst.chunks.append(chunk)
+            n -= size
+        return burst
+
+    def _packet(self, record):
+        etherbone_record = EtherboneRecord(self.addr_size)
+        if record.writes:
+            etherbone_record.writes = EtherboneWrites(base_addr=record.base, addr_size=self.addr_size, datas=record.writes)
+            etherbone_record.wcount = len(record.writes)
+        if record.reads:
+            etherbone_record.reads = EtherboneReads(addr_size=self.addr_size, addrs=record.reads)
+            etherbone_record.rcount = len(record.reads)
+        packet = EtherbonePacket(self.wb.csr_bus_address_width)
+        packet.records = [etherbone_record]
+        packet.encode()
+        return packet.bytes
+
+    def _resolve(self, record):
+        packet = EtherbonePacket(self.wb.csr_bus_address_width, _receive_packet(self.wb.socket, self.addr_size))
+        packet.decode()
+        datas = packet.records.pop().writes.get_datas()
+        for pending in record.pending:
+            pending.words, datas = datas[:pending.size], datas[pending.size:]
+
+    def flush(self):
+        records, self.records = self.records, []
+        in_flight = deque()
+        for record in records:
+            self.wb.socket.sendall(self._packet(record))
+            if record.reads:
+                in_flight.append(record)
+            if len(in_flight) >= self.window:
+                self._resolve(in_flight.popleft())
+        while in_flight:
+            self._resolve(in_flight.popleft())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.flush()
+
+
+class AnalyzerReader:
+    """Capture the LiteScope analyzer around every challenge of a `PUFReader`.
+
+    `analyzer` is a `LiteScopeAnalyzerDriver`, triggered on the falling edge of the
+    `trigger` signal. The analyzer has a single storage buffer, so captures cannot overlap:
+    instead, arming the analyzer, applying the challenge, checking the capture and
+    uploading it are queued on a `CSRBatch` for all the challenges of a round, and the
+    upload of a capture shares the round-trips of the arming and triggering of the next
+    one. A challenge whose response or capture was not ready when it was read is measured
+    again on its own, through the driver.
+    """
+
+    def __init__(self, analyzer, puf, offset=0, length=None, trigger='puf_reset'):
+        self.analyzer = analyzer
+        self.puf = puf
+        self.offset = offset
+        self.length = analyzer.depth if length is None else length
+        assert offset < analyzer.depth
+        assert self.length <= analyzer.depth
+        self.trigger = trigger
+        self.subwords = (analyzer.data_width + 31) // 32 # bus words per analyzer word
+        value, mask = getattr(analyzer, f'{trigger}_o'), getattr(analyzer, f'{trigger}_m')
+        self.conditions = [(value*1, mask), (value*0, mask)] # falling edge
+
+    def _arm(self, batch):
+        analyzer = self.analyzer
+        batch.write(analyzer.trigger_enable, 0)
+        batch.write(analyzer.storage_enable, 0) # also drops the words left from the last capture
+        full = batch.read(analyzer.trigger_mem_full)
+        for value, mask in self.conditions:
+            batch.write(analyzer.trigger_mem_mask, mask)
+            batch.write(analyzer.trigger_mem_value, value)
+            batch.write(analyzer.trigger_mem_write, 1)
+        batch.write(analyzer.storage_offset, self.offset)
+        batch.write(analyzer.storage_length, self.length)
+        batch.write(analyzer.storage_enable, 1)
+        batch.write(analyzer.trigger_enable, 1)
+        return full
+
+    def read(self, cell0, cell1):
+        """Capture one challenge through the driver, returns (response, analyzer words).
+
+        The words are returned as a (sample, lane) array, see `litepuf.capture`.
+        """
+        analyzer = self.analyzer
+        analyzer.clear()
+        for value, mask in self.conditions:
+            analyzer.add_trigger(value, mask)
+        analyzer.run(offset=self.offset, length=self.length)
+        response = self.puf.read(cell0, cell1)
+        analyzer.wait_done()
+        return response, words_to_lanes(analyzer.upload(), analyzer.data_width)
+
+    def read_batch(self, batch, challenges):
+        """Capture many challenges with one `CSRBatch`, returns (response, analyzer words) pairs.
+
+        The capture is uploaded once the storage is done, its `length` words are then in
+        the storage memory. The last capture is left in the driver for `analyzer.save`.
+        """
+        if self.puf.ready is None:
+            return [self.read(cell0, cell1) for cell0, cell1 in challenges]
+        queued = []
+        for cell0, cell1 in challenges:
+            full = self._arm(batch)
+            ready, response = self.puf.queue(batch, cell0, cell1)
+            done = batch.read(self.analyzer.storage_done)
+            data = batch.read_burst(self.analyzer.storage_mem_data, self.length*self.subwords)
+            queued.append((full, ready, response, done, data))
+        batch.flush()
+        captures = []
+        for (cell0, cell1), (full, ready, response, done, data) in zip(challenges, queued):
+            if full.value:
+                raise ValueError("Trigger memory full, too much conditions")
+            if ready.value and done.value:
+                captures.append((response.value, subwords_to_lanes(data.values, self.analyzer.data_width)))
+            else:
+                captures.append(self.read(cell0, cell1))
+        if captures:
+            self.analyzer.data = lanes_to_data(captures[-1][1], self.analyzer.data_width)
+            self.analyzer.offset, self.analyzer.length = self.offset, self.length
+        return captures
+
+
+class LocalServer:
+    """`litex_server` stand-in serving Etherbone on `port`, backed by a register dict.
+
+    Every packet takes `latency` seconds plus `word_time` seconds per access, to emulate
+    the bridge. `handlers` maps addresses to functions called with the written value
+    (reads of the address return the stored value).
+    """
+
+    def __init__(self, port=0, latency=0, word_time=0, addr_width=32, handlers=None):
+        self.latency = latency
+        self.word_time = word_time
+        self.addr_width = addr_width
+        self.handlers = handlers or {}
+        self.registers = {}
+        self.packets = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('localhost', port))
+        self.socket.listen(1)
+        self.port = self.socket.getsockname()[1]
+
+    def _serve(self, client):
+        addr_size = self.addr_width // 8
+        with client:
+            client.sendall(b'LocalServer')
+            while True:
+                try:
+                    packet = EtherbonePacket(self.addr_width, _receive_packet(client, addr_size))
+                except (ConnectionError, OSError):
+                    return
+                packet.decode()
+                record = packet.records.pop()
+                self.packets += 1
+                if self.latency or self.word_time:
+                    time.sleep(self.latency + self.word_time*(record.wcount + record.rcount))
+                if record.writes is not None:
+                    for i, data in enumerate(record.writes.get_datas()):
+                        addr = record.writes.base_addr + 4*i
+                        self.registers[addr] = data
+                        if addr in self.handlers:
+                            self.handlers[addr](data)
+                if record.reads is not None:
+                    response = EtherboneRecord(addr_size)
+                    datas = [self.registers.get(addr, 0) for addr in record.reads.get_addrs()]
+                    response.writes = EtherboneWrites(addr_size=addr_size, datas=datas)
+                    response.wcount = len(datas)
+                    packet = EtherbonePacket(self.addr_width)
+                    packet.records = [response]
+                    packet.encode()
+                    client.sendall(packet.bytes)
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def close(self):
+        self.socket.close()
+
+
+Board = namedtuple('Board', ['host', 'port', 'csr_csv', 'ident'], defaults=['localhost', 1234, 'test/csr.csv', None])
+
+
+def read_identifier(wb):
+    """Read the identifier string of the SoC."""
+    fpga_identifier = ""
+
+    for i in range(256):
+        c = chr(wb.read(wb.bases.identifier_mem + 4*i) & 0xff)
+        if c == "\0":
+            break
+        fpga_identifier += c
+
+    return fpga_identifier
+
+def acquire_puf(wb, cells, samples, name='puf', method='single'):
+    """Measure all the pairs of the first `cells` cells `samples` times.
+
+    `method` is 'single' (one challenge at a time), 'batch' (`PUFReader.read_batch`) or
+    'sequencer' (`ChallengeSequencer`). Returns a `{challenge: [samples]}` dump.
+    """
+    dump = defaultdict(list)
+    if method == 'sequencer':
+        sequencer = SequencerReader(wb.regs)
+        sequencer.configure(cells=cells, repetitions=samples)
+        for cell0, cell1, value in sequencer.responses():
+            dump[f'{cell0}:{cell1}'].append({'value': value})
+        return dict(dump)
+    puf = PUFReader(wb.regs, name)
+    challenges = list(combinations(range(cells), 2))
+    for _ in range(samples):
+        if method == 'batch':
+            values = puf.read_batch(CSRBatch(wb), challenges)
+        else:
+            values = [puf.read(cell0, cell1) for cell0, cell1 in challenges]
+        for (cell0, cell1), value in zip(challenges, values):
+            dump[f'{cell0}:{cell1}'].append({'value': value})
+    return dict(dump)
+
+def _acquire_board(board, acquire):
+    from litex.tools.litex_client import RemoteClient
+    wb = RemoteClient(host=board.host, port=board.port, csr_csv=board.csr_csv)
+    wb.open()
+    try:
+        return board.ident or read_identifier(wb), acquire(wb)
+    finally:
+        wb.close()
+
+def acquire_fleet(boards, acquire, workers=None):
+    """Run `acquire(wb)` on every board concurrently, returns `{ident: result}`.
+
+    The ident of a board is read from the SoC identifier when the board has none. A board
+    that fails is reported and left out of the results.
+    """
+    results = {}
+    with ThreadPoolExecutor(workers or len(boards)) as executor:
+        futures = {executor.submit(_acquire_board, board, acquire): board for board in boards}
+        for future in as_completed(futures):
+            board = futures[future]
+            try:
+                ident, result = future.result()
+            except Exception as e:
+                print(f'{board.host}:{board.port}: acquisition failed ({e!r})')
+                continue
+            if ident in results:
+                raise ValueError(f'two boards have the ident {ident}')
+            results[ident] = result
+            print(f'{ident} ({board.host}:{board.port}) done')
+    return results
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single and batched CSR accesses against a local Etherbone server")
+    parser.add_argument('--accesses', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0005, help='emulated bridge latency per packet (s)')
+    parser.add_argument('--word-time', type=float, default=0, help='emulated bridge time per access (s)')
+    parser.add_argument('--window', type=int, default=32, help='packets with reads in flight')
+    args = parser.parse_args()
+
+    from litex.tools.litex_client import RemoteClient
+    from litex.tools.remote.csr_builder import CSRRegister
+
+    server = LocalServer(latency=args.latency, word_time=args.word_time).start()
+    wb = RemoteClient(port=server.port)
+    wb.open()
+    regs = [CSRRegister(wb.read, wb.write, f'reg{i}', 4*i, 1, 32, 'rw') for i in range(4)]
+
+    def single():
+        for i in range(args.accesses // 4):
+            regs[0].write(i)
+            regs[1].write(i)
+            regs[2].read()
+            regs[3].read()
+
+    def batched():
+        with CSRBatch(wb, args.window) as batch:
+            for i in range(args.accesses // 4):
+                batch.write(regs[0], i)
+                batch.write(regs[1], i)
+                batch.read(regs[2])
+                batch.read(regs[3])
+
+    def single_nodelay():
+        # writes have no response, Nagle's algorithm holds the next packet until they are acknowledged
+        wb.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        single()
+
+    for name, run in (('single', single), ('single, TCP_NODELAY', single_nodelay), ('batched', batched)):
+        server.packets = 0
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {args.accesses / elapsed:.0f} accesses/s ({server.packets} packets)')
+
+    wb.close()
+    server.close()
+
+if __name__ == "__main__":
+    main()
+
+
+import unittest
+
+
+class HostTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from litex.tools.litex_client import RemoteClient
+        from litex.tools.remote.csr_builder import CSRRegister
+        self.server = LocalServer().start()
+        self.wb = RemoteClient(port=self.server.port)
+        self.wb.open()
+        self.addCleanup(self.server.close)
+        self.addCleanup(self.wb.close)
+        names = ('puf_bit_value', 'puf_cell0_select', 'puf_cell1_select', 'puf_ready', 'puf_reset', 'wide',
+            'trng_update_value', 'trng_ready', 'trng_random_word', 'trng_stream', 'trng_level', 'trng_overflow', 'trng_data',
+            'trng_decimation', 'trng_prescaler', 'trng_rate', 'trng_rate_window')
+        lengths = (1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1)
+        addr = 0
+        self.regs = type('Regs', (), {})()
+        for name, length in zip(names, lengths):
+            setattr(self.regs, name, CSRRegister(self.wb.read, self.wb.write, name, addr, length, 32, 'rw'))
+            addr += 4*length
+
+    def test_batch(self):
+        regs = self.regs
+        with CSRBatch(self.wb, window=4) as batch:
+            batch.write(regs.wide, 0x1234_5678_9abc_def0)
+            reads = []
+            for i in range(300): # more reads than a record holds
+                batch.write(regs.puf_reset, i)
+                reads.append(batch.read(regs.puf_reset))
+            wide = batch.read(regs.wide)
+        self.assertEqual([read.value for read in reads], list(range(300)))
+        self.assertEqual(wide.value, 0x1234_5678_9abc_def0)
+        self.assertEqual(regs.wide.read(), 0x1234_5678_9abc_def0)
+
+    def test_read_burst(self):
+        regs = self.regs
+        with CSRBatch(self.wb) as batch:
+            batch.write(regs.puf_bit_value, 7)
+            first = batch.read(regs.puf_reset)
+            burst = batch.read_burst(regs.puf_bit_value, 600) # more reads than a record holds
+            last = batch.read(regs.wide)
+        self.assertEqual(first.value, 0)
+        self.assertEqual(burst.values, [7]*600)
+        self.assertEqual(last.value, 0)
+
+    def test_read_batch(self):
+        registers = self.server.registers
+        def reset(value):
+            registers[self.regs.puf_ready.addr] = int(not value)
+            registers[self.regs.puf_bit_value.addr] = 10*registers.get(self.regs.puf_cell0_select.addr, 0) + registers.get(self.regs.puf_cell1_select.addr, 0)
+        self.server.handlers[self.regs.puf_reset.addr] = reset
+        puf = PUFReader(self.regs, 'puf')
+        challenges = [(0, 1), (2, 3), (3, 1)]
+        self.assertEqual(puf.read_batch(CSRBatch(self.wb), challenges), [1, 23, 31])
+
+    def test_trng(self):
+        import io
+        import tempfile
+        registers = self.server.registers
+        words = count(1)
+        def update(value):
+            registers[self.regs.trng_random_word.addr] = next(words)
+            registers[self.regs.trng_ready.addr] = 1
+        self.server.handlers[self.regs.trng_update_value.addr] = update
+        self.wb.regs = self.regs
+        reader = TRNGReader(self.wb, stream=False)
+        meter = RateMeter(interval=0, stream=io.StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            pattern = os.path.join(tmp, 'entropy_{shard:04d}.dat')
+            with ShardWriter(pattern, shard_size=12) as writer:
+                for word in reader.words(10):
+                    writer.write(word.to_bytes(4, 'big'))
+                    meter.update()
+            with ShardWriter(pattern, shard_size=12) as writer: # resumes with a new shard
+                writer.write(b'next')
+            shards = sorted(os.listdir(tmp))
+            data = b''
+            for shard in shards:
+                with open(os.path.join(tmp, shard), 'rb') as f:
+                    data += f.read()
+        self.assertEqual(shards, [f'entropy_{shard:04d}.dat' for shard in range(5)])
+        self.assertEqual(data, b''.join(word.to_bytes(4, 'big') for word in range(1, 11)) + b'next')
+        self.assertEqual(reader.polls, 10)
+        self.assertEqual(meter.words, 10)
+
+        reader.configure(decimation=16, prescaler=3)
+        self.assertEqual((self.regs.trng_decimation.read(), self.regs.trng_prescaler.read()), (16, 3))
+        self.assertIsNone(reader.measured_rate()) # no clock frequency without a CSR map
+        registers[self.regs.trng_rate.addr] = 500
+        registers[self.regs.trng_rate_window.addr] = 2**24
+        self.wb.constants = type('Constants', (), {'d': {'config_clock_frequency': 2**25}})()
+        self.assertEqual(reader.measured_rate(), 1000)
+        self.assertEqual(reader.word_period(), 32*16 / 2**25)
+
+    def test_trng_stream(self):
+        regs = self.regs
+        words = count(1)
+        fifo = deque()
+        class Registers(dict):
+            def get(self, addr, default=None):
+                if addr == regs.trng_level.addr:
+                    fifo.extend(islice(words, 3)) # generated since the last poll
+                    return len(fifo)
+                if addr == regs.trng_data.addr:
+                    return fifo.popleft()
+                return super().get(addr, default)
+        self.server.registers = Registers()
+        self.wb.regs = regs
+        reader = TRNGReader(self.wb, interval=0)
+        self.assertEqual(list(reader.words(20)), list(range(1, 21)))
+        self.assertLess(reader.polls, 20)
+        self.assertEqual(regs.trng_stream.read(), 0)
+
+    def test_sequencer_drain(self):
+        from litex.tools.remote.csr_builder import CSRRegister
+        names = ('start', 'enable', 'mode', 'cells', 'length', 'repetitions',
+                 'challenge_adr', 'challenge_dat', 'busy', 'level', 'data')
+        regs = type('Regs', (), {})()
+        for i, name in enumerate(names):
+            setattr(regs, f'sequencer_{name}', CSRRegister(self.wb.read, self.wb.write, name, 0x1000 + 4*i, 1, 32, 'rw'))
+        responses = [(i % 7, i % 5, i % 2) for i in range(600)] # more than a record holds
+        fifo = deque(cell0 | cell1 << 8 | value << 16 for cell0, cell1, value in responses)
+        class Registers(dict):
+            def get(self, addr, default=None):
+                if addr == regs.sequencer_level.addr:
+                    return len(fifo)
+                if addr == regs.sequencer_data.addr:
+                    return fifo.popleft()
+                return super().get(addr, default)
+        self.server.registers = Registers()
+        reader = SequencerReader(regs)
+        self.assertEqual(list(reader.drain()), responses)
+        self.assertEqual(list(reader.drain()), [])
+
+    def test_fleet(self):
+        from litex.tools.remote.csr_builder import CSRRegister
+        latency = 0.01
+        servers = [LocalServer(latency=latency).start() for _ in range(4)]
+        for server in servers:
+            self.addCleanup(server.close)
+        boards = [Board(port=server.port, csr_csv=None, ident=f'chip{i}') for i, server in enumerate(servers)]
+        def acquire(wb):
+            reg = CSRRegister(wb.read, wb.write, 'scratch', 0, 1, 32, 'rw')
+            for _ in range(5):
+                reg.write(wb.port)
+                value = reg.read()
+            return value
+        start = time.monotonic()
+        results = acquire_fleet(boards + [Board(port=1, csr_csv=None)], acquire) # the last board fails
+        elapsed = time.monotonic() - start
+        self.assertEqual(results, {f'chip{i}': server.port for i, server in enumerate(servers)})
+        self.assertLess(elapsed, len(servers) * 10 * latency) # boards are not acquired one after the other
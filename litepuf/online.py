@@ -0,0 +1,229 @@
+"""Online PUF metrics, updated one response at a time.
+
+Accumulators only keep per-bit counters, so their memory does not grow with the number
+of samples, and accumulators of several acquisition sessions can be merged. The intra-chip
+distance is measured against the bitwise majority of all the samples (the reference
+`litepuf.evaluation.majority_vote` computes afterwards): for every bit, the samples that
+differ from the majority are the minority, so the distance is known without the samples.
+"""
+import argparse
+import json
+from statistics import mean
+
+import numpy as np
+
+from .evaluation import hamming_matrix, mean_distance
+
+
+class ChallengeAccumulator:
+    """Bitwise counters of the responses to one challenge."""
+    __slots__ = ('response_len', 'count', 'ones', 'first')
+
+    def __init__(self, response_len=1):
+        self.response_len = response_len
+        self.count = 0
+        self.ones = [0] * response_len
+        self.first = None
+
+    def update(self, response):
+        response = int(response)
+        if self.first is None:
+            self.first = response
+        self.count += 1
+        for b in range(self.response_len):
+            self.ones[b] += (response >> b) & 1
+
+    def merge(self, other):
+        if other.response_len != self.response_len:
+            raise ValueError('cannot merge accumulators of different response lengths')
+        if self.first is None:
+            self.first = other.first
+        self.count += other.count
+        self.ones = [a + b for a, b in zip(self.ones, other.ones)]
+        return self
+
+    @property
+    def majority(self):
+        """Bitwise majority, ties are resolved to the first response like `statistics.mode`."""
+        majority = 0
+        for b, ones in enumerate(self.ones):
+            if 2*ones == self.count:
+                bit = (self.first >> b) & 1
+            else:
+                bit = 2*ones > self.count
+            majority |= bit << b
+        return majority
+
+    @property
+    def distance(self):
+        """Sum of the Hamming distances of all responses to the majority."""
+        return sum(min(ones, self.count - ones) for ones in self.ones)
+
+    @property
+    def steadiness(self):
+        return 1 - self.distance / (self.count * self.response_len)
+
+    def to_dict(self):
+        return {'count': self.count, 'ones': self.ones, 'first': self.first}
+
+    @classmethod
+    def from_dict(cls, state, response_len):
+        accumulator = cls(response_len)
+        accumulator.count = state['count']
+        accumulator.ones = list(state['ones'])
+        accumulator.first = state['first']
+        return accumulator
+
+
+class ChipAccumulator:
+    """Online steadiness and bias of one chip."""
+
+    def __init__(self, response_len=1, ident=None):
+        self.response_len = response_len
+        self.ident = ident
+        self.challenges = {}
+
+    def update(self, challenge, response):
+        try:
+            accumulator = self.challenges[challenge]
+        except KeyError:
+            accumulator = self.challenges[challenge] = ChallengeAccumulator(self.response_len)
+        accumulator.update(response)
+
+    def merge(self, other):
+        for challenge, accumulator in other.challenges.items():
+            if challenge in self.challenges:
+                self.challenges[challenge].merge(accumulator)
+            else:
+                self.challenges[challenge] = ChallengeAccumulator(self.response_len).merge(accumulator)
+        return self
+
+    @property
+    def samples(self):
+        return sum(accumulator.count for accumulator in self.challenges.values())
+
+    def references(self):
+        return {challenge: accumulator.majority for challenge, accumulator in self.challenges.items()}
+
+    def steadiness(self):
+        return mean(accumulator.steadiness for accumulator in self.challenges.values())
+
+    def bias(self):
+        ones = sum(bin(majority).count('1') for majority in self.references().values())
+        return ones / (len(self.challenges) * self.response_len)
+
+    def to_dict(self):
+        return {
+            'ident': self.ident,
+            'response_len': self.response_len,
+            'challenges': {challenge: accumulator.to_dict() for challenge, accumulator in self.challenges.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        chip = cls(state['response_len'], state['ident'])
+        chip.challenges = {
+            challenge: ChallengeAccumulator.from_dict(accumulator, chip.response_len)
+            for challenge, accumulator in state['challenges'].items()
+        }
+        return chip
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+
+def inter_distances(chips):
+    """Pairwise fractional Hamming distances between the references of chip accumulators."""
+    response_len = chips[0].response_len
+    challenges = list(chips[0].challenges)
+    references = np.array([[chip.challenges[c].majority for c in challenges] for chip in chips], dtype=np.uint64)
+    return hamming_matrix(references, response_len) / (len(challenges) * response_len)
+
+def uniqueness(chips):
+    return mean_distance(inter_distances(chips))
+
+def merge_chips(chips):
+    """Merge the accumulators of the same chip (by ident), keeping the order of appearance."""
+    merged = {}
+    for chip in chips:
+        if chip.ident in merged:
+            merged[chip.ident].merge(chip)
+        else:
+            merged[chip.ident] = ChipAccumulator(chip.response_len, chip.ident).merge(chip)
+    return list(merged.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge online PUF metrics of acquisition sessions")
+    parser.add_argument('state_files', nargs='+')
+    args = parser.parse_args()
+
+    chips = merge_chips([ChipAccumulator.load(filename) for filename in args.state_files])
+    for chip in chips:
+        print(f'{chip.ident}: {chip.samples} samples, steadiness {chip.steadiness():.4f}, bias {chip.bias():.4f}')
+    print('Uniqueness:', uniqueness(chips))
+
+if __name__ == "__main__":
+    main()
+
+
+import unittest
+
+
+class OnlineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from .evaluation import majority_vote
+        rng = np.random.default_rng(0)
+        self.response_len = 4
+        # 3 chips, 5 challenges, 8 samples (ties are resolved to the first sample)
+        self.responses = rng.integers(0, 2**self.response_len, size=(3, 5, 8)).astype(np.uint64)
+        self.counts = np.full((3, 5), 8)
+        self.challenges = [f'{cell}:{cell + 1}' for cell in range(5)]
+        self.references = majority_vote(self.responses, self.counts, self.response_len)
+
+    def accumulate(self, samples=slice(None)):
+        chips = []
+        for chip_idx, chip_responses in enumerate(self.responses):
+            chip = ChipAccumulator(self.response_len, f'chip{chip_idx}')
+            for challenge, responses in zip(self.challenges, chip_responses):
+                for response in responses[samples]:
+                    chip.update(challenge, response)
+            chips.append(chip)
+        return chips
+
+    def assertMatchesArrays(self, chips):
+        from .evaluation import steadiness_array, uniqueness_array
+        for chip, responses, counts, references in zip(chips, self.responses, self.counts, self.references):
+            self.assertEqual(list(chip.references().values()), references.tolist())
+            expected = steadiness_array(responses, counts, references, self.response_len)
+            np.testing.assert_allclose([chip.challenges[c].steadiness for c in self.challenges], expected)
+            self.assertEqual(chip.samples, counts.sum())
+        self.assertAlmostEqual(uniqueness(chips), uniqueness_array(self.responses, self.counts, self.response_len))
+
+    def test_arrays(self):
+        self.assertMatchesArrays(self.accumulate())
+
+    def test_merge_chips(self):
+        sessions = self.accumulate(slice(0, 3)) + self.accumulate(slice(3, None))
+        chips = merge_chips(sessions)
+        self.assertEqual([chip.ident for chip in chips], ['chip0', 'chip1', 'chip2'])
+        self.assertMatchesArrays(chips)
+
+    def test_json(self):
+        import os
+        import tempfile
+        chips = self.accumulate()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'chip0.json')
+            chips[0].save(filename)
+            loaded = ChipAccumulator.load(filename)
+        self.assertEqual(loaded.to_dict(), chips[0].to_dict())
+        chips = [ChipAccumulator.from_dict(json.loads(json.dumps(chip.to_dict()))) for chip in chips]
+        self.assertMatchesArrays(chips)
@@ -7,6 +7,7 @@ from operator import xor, or_
 
 from migen import *
 from migen.genlib.cdc import MultiReg
+from migen.genlib.fifo import SyncFIFO
 
 from litex.soc.interconnect.csr import *
 
@@ -18,6 +19,10 @@ def xor_lut(n):
     predicates = [reduce(xor, o) for o in truth_table]
     return sum(v<<i for i, v in enumerate(reversed(predicates)))
 
+def rotate_left(value, shift, width):
+    shift %= width
+    return ((value << shift) | (value >> (width - shift))) & (2**width - 1)
+
 
 class LFSR(Module):
     def __init__(self, width, shiftreg_init, taps, clock_domain="rng"):
@@ -40,6 +45,44 @@ class LFSR(Module):
             )
 
 
+def unrolled_feedback(width, taps, steps):
+    """State of an `LFSR` after `steps` shifts, as a GF(2) mask per shift register bit.
+
+    Bits 0 to `width - 1` of a mask select bits of the initial state, bit `width + j` the
+    input bit shifted in at step j.
+    """
+    state = [1 << b for b in range(width)]
+    for step in range(steps):
+        feedback = reduce(xor, [state[t] for t in range(width) if taps >> t & 1], 1 << (width + step))
+        state = state[1:] + [feedback]
+    return state
+
+class UnrolledLFSR(Module):
+    """`LFSR` advancing `steps` shifts per clock, bit i[j] is the input of shift j.
+
+    The feedback network of the `steps` shifts is computed at elaboration, the shift
+    register sequence is the one of `LFSR` fed with i[0], i[1], ... one bit per clock.
+    """
+    def __init__(self, width, shiftreg_init, taps, steps, clock_domain="rng"):
+        assert 1 <= steps <= width
+        self.reset = Signal()
+        self.i = Signal(steps)
+        self.shiftreg = Signal(width)
+
+        variables = Cat(self.shiftreg, self.i)
+        next_state = [reduce(xor, [variables[v] for v in range(width + steps) if mask >> v & 1])
+            for mask in unrolled_feedback(width, taps, steps)]
+
+        self.sampling_clk = ClockSignal(clock_domain)
+        sync = getattr(self.sync, clock_domain)
+        sync += \
+            If(self.reset,
+                self.shiftreg.eq(shiftreg_init)
+            ).Else(
+                self.shiftreg.eq(Cat(*next_state))
+            )
+
+
 class XORTree(Module):
     def __init__(self, n_inputs):
         assert(n_inputs == 4)
@@ -65,61 +108,166 @@ class Sampler(Module):
 
 
 class RandomLFSR(Module, AutoCSR):
-    def __init__(self, oscillators, shiftreg_init=0b0110_1011_1110_0100_1000_0101_0110_1100, taps=0b0000_0000_0000_0000_0000_0000_1100_0101, clock_domain="sys"):
+    """Random words from the XOR of free-running oscillators, compressed by an LFSR.
+
+    A word is ready after `shiftreg_width * decimation / steps` sys cycles of extraction,
+    the LFSR sampling the oscillators on the `rng` clock, of period `2 * prescaler` sys
+    cycles, and shifting `steps` bits per clock (`UnrolledLFSR`). `decimation` and
+    `prescaler` are set at run time by their CSRs (at least 1), the arguments are their
+    reset values. `rate` is the number of words generated during the
+    last `rate_window` sys cycles (`rate_window` CSR). By default the generator stops after
+    a word until the host pulses `update_value`. With the `stream` CSR set,
+    every word is pushed in a FIFO of `fifo_depth` words and extraction continues: reading
+    the `data` CSR pops the FIFO, `level` is its level and `overflow` counts the words
+    dropped while it was full. Clearing `stream` empties the FIFO and clears `overflow`.
+
+    The oscillators are split in `lanes` groups, each with its own sampler and LFSR. The
+    lanes complete their words together, and the words are pushed in the FIFO in lane
+    order. `random_word` is the word of lane 0, `metastable`, `trng` and `word_o` are its
+    signals. Within a lane, the oscillators are split in `steps` groups, each XORed into
+    one of the `steps` sampler flip-flops feeding the LFSR.
+    """
+    def __init__(self, oscillators, shiftreg_init=0b0110_1011_1110_0100_1000_0101_0110_1100, taps=0b0000_0000_0000_0000_0000_0000_1100_0101, clock_domain="sys", fifo_depth=512,
+            decimation=1024, prescaler=2, rate_window=2**24, lanes=1, steps=1):
+        assert len(oscillators) % (lanes*steps) == 0
         self.reset = Signal()
-        self.metastable = Signal()
+        self.metastable = Signal(steps)
         shiftreg_width = 32
-        decimation = 1024
+        assert shiftreg_width % steps == 0
         self.word_o = Signal(shiftreg_width)
         self.word_ready = Signal()
-        
-        bits_remaining = Signal(max=shiftreg_width*decimation)
+
+        self._decimation = CSRStorage(16, reset=decimation)
+        self._prescaler = CSRStorage(8, reset=prescaler)
+        self._rate = CSRStatus(32)
+        self._rate_window = CSRStatus(32, reset=rate_window)
+
+        # 0 is taken as 1
+        decimation = Signal(16)
+        prescaler = Signal(8)
+        self.comb += [
+            decimation.eq(Mux(self._decimation.storage == 0, 1, self._decimation.storage)),
+            prescaler.eq(Mux(self._prescaler.storage == 0, 1, self._prescaler.storage))
+        ]
+
+        bits_remaining = Signal(max=shiftreg_width*2**16)
+        word_cycles = Signal.like(bits_remaining)
+        self.comb += word_cycles.eq(shiftreg_width//steps*decimation - 1)
 
         self._update_value = CSRStorage(1)
         self._ready = CSRStatus()
         self._random_word = CSRStatus(32)
+        self._stream = CSRStorage(reset=0)
+        self._level = CSRStatus(bits_for(fifo_depth))
+        self._overflow = CSRStatus(32)
+        self._data = CSRStatus(32)
         
         #sampler = Sampler()
         #sampling_interval = 1024
         #timer  = WaitTimer(int(sampling_interval))
         #debias = Debias()
-        lfsr = LFSR(shiftreg_width, shiftreg_init, taps)
 
         self.oscillators_o = oscillators_o = Signal(len(oscillators))
         for i, o in enumerate(oscillators):
             self.comb += oscillators_o[i].eq(o.ring_out) # foo.eq(Cat(0, 0, bar, 0, baz, 1)),
             self.comb += o.enable.eq(~self.reset)
-        self.comb += [
-            self.metastable.eq(reduce(xor, oscillators_o)),
-            lfsr.i.eq(self.metastable),
-            lfsr.reset.eq(self.reset)
-        ]
 
         #cd_chain = ClockDomain(reset_less=True)
         #lsfr = ClockDomainsRenamer("chain")lsfr
         
-        cd_rng = ClockDomain("rng", reset_less=True)
-        self.clock_domains += cd_rng
+        self.clock_domains.cd_rng = cd_rng = ClockDomain("rng", reset_less=True)
 
-        prescaler_clk_counter = Signal(2)
-        self.sync += prescaler_clk_counter.eq(prescaler_clk_counter + 1)
-        self.sync += cd_rng.clk.eq(prescaler_clk_counter[-1])
+        prescaler_clk_counter = Signal(8)
+        self.sync += \
+            If(prescaler_clk_counter >= prescaler - 1,
+                prescaler_clk_counter.eq(0),
+                cd_rng.clk.eq(~cd_rng.clk)
+            ).Else(
+                prescaler_clk_counter.eq(prescaler_clk_counter + 1)
+            )
 
         self.counter_rng = counter = Signal(8)
         self.sync.rng += counter.eq(counter + 1)
 
-        self.specials += [
-            MultiReg(self.word_ready, self._ready.status, clock_domain),
-            MultiReg(self.word_o, self._random_word.status, clock_domain),
-        ]
+        self.specials += MultiReg(self.word_ready, self._ready.status, clock_domain)
 
-        self.trng = Signal()
-        self.sync.rng += self.trng.eq(self.metastable)
-        self.comb += lfsr.i.eq(self.trng)
-        self.comb += self.word_o.eq(lfsr.shiftreg)
+        self.trng = Signal(steps)
+        group = len(oscillators) // (lanes*steps)
+        lane_words = []
+        for lane in range(lanes):
+            metastable, trng, word_o = (self.metastable, self.trng, self.word_o) if lane == 0 else \
+                (Signal(steps), Signal(steps), Signal(shiftreg_width))
+            lane_init = rotate_left(shiftreg_init, 7*lane, shiftreg_width)
+            if steps == 1:
+                lfsr = LFSR(shiftreg_width, lane_init, taps)
+            else:
+                lfsr = UnrolledLFSR(shiftreg_width, lane_init, taps, steps)
+            word = Signal(shiftreg_width)
+            first = lane*steps*group
+            self.comb += [
+                metastable[j].eq(reduce(xor, oscillators_o[first + j*group:first + (j+1)*group]))
+                for j in range(steps)
+            ]
+            self.comb += [
+                lfsr.reset.eq(self.reset),
+                lfsr.i.eq(trng),
+                word_o.eq(lfsr.shiftreg)
+            ]
+            self.sync.rng += trng.eq(metastable)
+            self.specials += MultiReg(word_o, word, clock_domain)
+            self.submodules += lfsr, # sampler, debias
+            lane_words.append(word)
+        self.comb += self._random_word.status.eq(lane_words[0])
 
         self.submodules += oscillators
-        self.submodules += lfsr, # sampler, debias
+
+        # free-running mode, the words are queued for burst reads
+        stream = self._stream.storage
+        self.submodules.fifo = fifo = ResetInserter()(SyncFIFO(shiftreg_width, fifo_depth))
+        generated = Signal()
+        held = Array(Signal(shiftreg_width) for _ in range(lanes))
+        push = Signal()
+        push_lane = Signal(max=max(lanes, 2))
+        # the words of the lanes are held and pushed one per cycle
+        self.sync += \
+            If(generated & stream,
+                [word.eq(lane_word) for word, lane_word in zip(held, lane_words)],
+                push.eq(1),
+                push_lane.eq(0)
+            ).Elif(push,
+                If(push_lane == lanes - 1,
+                    push.eq(0)
+                ).Else(
+                    push_lane.eq(push_lane + 1)
+                )
+            )
+        self.comb += [
+            fifo.reset.eq(~stream),
+            fifo.din.eq(held[push_lane]),
+            fifo.we.eq(push),
+            self._level.status.eq(fifo.level),
+            self._data.status.eq(fifo.dout),
+            fifo.re.eq(self._data.we)
+        ]
+        self.sync += \
+            If(~stream,
+                self._overflow.status.eq(0)
+            ).Elif(push & ~fifo.writable,
+                self._overflow.status.eq(self._overflow.status + 1)
+            )
+
+        # words generated per rate window
+        words = Signal(32)
+        window = Signal(max=rate_window)
+        self.sync += \
+            If(window == rate_window - 1,
+                window.eq(0),
+                words.eq(0),
+                self._rate.status.eq(words + Mux(generated, lanes, 0))
+            ).Else(
+                window.eq(window + 1),
+                words.eq(words + Mux(generated, lanes, 0))
+            )
 
         fsm = FSM(reset_state="INIT")
         fsm = ResetInserter()(fsm)
@@ -127,16 +275,214 @@ class RandomLFSR(Module, AutoCSR):
         self.comb += fsm.reset.eq(self._update_value.re)
 
         fsm.act("INIT",
-            NextValue(bits_remaining, (shiftreg_width * decimation) - 1),
+            NextValue(bits_remaining, word_cycles),
             NextState("EXTRACT"),
         )
         fsm.act("EXTRACT",
             NextValue(bits_remaining, bits_remaining - 1),
             If(bits_remaining == 0,
-                NextState("READY"),
+                generated.eq(1),
+                If(stream,
+                    NextValue(bits_remaining, word_cycles),
+                ).Else(
+                    NextState("READY"),
+                )
             )
         )
         fsm.act("READY",
             self.word_ready.eq(1),
+            If(stream,
+                NextState("INIT"),
+            )
             # TODO: disable oscillators to save power
         )
+
+
+import unittest
+
+
+class LFSRTestCase(unittest.TestCase):
+
+    def shift(self, steps, width=32, shiftreg_init=0b0110_1011_1110_0100_1000_0101_0110_1100,
+            taps=0b1100_0101, words=20, seed=0):
+        """Shift registers of `LFSR` and `UnrolledLFSR` after every `steps` bits."""
+        import random
+        rng = random.Random(seed)
+        bits = [rng.getrandbits(1) for _ in range(words*steps)]
+        top = Module()
+        top.submodules.lfsr = lfsr = LFSR(width, shiftreg_init, taps, clock_domain="sys")
+        top.submodules.unrolled = unrolled = CEInserter()(UnrolledLFSR(width, shiftreg_init, taps, steps, clock_domain="sys"))
+        # both are reset on cycle 0, then LFSR shifts bit n on cycle n + 1 and UnrolledLFSR
+        # shifts bits n - steps + 1 to n on that cycle
+        cycle = Signal(max=len(bits) + 2)
+        n = Signal.like(cycle)
+        top.sync += cycle.eq(cycle + 1)
+        top.comb += [
+            n.eq(cycle - 1),
+            lfsr.reset.eq(cycle == 0),
+            unrolled.reset.eq(cycle == 0),
+            lfsr.i.eq(Array(bits + [0, 0])[n]),
+            unrolled.i.eq(Array([sum(bit << j for j, bit in enumerate(bits[n - n % steps:][:steps]))
+                for n in range(len(bits))] + [0, 0])[n]),
+            unrolled.ce.eq((cycle == 0) | Array([n % steps == steps - 1 for n in range(len(bits))] + [0, 0])[n])
+        ]
+        states = []
+
+        def generator():
+            for _ in range(len(bits) + 1):
+                yield
+                shifted = (yield cycle) - 1
+                if shifted >= 0 and shifted % steps == 0:
+                    states.append(((yield lfsr.shiftreg), (yield unrolled.shiftreg)))
+
+        run_simulation(top, generator())
+        return states
+
+    def test_unrolled(self):
+        for steps in (2, 4, 8):
+            states = self.shift(steps)
+            self.assertEqual(len(states), 21)
+            self.assertEqual([unrolled for _, unrolled in states], [lfsr for lfsr, _ in states], steps)
+            self.assertEqual(len(set(lfsr for lfsr, _ in states)), len(states))
+
+    def test_unrolled_feedback(self):
+        # 3 bits LFSR tapping bit 0, after one shift: s1, s2, s0 ^ i0
+        self.assertEqual(unrolled_feedback(3, 0b001, 1), [0b0010, 0b0100, 0b1001])
+        self.assertEqual(unrolled_feedback(3, 0b001, 2), [0b00100, 0b01001, 0b10010])
+
+
+class RandomLFSRTestCase(unittest.TestCase):
+
+    class Oscillator(Module):
+        """Pseudo-random ring output, from a 16 bits LFSR seeded by `seed`."""
+
+        def __init__(self, seed):
+            self.enable = Signal()
+            self.ring_out = Signal()
+            state = Signal(16, reset=seed)
+            self.sync += state.eq(Cat(state[1:], state[0] ^ state[2] ^ state[3] ^ state[5]))
+            self.comb += self.ring_out.eq(state[0])
+
+    def random_lfsr(self, oscillators=2, **kwargs):
+        return RandomLFSR([self.Oscillator(0xace1 + 37*i) for i in range(oscillators)], **kwargs)
+
+    def test_stream(self):
+        depth = 4
+        dut = self.random_lfsr(fifo_depth=depth, decimation=1, prescaler=1)
+        log = {}
+
+        def generator():
+            yield dut._stream.storage.eq(1)
+            pushed, samples = [], []
+            while len(samples) < 300:
+                yield
+                if (yield dut.fifo.we) and (yield dut.fifo.writable):
+                    pushed.append((yield dut.fifo.din))
+                samples.append(((yield dut._level.status), (yield dut._overflow.status)))
+            log['pushed'], log['samples'] = pushed, samples
+            # pop one word right after a push, before the next word
+            while not (yield dut.fifo.we):
+                yield
+            yield
+            log['head'] = (yield dut._data.status)
+            log['level_before'] = (yield dut._level.status)
+            yield dut._data.we.eq(1)
+            yield
+            yield dut._data.we.eq(0)
+            yield
+            log['level_after'] = (yield dut._level.status)
+            log['next'] = (yield dut._data.status)
+            yield dut._stream.storage.eq(0)
+            yield
+            yield
+            log['cleared'] = ((yield dut._level.status), (yield dut._overflow.status))
+
+        run_simulation(dut, generator(), clocks={"sys": 10, "rng": 20})
+        levels = [level for level, _ in log['samples']]
+        self.assertEqual(levels, sorted(levels))
+        self.assertEqual(levels[-1], depth)
+        for (level, overflow), (_, next_overflow) in zip(log['samples'], log['samples'][1:]):
+            self.assertIn(next_overflow - overflow, (0, 1) if level == depth else (0,))
+        self.assertGreater(log['samples'][-1][1], 0)
+        self.assertEqual(log['pushed'][:2], [log['head'], log['next']])
+        self.assertEqual(len(set(log['pushed'])), len(log['pushed']))
+        self.assertEqual(log['level_after'], log['level_before'] - 1)
+        self.assertEqual(log['cleared'], (0, 0))
+
+    def test_periods(self):
+        dut = self.random_lfsr(steps=2, decimation=2, prescaler=1, rate_window=256)
+        log = {}
+
+        def intervals(signal, n):
+            """Sets of cycles between the first `n` rising edges of `signal`."""
+            times, cycle, previous = [], 0, (yield signal)
+            while len(times) < n:
+                yield
+                cycle += 1
+                value = yield signal
+                if value and not previous:
+                    times.append(cycle)
+                previous = value
+            return set(b - a for a, b in zip(times, times[1:]))
+
+        def generator():
+            yield dut._stream.storage.eq(1)
+            for prescaler, decimation in ((1, 2), (3, 2), (0, 1), (1, 0)):
+                yield dut._prescaler.storage.eq(prescaler)
+                yield dut._decimation.storage.eq(decimation)
+                yield from intervals(dut.fifo.we, 2) # let the current word complete
+                log[prescaler, decimation] = (
+                    (yield from intervals(dut.cd_rng.clk, 4)),
+                    (yield from intervals(dut.fifo.we, 4))
+                )
+            yield dut._decimation.storage.eq(2)
+            for _ in range(3*256):
+                yield
+            log['rate'] = (yield dut._rate.status)
+            log['rate_window'] = (yield dut._rate_window.status)
+
+        run_simulation(dut, generator(), clocks={"sys": 10})
+        # rng clock period of 2*prescaler sys cycles, 32//steps*decimation sys cycles per word
+        self.assertEqual(log[1, 2], ({2}, {32}))
+        self.assertEqual(log[3, 2], ({6}, {32}))
+        self.assertEqual(log[0, 1], ({2}, {16}))
+        self.assertEqual(log[1, 0], ({2}, {16}))
+        self.assertEqual(log['rate'], 256 // 32)
+        self.assertEqual(log['rate_window'], 256)
+
+    def test_lanes(self):
+        def stream(lanes, cycles=200):
+            dut = self.random_lfsr(oscillators=2*lanes, lanes=lanes, fifo_depth=16,
+                decimation=1, prescaler=1, rate_window=256)
+            log = {'pushes': [], 'popped': []}
+
+            def generator():
+                yield dut._stream.storage.eq(1)
+                for cycle in range(cycles):
+                    yield
+                    if (yield dut.fifo.we):
+                        log['pushes'].append((cycle, (yield dut.fifo.din)))
+                log['level'] = (yield dut._level.status)
+                for _ in range(log['level']):
+                    log['popped'].append((yield dut._data.status))
+                    yield dut._data.we.eq(1)
+                    yield
+                    yield dut._data.we.eq(0)
+                    yield
+                for _ in range(2*256): # a whole rate window
+                    yield
+                log['rate'] = (yield dut._rate.status)
+
+            run_simulation(dut, generator(), clocks={"sys": 10, "rng": 20})
+            return log
+
+        single, dual = stream(lanes=1), stream(lanes=2)
+        cycles = [cycle for cycle, _ in dual['pushes']]
+        words = [word for _, word in dual['pushes']]
+        # the words of a generation are pushed on consecutive cycles, lane 0 first
+        self.assertEqual(cycles[1::2], [cycle + 1 for cycle in cycles[::2]])
+        self.assertEqual(words[::2], [word for _, word in single['pushes']])
+        self.assertTrue(all(lane0 != lane1 for lane0, lane1 in zip(words[::2], words[1::2])))
+        self.assertEqual(dual['level'], 2*single['level'])
+        self.assertEqual(dual['popped'], words)
+        self.assertEqual((single['rate'], dual['rate']), (256 // 32, 2 * 256 // 32))
@@ -0,0 +1,644 @@
+"""Columnar on-disk store of PUF responses.
+
+A store is a directory holding one ``.npy`` file per column, an ``index.npy`` table and a
+``meta.json`` header. Rows are sorted by (chip, challenge, offset, voltage) so that the index
+maps every (chip, challenge, offset, voltage) group to a contiguous row range. Columns are
+memory-mapped when the store is opened.
+
+Responses can also be written while they are acquired, to an append-only stream directory
+(see `StreamWriter`), which is opened like a store.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+
+COLUMNS = {
+    'chip':    np.uint32,
+    'cell0':   np.uint16,
+    'cell1':   np.uint16,
+    'sample':  np.uint32,
+    'offset':  np.int32,
+    'voltage': np.float64,
+    'value':   np.int64,
+}
+GROUP_KEYS = ('chip', 'cell0', 'cell1', 'offset', 'voltage')
+INDEX_DTYPE = np.dtype([(key, COLUMNS[key]) for key in GROUP_KEYS] + [('start', np.int64), ('stop', np.int64)])
+
+NO_OFFSET = -1 # offset of samples without offset attribute
+NO_VOLTAGE = np.nan # voltage of samples without voltage attribute
+
+STORE_VERSION = 1
+STREAM_VERSION = 1
+
+
+def _challenge_key(cell0, cell1):
+    return f'{cell0}:{cell1}'
+
+def _challenge_code(cell0, cell1):
+    return np.asarray(cell0).astype(np.int64) << 16 | cell1
+
+def _parse_challenge(key):
+    cell0, cell1 = key.split(':')
+    return int(cell0), int(cell1)
+
+def _missing(column, values):
+    if column == 'voltage':
+        return np.isnan(values)
+    return values == NO_OFFSET
+
+
+def _concatenate(arrays, dtype):
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+
+def json_to_columns(dumps):
+    """Convert `{challenge: [samples]}` dumps (one per chip) to column arrays.
+
+    A sample without 'offset' attribute starts a new acquisition round, the following
+    analyzer samples (with 'offset') share its sample index.
+    """
+    columns = {column: [] for column in COLUMNS}
+    for chip_idx, dump in enumerate(dumps):
+        for challenge, samples in dump.items():
+            cell0, cell1 = _parse_challenge(challenge)
+            sample_idx = -1
+            for sample in samples:
+                if not isinstance(sample, dict): # raw values (ropuf_remote.py, hybridpuf_remote.py)
+                    sample = {'value': sample}
+                if 'offset' not in sample or sample_idx < 0:
+                    sample_idx += 1
+                columns['chip'].append(chip_idx)
+                columns['cell0'].append(cell0)
+                columns['cell1'].append(cell1)
+                columns['sample'].append(sample_idx)
+                columns['offset'].append(sample.get('offset', NO_OFFSET))
+                columns['voltage'].append(sample.get('voltage', NO_VOLTAGE))
+                columns['value'].append(sample['value'])
+    return {column: np.array(values, dtype=COLUMNS[column]) for column, values in columns.items()}
+
+def sort_columns(columns):
+    """Sort the rows by group keys (stable) and build the group index."""
+    order = np.lexsort([columns[key] for key in reversed(GROUP_KEYS)])
+    columns = {column: values[order] for column, values in columns.items()}
+
+    n_rows = len(columns['value'])
+    boundaries = np.zeros(n_rows, dtype=bool)
+    if n_rows:
+        boundaries[0] = True
+    for key in GROUP_KEYS:
+        values = columns[key]
+        changed = values[1:] != values[:-1]
+        if key == 'voltage':
+            changed &= ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+        boundaries[1:] |= changed
+    starts = np.flatnonzero(boundaries)
+
+    index = np.empty(len(starts), dtype=INDEX_DTYPE)
+    for key in GROUP_KEYS:
+        index[key] = columns[key][starts]
+    index['start'] = starts
+    index['stop'] = np.append(starts[1:], n_rows)
+    return columns, index
+
+def write_store(path, idents, columns):
+    """Write a store directory from column arrays (see `COLUMNS`)."""
+    path = Path(path)
+    columns, index = sort_columns(columns)
+    tmp_path = path.with_name(path.name + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    for column, dtype in COLUMNS.items():
+        np.save(tmp_path / f'{column}.npy', columns[column].astype(dtype, copy=False))
+    np.save(tmp_path / 'index.npy', index)
+    with open(tmp_path / 'meta.json', 'w') as f:
+        json.dump({'version': STORE_VERSION, 'idents': idents, 'rows': len(columns['value'])}, f)
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def read_json_dumps(filenames):
+    """Load legacy `{ident, dump}` JSON files, return idents and dumps."""
+    idents, dumps = [], []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            response_data = json.load(f)
+        idents.append(response_data.get('ident') or Path(filename).stem)
+        dumps.append(response_data['dump'])
+    return idents, dumps
+
+def convert_json(filenames, path):
+    """Convert legacy JSON dumps (one file per chip) to a store directory."""
+    idents, dumps = read_json_dumps(filenames)
+    write_store(path, idents, json_to_columns(dumps))
+    return ResponseStore(path)
+
+
+class _JSONStream:
+    """Incremental reader of JSON tokens and values from a text file."""
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            raise ValueError('unexpected end of JSON dump')
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def token(self):
+        """Return the next structural character."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos-1]
+            self._fill()
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        while True:
+            self.token()
+            self.pos -= 1
+            try:
+                value, self.pos = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                self._fill()
+                continue
+            if self.pos == len(self.buffer) and not isinstance(value, (str, list, dict)):
+                self._fill() # a number may continue in the next chunk
+                continue
+            return value
+
+def iter_json_dump(filename, header=None, chunk_size=1<<20):
+    """Yield the (challenge, samples) items of a legacy JSON dump one challenge at a time.
+
+    Only one challenge is decoded at once. The other top-level entries ('ident') are
+    stored into `header` if given.
+    """
+    with open(filename, 'r') as f:
+        stream = _JSONStream(f, chunk_size)
+        if stream.token() != '{':
+            raise ValueError(f'{filename}: not a JSON dump')
+        while True:
+            key = stream.value()
+            if stream.token() != ':':
+                raise ValueError(f'{filename}: malformed JSON dump')
+            if key == 'dump':
+                if stream.token() != '{':
+                    raise ValueError(f'{filename}: malformed JSON dump')
+                separator = stream.token()
+                while separator != '}':
+                    stream.pos -= 1
+                    challenge = stream.value()
+                    if stream.token() != ':':
+                        raise ValueError(f'{filename}: malformed JSON dump')
+                    yield challenge, stream.value()
+                    separator = stream.token()
+                    if separator == ',':
+                        separator = stream.token()
+            else:
+                value = stream.value()
+                if header is not None:
+                    header[key] = value
+            if stream.token() == '}':
+                break
+
+def read_json_chip(filename):
+    """Read one JSON dump as (ident, columns), converting it challenge by challenge."""
+    if is_stream(filename):
+        return read_stream(filename)
+    header = {}
+    batches = [json_to_columns([{challenge: samples}]) for challenge, samples in iter_json_dump(filename, header)]
+    columns = {
+        column: np.concatenate([batch[column] for batch in batches]) if batches else np.empty(0, dtype=dtype)
+        for column, dtype in COLUMNS.items()
+    }
+    return header.get('ident') or Path(filename).stem, columns
+
+def iter_json_stores(filenames):
+    """Yield a single-chip `ResponseStore` per JSON dump (or stream).
+
+    The next dump is parsed in a worker process while the current one is processed, at
+    most two chips are held in memory.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        raise ValueError('no response dump to read')
+    with ProcessPoolExecutor(1) as executor:
+        pending = executor.submit(read_json_chip, filenames[0])
+        for filename in filenames[1:] + [None]:
+            ident, columns = pending.result()
+            if filename is not None:
+                pending = executor.submit(read_json_chip, filename)
+            yield ResponseStore(idents=[ident], columns=columns)
+            del columns
+
+
+class ResponseStore:
+    """Responses of a set of chips, backed by (memory-mapped) column arrays."""
+
+    def __init__(self, path=None, idents=None, columns=None, index=None, mmap=True):
+        if path is not None:
+            path = Path(path)
+            with open(path / 'meta.json', 'r') as f:
+                meta = json.load(f)
+            if meta['version'] != STORE_VERSION:
+                raise ValueError(f'unsupported store version {meta["version"]}')
+            mmap_mode = 'r' if mmap else None
+            idents = meta['idents']
+            columns = {column: np.load(path / f'{column}.npy', mmap_mode=mmap_mode) for column in COLUMNS}
+            index = np.load(path / 'index.npy')
+        elif index is None:
+            columns, index = sort_columns(columns)
+        self.path = path
+        self.idents = idents
+        self.columns = columns
+        self.index = index
+        self._partitions = {}
+
+    @classmethod
+    def from_json(cls, filenames):
+        idents, dumps = read_json_dumps(filenames)
+        return cls(idents=idents, columns=json_to_columns(dumps))
+
+    @classmethod
+    def concatenate(cls, stores):
+        idents, columns = [], {column: [] for column in COLUMNS}
+        for store in stores:
+            for column in COLUMNS:
+                values = np.asarray(store.columns[column])
+                if column == 'chip':
+                    values = values + len(idents)
+                columns[column].append(values)
+            idents += store.idents
+        return cls(idents=idents, columns={column: np.concatenate(values) for column, values in columns.items()})
+
+    def __len__(self):
+        return len(self.columns['value'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @cached_property
+    def _challenge_codes(self):
+        return np.unique(_challenge_code(self.index['cell0'], self.index['cell1']))
+
+    @property
+    def challenges(self):
+        """Challenge keys ('cell0:cell1'), sorted."""
+        return [_challenge_key(code >> 16, code & 0xffff) for code in self._challenge_codes.tolist()]
+
+    def offsets(self, offset_attr):
+        """Sorted distinct values of an offset attribute ('offset' or 'voltage')."""
+        values = self.index[offset_attr]
+        return np.unique(values[~_missing(offset_attr, values)]).tolist()
+
+    def _select(self, offset_attr, offset):
+        index = self.index
+        if offset_attr is None:
+            # remove all values with additional offset attribute(s)
+            return index[_missing('offset', index['offset']) & _missing('voltage', index['voltage'])]
+        return index[index[offset_attr] == offset]
+
+    def _partition_index(self, offset_attr):
+        """Groups sorted by (offset, chip, challenge) and the bounds of each offset, built once."""
+        if offset_attr not in self._partitions:
+            if offset_attr is None:
+                selected = self._select(None, None)
+                offsets, offset_ids = [None], np.zeros(len(selected), dtype=np.int64)
+            else:
+                selected = self.index[~_missing(offset_attr, self.index[offset_attr])]
+                offsets, offset_ids = np.unique(selected[offset_attr], return_inverse=True)
+                offsets = offsets.tolist()
+            challenge_ids = np.searchsorted(self._challenge_codes, _challenge_code(selected['cell0'], selected['cell1']))
+            order = np.lexsort((challenge_ids, selected['chip'], offset_ids))
+            bounds = np.searchsorted(offset_ids[order], np.arange(len(offsets) + 1))
+            self._partitions[offset_attr] = (offsets, bounds, selected[order], challenge_ids[order])
+        return self._partitions[offset_attr]
+
+    def _tensor(self, groups, challenge_ids):
+        """Gather the rows of sorted groups into a (chip, challenge, sample) tensor."""
+        lengths = groups['stop'] - groups['start']
+        n_rows = int(lengths.sum())
+        group_offsets = np.cumsum(lengths) - lengths
+        rows = np.repeat(groups['start'] - group_offsets, lengths) + np.arange(n_rows)
+        n_challenges = len(self._challenge_codes)
+        keys = np.repeat(groups['chip'].astype(np.int64) * n_challenges + challenge_ids, lengths)
+        # rank of each row within its (chip, challenge)
+        positions = np.arange(n_rows)
+        run_start = np.ones(n_rows, dtype=bool)
+        run_start[1:] = keys[1:] != keys[:-1]
+        ranks = positions - np.maximum.accumulate(np.where(run_start, positions, 0)) if n_rows else positions
+        counts = np.bincount(keys, minlength=len(self.idents) * n_challenges)
+        counts = counts.reshape(len(self.idents), n_challenges)
+        values = np.zeros(counts.shape + (int(counts.max(initial=0)),), dtype=np.int64)
+        values[keys // n_challenges, keys % n_challenges, ranks] = self.columns['value'][rows]
+        return values, counts
+
+    def partition(self, offset_attr=None):
+        """Yield (offset, values, counts) for every value of the offset attribute.
+
+        The responses are grouped by (offset, chip, challenge) in a single pass, `values`
+        is a (chip, challenge, sample) tensor (see `litepuf.evaluation`), offsets are sorted.
+        """
+        offsets, bounds, groups, challenge_ids = self._partition_index(offset_attr)
+        for offset_idx, offset in enumerate(offsets):
+            group_slice = slice(bounds[offset_idx], bounds[offset_idx+1])
+            yield (offset, *self._tensor(groups[group_slice], challenge_ids[group_slice]))
+
+    def tensor(self, offset_attr=None, offset=None):
+        """Return the (values, counts) response tensor of a single offset."""
+        offsets, bounds, groups, challenge_ids = self._partition_index(offset_attr)
+        offset_idx = offsets.index(offset)
+        group_slice = slice(bounds[offset_idx], bounds[offset_idx+1])
+        return self._tensor(groups[group_slice], challenge_ids[group_slice])
+
+    def chips(self, offset_attr=None, offset=None):
+        """Yield a `{challenge: values}` mapping per chip, like the legacy JSON dumps."""
+        challenges = self.challenges
+        selected = self._select(offset_attr, offset)
+        chip_bounds = np.searchsorted(selected['chip'], np.arange(len(self.idents) + 1))
+        value = self.columns['value']
+        for chip_idx in range(len(self.idents)):
+            groups = {challenge: [] for challenge in challenges}
+            for group in selected[chip_bounds[chip_idx]:chip_bounds[chip_idx+1]]:
+                challenge = _challenge_key(group['cell0'], group['cell1'])
+                groups[challenge].append(value[group['start']:group['stop']])
+            yield {challenge: _concatenate(values, value.dtype) for challenge, values in groups.items()}
+
+
+class StreamWriter:
+    """Append-only writer of the responses of one chip, as they are acquired.
+
+    Rows are buffered and written in blocks (one ``.npz`` file per block) to the `path`
+    directory, at the latest every `block_rows` rows or `flush_interval` seconds. The
+    acquisition is divided in units (e.g. a sample round), and blocks are only written at
+    unit boundaries. A block is written to a temporary file and renamed, then a line with
+    its name, the number of completed units and the key of the last one is appended to
+    ``manifest.jsonl``: a unit is complete once its manifest line is on disk.
+
+    Opening an existing stream resumes it, `done` and `last` tell which units to skip.
+    Lines after a torn (partial) manifest line and blocks without a manifest line are
+    discarded, a stream with an empty or torn header starts over.
+    """
+
+    def __init__(self, path, ident=None, block_rows=1<<14, flush_interval=10.0):
+        self.path = Path(path)
+        self.block_rows = block_rows
+        self.flush_interval = flush_interval
+        self.buffer = {column: [] for column in COLUMNS}
+        self.done = 0
+        self.last = None
+        self.blocks = 0
+        self.pending = 0 # units ended since the last flush
+        self.pending_rows = 0 # rows of these units
+        self.pending_last = None
+        self.flushed_at = time.monotonic()
+
+        manifest_path = self.path / 'manifest.jsonl'
+        header = None
+        if manifest_path.exists():
+            header, entries, size = _read_manifest(manifest_path)
+        if header is not None:
+            if ident is not None and header['ident'] != ident:
+                raise ValueError(f'{path} is the stream of {header["ident"]}, not {ident}')
+            self.ident = header['ident']
+            self.manifest = open(manifest_path, 'r+')
+            self.manifest.truncate(size) # drop a torn last line
+            self.manifest.seek(size)
+            for entry in entries:
+                self.blocks += entry['block'] is not None
+                self.done = entry['done']
+                self.last = entry['last']
+        else:
+            self.ident = ident
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.manifest = open(manifest_path, 'w')
+            self._log({'version': STREAM_VERSION, 'ident': ident})
+            _fsync_dir(self.path)
+
+    def _log(self, entry):
+        self.manifest.write(json.dumps(entry) + '\n')
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+
+    def append(self, cell0, cell1, sample, value, offset=NO_OFFSET, voltage=NO_VOLTAGE):
+        buffer = self.buffer
+        buffer['chip'].append(0)
+        buffer['cell0'].append(cell0)
+        buffer['cell1'].append(cell1)
+        buffer['sample'].append(sample)
+        buffer['offset'].append(offset)
+        buffer['voltage'].append(NO_VOLTAGE if voltage is None else voltage)
+        buffer['value'].append(value)
+
+    def extend(self, cell0, cell1, sample, values, offset=NO_OFFSET, voltage=NO_VOLTAGE):
+        """Append many rows at once, every argument is a scalar or an array like `values`."""
+        columns = np.broadcast_arrays(0, cell0, cell1, sample, offset,
+            NO_VOLTAGE if voltage is None else voltage, values)
+        for column, array in zip(('chip', 'cell0', 'cell1', 'sample', 'offset', 'voltage', 'value'), columns):
+            self.buffer[column].extend(array.tolist())
+
+    def end_unit(self, key=None):
+        """Mark the rows appended so far as a complete unit, `key` is stored as `last`."""
+        self.pending += 1
+        self.pending_rows = len(self.buffer['value'])
+        self.pending_last = key
+        if self.pending_rows >= self.block_rows or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows = self.pending_rows
+        block = None
+        if rows:
+            block = f'block_{self.blocks:06d}.npz'
+            tmp_path = self.path / f'{block}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **{column: np.array(values[:rows], dtype=COLUMNS[column]) for column, values in self.buffer.items()})
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path / block)
+            _fsync_dir(self.path) # the rename must be on disk before the manifest line
+            self.blocks += 1
+        self.done += self.pending
+        self.last = self.pending_last
+        self._log({'block': block, 'rows': rows, 'done': self.done, 'last': self.last})
+        for values in self.buffer.values():
+            del values[:rows] # keep the rows of the unit in progress
+        self.pending = 0
+        self.pending_rows = 0
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        """Flush the complete units, the rows of an unfinished unit are dropped."""
+        self.flush()
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _fsync_dir(path):
+    """Make the entries created or renamed in a directory durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _read_manifest(manifest_path):
+    """Return the header, the block entries and the size of the valid part of a manifest.
+
+    The header is None if it is empty or torn (the stream was never started).
+    """
+    entries = []
+    size = 0
+    with open(manifest_path, 'r') as f:
+        line = f.readline()
+        try:
+            header = json.loads(line) if line.endswith('\n') else None
+        except json.JSONDecodeError:
+            header = None
+        if header is None:
+            return None, entries, size
+        size = f.tell()
+        for line in iter(f.readline, ''):
+            if not line.endswith('\n'):
+                break
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            size = f.tell()
+    if header['version'] != STREAM_VERSION:
+        raise ValueError(f'unsupported stream version {header["version"]}')
+    return header, entries, size
+
+def is_stream(path):
+    return (Path(path) / 'manifest.jsonl').is_file()
+
+def iter_stream_blocks(path):
+    """Yield the column arrays of the blocks of a stream, one block at a time."""
+    path = Path(path)
+    _, entries, _ = _read_manifest(path / 'manifest.jsonl')
+    for entry in entries:
+        if entry['block'] is not None:
+            with np.load(path / entry['block']) as block:
+                yield {column: block[column] for column in COLUMNS}
+
+def read_stream(path):
+    """Read a stream as (ident, columns)."""
+    header, _, _ = _read_manifest(Path(path) / 'manifest.jsonl')
+    blocks = list(iter_stream_blocks(path))
+    columns = {column: _concatenate([block[column] for block in blocks], dtype) for column, dtype in COLUMNS.items()}
+    ident = header['ident'] if header is not None else None
+    return ident or Path(path).name, columns
+
+
+def is_store(path):
+    return (Path(path) / 'meta.json').is_file()
+
+def open_responses(paths):
+    """Open response stores, streams and/or legacy JSON dumps as a single `ResponseStore`."""
+    paths = list(paths)
+    if not paths:
+        raise ValueError('no response store or dump to open')
+    if len(paths) == 1 and is_store(paths[0]):
+        return ResponseStore(paths[0])
+    json_files = [path for path in paths if not is_store(path) and not is_stream(path)]
+    stores = [ResponseStore(path) for path in paths if is_store(path)]
+    for path in paths:
+        if is_stream(path):
+            ident, columns = read_stream(path)
+            stores.append(ResponseStore(idents=[ident], columns=columns))
+    if json_files:
+        stores.append(ResponseStore.from_json(json_files))
+    return ResponseStore.concatenate(stores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON PUF dumps to a response store")
+    parser.add_argument('store', help='output store directory')
+    parser.add_argument('dump_files', nargs='+')
+    args = parser.parse_args()
+
+    store = convert_json(args.dump_files, args.store)
+    print(f'{len(store)} responses of {len(store.idents)} chips written to {args.store}')
+
+if __name__ == "__main__":
+    main()
+
+
+import unittest
+
+
+class StreamTestCase(unittest.TestCase):
+
+    def test_no_input(self):
+        with self.assertRaises(ValueError):
+            open_responses([])
+        with self.assertRaises(ValueError):
+            list(iter_json_stores([]))
+
+    def test_resume(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'stream'
+            with StreamWriter(path, ident='chip', flush_interval=0) as writer:
+                for sample in range(3):
+                    writer.append(0, 1, sample, sample)
+                    writer.end_unit([sample])
+                writer.append(0, 1, 3, 3) # unfinished unit, dropped
+            with open(path / 'manifest.jsonl', 'a') as f:
+                f.write('{"block": "block_000003.npz", "ro') # torn line
+
+            writer = StreamWriter(path, ident='chip')
+            self.assertEqual((writer.done, writer.last), (3, [2]))
+            writer.append(0, 1, 3, 3)
+            writer.extend(0, 1, 3, np.array([4, 5]), offset=np.array([0, 10]))
+            writer.end_unit([3])
+            writer.close()
+            ident, columns = read_stream(path)
+            self.assertEqual(ident, 'chip')
+            self.assertEqual(columns['value'].tolist(), [0, 1, 2, 3, 4, 5])
+            self.assertEqual(columns['offset'].tolist(), [NO_OFFSET]*4 + [0, 10])
+            with self.assertRaises(ValueError):
+                StreamWriter(path, ident='other')
+
+    def test_torn_header(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'stream'
+            path.mkdir()
+            for header in ('', '{"version": 1, "id'):
+                with open(path / 'manifest.jsonl', 'w') as f:
+                    f.write(header)
+                self.assertEqual(read_stream(path)[1]['value'].tolist(), [])
+                with StreamWriter(path, ident='chip', flush_interval=0) as writer:
+                    self.assertEqual((writer.done, writer.last), (0, None))
+                    writer.append(0, 1, 0, 7)
+                    writer.end_unit([0])
+                ident, columns = read_stream(path)
+                self.assertEqual(ident, 'chip')
+                self.assertEqual(columns['value'].tolist(), [7])
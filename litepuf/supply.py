@@ -0,0 +1,175 @@
+"""Programmable supplies for voltage sweeps.
+
+A supply sets the core voltage and reads back the measured voltage, so that a sweep waits
+for the rail to settle (`Supply.settle`) instead of sleeping a fixed time. `sweep` orders
+the acquisition voltage-major: all the samples of an operating point are taken before
+the supply is reprogrammed.
+"""
+import math
+import random
+import time
+from ctypes import byref, c_double, c_int, cdll
+from decimal import Decimal
+
+# max recommended operating conditions for ECP5-5G is 1.26V
+# absolute maximum rating is 1.32V for ECP5 and ECP5-5G
+MAX_VOLTAGE = Decimal('1.32')
+
+
+def voltage_range(start, stop, step):
+    """Voltages from `start` to `stop` (excluded) by `step`, as Decimals."""
+    start, stop, step = Decimal(start), Decimal(stop), Decimal(step)
+    assert(start <= stop <= MAX_VOLTAGE)
+    return [start + i*step for i in range(math.ceil((stop - start) / step))]
+
+def sweep(samples, voltages, passes=1, shuffle=False, seed=0):
+    """Voltage-major acquisition order, as a list of (sample, voltage) pairs.
+
+    The samples are split in `passes` consecutive chunks; every pass visits all the
+    voltages and takes the samples of its chunk at each of them. With `shuffle`, the order
+    of the voltages is drawn at random for every pass (from `seed`, so that an interrupted
+    sweep is scheduled the same way when resumed), to decorrelate drift from voltage.
+    """
+    rng = random.Random(seed)
+    voltages = list(voltages)
+    order = []
+    for chunk in range(passes):
+        chunk_samples = range(chunk * samples // passes, (chunk + 1) * samples // passes)
+        if shuffle:
+            rng.shuffle(voltages)
+        for voltage in voltages:
+            order += [(sample, voltage) for sample in chunk_samples]
+    return order
+
+
+class Supply:
+    """Base class of the supplies, `set_voltage` and `measure` are implemented by backends."""
+
+    def set_voltage(self, voltage):
+        raise NotImplementedError
+
+    def measure(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def settle(self, voltage, tolerance=0.005, stable=3, interval=0.02, timeout=5.0):
+        """Wait until `stable` consecutive readings are within `tolerance` volts of `voltage`.
+
+        Returns the waiting time, raises `TimeoutError` after `timeout` seconds.
+        """
+        start = time.monotonic()
+        in_range = 0
+        while in_range < stable:
+            if abs(self.measure() - voltage) <= tolerance:
+                in_range += 1
+            else:
+                in_range = 0
+            elapsed = time.monotonic() - start
+            if elapsed > timeout:
+                raise TimeoutError(f'supply not settled at {voltage} V after {timeout} s')
+            if in_range < stable:
+                time.sleep(interval)
+        return time.monotonic() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DigilentSupply(Supply):
+    """Positive supply of a Digilent WaveForms device (Analog Discovery), through libdwf."""
+
+    def __init__(self, voltage=1.20, channel=0, device=-1):
+        from dwfconstants import DwfParamOnClose, hdwfNone
+
+        self.dwf = dwf = cdll.LoadLibrary("libdwf.so")
+        self.hdwf = hdwf = c_int()
+        self.channel = c_int(channel)
+
+        dwf.FDwfParamSet(DwfParamOnClose, c_int(0)) # 0 = run, 1 = stop, 2 = shutdown
+        dwf.FDwfDeviceOpen(c_int(device), byref(hdwf))
+        if hdwf.value == hdwfNone.value:
+            raise IOError("failed to open device")
+
+        dwf.FDwfDeviceAutoConfigureSet(hdwf, c_int(0))
+        # set up analog IO channel nodes
+        # enable positive supply
+        dwf.FDwfAnalogIOChannelNodeSet(hdwf, self.channel, c_int(0), c_double(True))
+        dwf.FDwfAnalogIOChannelNodeSet(hdwf, self.channel, c_int(1), c_double(voltage))
+        # master enable
+        dwf.FDwfAnalogIOEnableSet(hdwf, c_int(True))
+        dwf.FDwfAnalogIOConfigure(hdwf)
+
+    def set_voltage(self, voltage):
+        assert(voltage <= MAX_VOLTAGE)
+        self.dwf.FDwfAnalogIOChannelNodeSet(self.hdwf, self.channel, c_int(1), c_double(voltage))
+        self.dwf.FDwfAnalogIOConfigure(self.hdwf)
+
+    def measure(self):
+        if self.dwf.FDwfAnalogIOStatus(self.hdwf) == 0:
+            raise IOError("device status failed")
+        value = c_double()
+        self.dwf.FDwfAnalogIOChannelNodeStatus(self.hdwf, self.channel, c_int(1), byref(value))
+        return value.value
+
+    def close(self):
+        self.dwf.FDwfDeviceClose(self.hdwf)
+
+
+class MockSupply(Supply):
+    """Supply model with a first order response of time constant `tau` (s) and reading noise."""
+
+    def __init__(self, voltage=1.20, tau=0.05, noise=0.0, seed=None):
+        self.tau = tau
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.start = self.target = float(voltage)
+        self.changed_at = time.monotonic()
+        self.changes = 0
+
+    def set_voltage(self, voltage):
+        assert(voltage <= MAX_VOLTAGE)
+        self.start = self.measure_exact()
+        self.target = float(voltage)
+        self.changed_at = time.monotonic()
+        self.changes += 1
+
+    def measure_exact(self):
+        elapsed = time.monotonic() - self.changed_at
+        return self.target + (self.start - self.target) * math.exp(-elapsed / self.tau)
+
+    def measure(self):
+        return self.measure_exact() + self.rng.gauss(0, self.noise)
+
+
+SUPPLIES = {
+    'digilent': DigilentSupply,
+    'mock': MockSupply,
+}
+
+
+import unittest
+
+
+class SupplyTestCase(unittest.TestCase):
+
+    def test_sweep(self):
+        voltages = voltage_range('1.1', '1.31', '0.02')
+        order = sweep(10, voltages, passes=2, shuffle=True)
+        self.assertEqual(sorted(order), sorted((sample, voltage) for sample in range(10) for voltage in voltages))
+        changes = sum(a[1] != b[1] for a, b in zip(order, order[1:]))
+        self.assertLessEqual(changes, 2 * len(voltages) - 1)
+        self.assertEqual(order, sweep(10, voltages, passes=2, shuffle=True))
+
+    def test_settle(self):
+        supply = MockSupply(tau=0.02, noise=0.0005, seed=0)
+        supply.set_voltage(1.1)
+        elapsed = supply.settle(1.1, tolerance=0.005, interval=0.005)
+        self.assertAlmostEqual(supply.measure_exact(), 1.1, delta=0.005)
+        self.assertLess(elapsed, 0.5)
+        with self.assertRaises(TimeoutError):
+            supply.settle(1.2, timeout=0.05)
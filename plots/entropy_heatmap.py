@@ -1,12 +1,15 @@
-from importlib import import_module
-from tempfile import NamedTemporaryFile
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import product
-import re
-import subprocess
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 
+from litepuf.cache import ResponseCache
+from litepuf.capture import load_signal
+from litepuf.entropy import ESTIMATORS
+
 # matplotlib.use("pgf")
 # matplotlib.rcParams.update({
 #     "pgf.texsystem": "pdflatex",
@@ -15,57 +18,114 @@ import matplotlib.pyplot as plt
 #     'pgf.rcfonts': False,
 # })
 
-oscillator_counts = [2, 4, 6, 8, 10]
-inverter_counts = [3, 5, 7, 9, 11]
 
-min_entropy = np.empty(shape=(len(oscillator_counts), len(inverter_counts)))
+def _estimate_capture(filename, signal, estimators):
+    bits = load_signal(filename, signal).astype(np.uint8, copy=False)
+    return {name: ESTIMATORS[name](bits).min_entropy for name in estimators}
+
+def run_grid(grid, pattern, signal, estimators, cache=None, workers=None):
+    """Evaluate the capture of every grid configuration, returns the result table.
+
+    `grid` maps the axis names to their values, `pattern` formats the capture filename of
+    a configuration. Results are cached by capture content.
+    """
+    configurations = [dict(zip(grid, values)) for values in product(*grid.values())]
+    table = []
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {}
+        for configuration in configurations:
+            filename = pattern.format(**configuration)
+            row = dict(configuration, capture=filename)
+            table.append(row)
+            key = cache.key([filename], 'entropy', signal, tuple(estimators)) if cache else None
+            row['estimates'] = cache.get(key) if cache else None
+            if row['estimates'] is not None:
+                continue
+            futures[executor.submit(_estimate_capture, filename, signal, estimators)] = row, key
+        for future in as_completed(futures):
+            row, key = futures[future]
+            row['estimates'] = future.result()
+            if cache:
+                cache.put(key, row['estimates'])
+            print(f"{row['capture']}: {row['estimates']}")
+    return table
 
-for osc_idx, osc_count in enumerate(oscillator_counts):
-    for inv_idx, inv_count in enumerate(inverter_counts):
-        dump = import_module(f'dump_weak_{osc_count}_{inv_count}')
+def plot_heatmap(ax, table, oscillator_counts, inverter_counts, exclude=()):
+    min_entropy = np.full((len(oscillator_counts), len(inverter_counts)), np.nan)
+    for row in table:
+        if row['oscillators'] not in oscillator_counts or row['inverters'] not in inverter_counts:
+            continue
+        i = oscillator_counts.index(row['oscillators'])
+        j = inverter_counts.index(row['inverters'])
+        min_entropy[i, j] = min(entropy for name, entropy in row['estimates'].items() if name not in exclude)
+    print(min_entropy)
 
-        metastable = dump.dump["soc_trng_metastable"]
+    im = ax.imshow(min_entropy, cmap='YlGn')
 
-        with NamedTemporaryFile() as fp:
-            fp.write(bytes(metastable[::2]))
+    # We want to show all ticks...
+    ax.set_xticks(np.arange(len(inverter_counts)))
+    ax.set_yticks(np.arange(len(oscillator_counts)))
+    # ... and label them with the respective list entries
+    ax.set_xticklabels([f'{inv_count} inverters' for inv_count in inverter_counts])
+    ax.set_yticklabels([f'{osc_count} oscillators' for osc_count in oscillator_counts])
 
-            process = subprocess.run(['ea_non_iid', '-i', '-a', '-v', fp.name, '1'], 
-                                stdout=subprocess.PIPE, 
-                                universal_newlines=True)
+    # Rotate the tick labels and set their alignment.
+    plt.setp(ax.get_xticklabels(), rotation=45, ha="right",
+             rotation_mode="anchor")
 
-        pattern = re.compile(r'([^\t]+) Test Estimate = (\d*\.\d+|\d+) / 1 bit\(s\)')
-  
-        result = {test: float(result) for test, result in re.findall(pattern, process.stdout)}
-        print(result)
-        del result['tCompression']
-        min_entropy[osc_idx][inv_idx] = min(result.values())
-        print(f'{osc_count} oscillators with {inv_count} inverters min-entropy: {min(result.values())}')
+    # Loop over data dimensions and create text annotations.
+    textcolors = ("black", "white")
+    threshold = 0.6
+    for i in range(len(oscillator_counts)):
+        for j in range(len(inverter_counts)):
+            color = textcolors[int(im.norm(min_entropy[i, j]) > threshold)]
+            text = ax.text(j, i, min_entropy[i, j],
+                           ha="center", va="center", color=color)
 
-print(min_entropy)
 
-fig, ax = plt.subplots()
-im = ax.imshow(min_entropy, cmap='YlGn')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Min-entropy heatmap of TRNG configurations")
+    parser.add_argument('--oscillators', type=int, nargs='+', default=[2, 4, 6, 8, 10], help='oscillator counts')
+    parser.add_argument('--inverters', type=int, nargs='+', default=[3, 5, 7, 9, 11], help='oscillator lengths')
+    parser.add_argument('--decimations', type=int, nargs='+', default=None, help='decimation values, one heatmap each')
+    parser.add_argument('--pattern', default=None,
+        help="capture (.lcap) or Python dump filename pattern (default: 'dump_weak_{oscillators}_{inverters}.py', '_{decimation}' is appended with --decimations)")
+    parser.add_argument('--signal', default='soc_trng_metastable')
+    parser.add_argument('--estimators', nargs='+', choices=list(ESTIMATORS), default=list(ESTIMATORS))
+    parser.add_argument('--exclude', nargs='*', default=['compression'], help='estimators left out of the min-entropy')
+    parser.add_argument('--table', default='entropy_table.json', help='result table path')
+    parser.add_argument('--from-table', action='store_true', help='render the heatmap from the result table only')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--export-path', default=None, help='export path of plot figure')
+    args = parser.parse_args()
 
-# We want to show all ticks...
-ax.set_xticks(np.arange(len(inverter_counts)))
-ax.set_yticks(np.arange(len(oscillator_counts)))
-# ... and label them with the respective list entries
-ax.set_xticklabels([f'{inv_count} inverters' for inv_count in inverter_counts])
-ax.set_yticklabels([f'{osc_count} oscillators' for osc_count in oscillator_counts])
+    grid = {'oscillators': args.oscillators, 'inverters': args.inverters}
+    pattern = args.pattern or 'dump_weak_{oscillators}_{inverters}.py'
+    if args.decimations:
+        grid['decimation'] = args.decimations
+        if args.pattern is None:
+            pattern = 'dump_weak_{oscillators}_{inverters}_{decimation}.py'
 
-# Rotate the tick labels and set their alignment.
-plt.setp(ax.get_xticklabels(), rotation=45, ha="right",
-         rotation_mode="anchor")
+    if args.from_table:
+        with open(args.table, 'r') as f:
+            table = json.load(f)
+    else:
+        cache = None if args.no_cache else ResponseCache()
+        table = run_grid(grid, pattern, args.signal, args.estimators, cache, args.workers)
+        with open(args.table, 'w') as f:
+            json.dump(table, f, indent=1)
 
-# Loop over data dimensions and create text annotations.
-textcolors = ("black", "white")
-threshold = 0.6
-for i in range(len(oscillator_counts)):
-    for j in range(len(inverter_counts)):
-        color = textcolors[int(im.norm(min_entropy[i, j]) > threshold)]
-        text = ax.text(j, i, min_entropy[i, j],
-                       ha="center", va="center", color=color)
+    decimations = args.decimations or [None]
+    fig, axes = plt.subplots(1, len(decimations), squeeze=False)
+    for ax, decimation in zip(axes[0], decimations):
+        rows = [row for row in table if row.get('decimation') == decimation]
+        plot_heatmap(ax, rows, args.oscillators, args.inverters, args.exclude)
+        if decimation is not None:
+            ax.set_title(f'decimation {decimation}')
 
-fig.tight_layout()
-plt.show()
-#plt.savefig('heatmap.pgf')
+    fig.tight_layout()
+    if args.export_path:
+        fig.savefig(args.export_path, bbox_inches='tight', pad_inches=0)
+    else:
+        plt.show()
@@ -1,30 +1,93 @@
-from functools import reduce
-from itertools import zip_longest
-from importlib import import_module
-from tempfile import NamedTemporaryFile
-import subprocess
+import argparse
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+import numpy as np
 
-def grouper(iterable, n, fillvalue=None):
-    "Collect data into fixed-length chunks or blocks"
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return zip_longest(*args, fillvalue=fillvalue)
+from litepuf.capture import load_signal
 
-bits2bytes = lambda bits: [reduce(lambda byte, bit: byte << 1 | bit, eight_bits)
-         for eight_bits in grouper(bits, 8, fillvalue=0)]
 
-oscillator_counts = [2, 4, 6, 8, 10]
-inverter_counts = [3, 5, 7, 9, 11]
+def _png_chunk(kind, data):
+    chunk = kind + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk))
 
-for osc_idx, osc_count in enumerate(oscillator_counts):
-    for inv_idx, inv_count in enumerate(inverter_counts):
-        dump = import_module(f'dump_weak_{osc_count}_{inv_count}')
+def write_png(filename, rows, width, bit_depth):
+    """Write a grayscale PNG from packed rows (one bytes row per image row)."""
+    rows = np.asarray(rows, dtype=np.uint8)
+    # filter type 0 (none) in front of every row
+    raw = np.hstack([np.zeros((len(rows), 1), dtype=np.uint8), rows]).tobytes()
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, len(rows), bit_depth, 0, 0, 0, 0)))
+        f.write(_png_chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(_png_chunk(b'IEND', b''))
 
-        metastable = dump.dump["soc_trng_metastable"]
+def render_mono(filename, bits, width, height):
+    """One pixel per sample, 1 is white, samples beyond the canvas are dropped."""
+    canvas = np.zeros(width * height, dtype=np.uint8)
+    bits = bits[:len(canvas)]
+    canvas[:len(bits)] = bits
+    write_png(filename, np.packbits(canvas.reshape(height, width), axis=1), width, 1)
 
-        with NamedTemporaryFile() as fp:
-            fp.write(bytes(bits2bytes(metastable[::2])))
-            fp.seek(0)
+def render_tiles(filename, bits, width, height):
+    """Render the whole capture on as many canvases as needed, tile N is written to
+    `filename` with a _N suffix added to its stem."""
+    filename = Path(filename)
+    tile_size = width * height
+    for tile, start in enumerate(range(0, len(bits), tile_size)):
+        tile_filename = filename.with_name(f'{filename.stem}_{tile}{filename.suffix}')
+        render_mono(tile_filename, bits[start:start+tile_size], width, height)
 
-            process = subprocess.run(['convert', '-depth', '1', '-size', '1000x320', 'mono:-', f'{osc_count}_{inv_count}.png'], 
-                                stdin=fp, capture_output=True)
+def render_downsampled(filename, bits, width, height, factor=None):
+    """Render the whole capture on one canvas, every pixel is the ratio of ones of a block
+    of factor x factor samples (the smallest factor fitting the canvas by default)."""
+    if not len(bits):
+        raise ValueError(f'cannot downsample an empty capture to {filename}')
+    if factor is None:
+        factor = max(int(np.ceil(np.sqrt(len(bits) / (width * height)))), 1)
+    rows = min(-(-len(bits) // (width * factor * factor)), height)
+    canvas = np.zeros(rows * factor * width * factor, dtype=np.uint16)
+    bits = bits[:len(canvas)]
+    canvas[:len(bits)] = bits
+    blocks = canvas.reshape(rows, factor, width, factor).sum(axis=(1, 3))
+    write_png(filename, (blocks * 255 // (factor * factor)).astype(np.uint8), width, 8)
+
+def _render(capture, signal, filename, mode, width, height, factor):
+    bits = load_signal(capture, signal).astype(np.uint8, copy=False)
+    if mode == 'tiles':
+        render_tiles(filename, bits, width, height)
+    elif mode == 'downsample':
+        render_downsampled(filename, bits, width, height, factor)
+    else:
+        render_mono(filename, bits, width, height)
+    return filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render TRNG noise captures as monochrome images")
+    parser.add_argument('--oscillators', type=int, nargs='+', default=[2, 4, 6, 8, 10], help='oscillator counts')
+    parser.add_argument('--inverters', type=int, nargs='+', default=[3, 5, 7, 9, 11], help='oscillator lengths')
+    parser.add_argument('--pattern', default='dump_weak_{oscillators}_{inverters}.py', help='capture (.lcap) or Python dump filename pattern')
+    parser.add_argument('--output', default='{oscillators}_{inverters}.png', help='image filename pattern')
+    parser.add_argument('--signal', default='soc_trng_metastable')
+    parser.add_argument('--size', default='1000x320', help='canvas size (WIDTHxHEIGHT)')
+    parser.add_argument('--mode', choices=['crop', 'tiles', 'downsample'], default='crop',
+        help='crop the capture to the canvas, render every canvas-sized tile, or downsample the whole capture')
+    parser.add_argument('--factor', type=int, default=None, help='downsampling factor (fit to the canvas by default)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split('x'))
+    grid = {'oscillators': args.oscillators, 'inverters': args.inverters}
+    configurations = [dict(zip(grid, values)) for values in product(*grid.values())]
+
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [
+            executor.submit(_render, args.pattern.format(**configuration), args.signal,
+                args.output.format(**configuration), args.mode, width, height, args.factor)
+            for configuration in configurations
+        ]
+        for future in futures:
+            print(future.result())
@@ -9,6 +9,7 @@ setup(name='litepuf',
       packages=['metastable'],
       install_requires=[
           'migen',
-          'litex'
+          'litex',
+          'numpy'
       ],
       zip_safe=False)